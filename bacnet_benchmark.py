@@ -0,0 +1,364 @@
+"""
+Loopback load generator and latency benchmark for the BACnet servers.
+
+Drives ReadProperty, ReadPropertyMultiple, WriteProperty and SubscribeCOV
+requests at fixed rates against either server, the way a BAS front end
+and a few controllers polling it would, and reports the p50 and p99
+response latency and the dropped requests of each service. Requests are
+started on a fixed schedule whether or not earlier ones were answered, so
+a stalled server shows up as latency and drops instead of a slower
+client.
+
+The load runs once per phase: "idle" waits until the server is not
+training, "training" writes active to the model-training BV so the
+server starts a training run on its next tick, or once it has stored
+enough readings to train on. The servers only serve that BV with
+--training-trigger, start one on loopback first, e.g.
+
+    cd bacpypes_three_version
+    python bacnet_server.py --address 127.0.0.1/8 --training-trigger
+    python ../bacnet_benchmark.py --target 127.0.0.1 --rp 50 --duration 60
+"""
+import asyncio
+import time
+
+import numpy as np
+
+from bacpypes3.debugging import ModuleLogger
+from bacpypes3.argparse import SimpleArgumentParser
+from bacpypes3.apdu import AbortPDU, ErrorRejectAbortNack, SubscribeCOVRequest
+from bacpypes3.app import Application
+from bacpypes3.basetypes import BinaryPV
+from bacpypes3.pdu import Address
+from bacpypes3.primitivedata import ObjectIdentifier, PropertyIdentifier
+
+_debug = 0
+_log = ModuleLogger(globals())
+
+CLIENT_ADDRESS = "127.0.0.1/8:47809"  # the servers listen on 47808
+CLIENT_INSTANCE = 599
+READ_OBJECTS = (
+    "analogValue,1",  # input-power-meter
+    "analogValue,2",  # one-hour-future-power
+    "analogValue,3",  # power-rate-of-change
+    "binaryValue,1",  # high-load-conditions
+    "binaryValue,2",  # low-load-conditions
+)
+WRITE_OBJECT = "analogValue,1"
+TRAINING_OBJECT = "binaryValue,3"  # model-training
+COV_LIFETIME = 300  # seconds, unused subscriptions expire on their own
+COV_PROCESSES = 32  # subscriber process ids reused, like resubscribing devices
+SERVER_TICK = 60.0  # the servers act on a training request once a tick
+MAX_OUTSTANDING = 240  # a BACnet peer has 256 invoke ids, past that drop
+
+PRESENT_VALUE = PropertyIdentifier("presentValue")
+STATUS_FLAGS = PropertyIdentifier("statusFlags")
+
+
+class OperationStats:
+    """
+    Outcome of every request of one service in one phase
+    """
+
+    def __init__(self):
+        self.latencies = []
+        self.dropped = 0
+        self.errors = 0
+
+    @property
+    def sent(self):
+        return len(self.latencies) + self.dropped + self.errors
+
+    def percentile(self, q):
+        """
+        Returns:
+        - float q-th percentile of the answered requests in milliseconds,
+          None if none were answered
+        """
+        if not self.latencies:
+            return None
+        return float(np.percentile(self.latencies, q)) * 1000.0
+
+
+class LoadGenerator:
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.target = Address(args.target)
+        self.read_objects = [ObjectIdentifier(o) for o in args.read_objects]
+        self.write_object = ObjectIdentifier(args.write_object)
+        self.training_object = ObjectIdentifier(args.training_object)
+        self.write_value = None
+        self.next_read = 0
+        self.next_cov = 0
+        self.subscriptions = set()
+        self.outstanding = 0
+
+    async def timed(self, request, stats):
+        """
+        Await `request()` and record its latency, a request that is not
+        answered within the timeout, is aborted or finds every invoke id
+        in use counts as dropped, an Error or Reject as an error
+        """
+        if self.outstanding >= MAX_OUTSTANDING:
+            stats.dropped += 1
+            return
+        self.outstanding += 1
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(request(), self.args.timeout)
+            if isinstance(response, ErrorRejectAbortNack):
+                raise response
+        except (asyncio.TimeoutError, AbortPDU):
+            stats.dropped += 1
+        except ErrorRejectAbortNack as e:
+            if _debug:
+                _log.debug("error response: %r", e)
+            stats.errors += 1
+        else:
+            stats.latencies.append(time.perf_counter() - started)
+        finally:
+            self.outstanding -= 1
+
+    async def drive(self, request, rate, stats):
+        """
+        Start `request` `rate` times a second for the phase duration
+        without waiting on the previous ones, then wait for the stragglers
+        """
+        if rate <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        pending = []
+        for i in range(int(rate * self.args.duration)):
+            delay = start + i / rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            pending.append(asyncio.create_task(self.timed(request, stats)))
+        await asyncio.gather(*pending)
+
+    async def read_property(self):
+        objid = self.read_objects[self.next_read % len(self.read_objects)]
+        self.next_read += 1
+        return await self.app.read_property(self.target, objid, PRESENT_VALUE)
+
+    async def read_property_multiple(self):
+        parameters = []
+        for objid in self.read_objects:
+            parameters.extend([objid, [PRESENT_VALUE, STATUS_FLAGS]])
+        return await self.app.read_property_multiple(self.target, parameters)
+
+    async def write_property(self):
+        # the value read before the run, the meter reading stays put
+        return await self.app.write_property(
+            self.target, self.write_object, PRESENT_VALUE, self.write_value
+        )
+
+    async def subscribe_cov(self):
+        objid = self.read_objects[self.next_cov % len(self.read_objects)]
+        process = self.next_cov % COV_PROCESSES + 1
+        self.next_cov += 1
+        self.subscriptions.add((process, objid))
+        return await self.app.request(
+            SubscribeCOVRequest(
+                subscriberProcessIdentifier=process,
+                monitoredObjectIdentifier=objid,
+                issueConfirmedNotifications=False,
+                lifetime=COV_LIFETIME,
+                destination=self.target,
+            )
+        )
+
+    async def cancel_subscriptions(self):
+        for process, objid in self.subscriptions:
+            try:
+                await self.app.request(
+                    SubscribeCOVRequest(
+                        subscriberProcessIdentifier=process,
+                        monitoredObjectIdentifier=objid,
+                        destination=self.target,
+                    )
+                )
+            except ErrorRejectAbortNack:
+                pass
+        self.subscriptions.clear()
+
+    async def is_training(self):
+        value = await self.app.read_property(
+            self.target, self.training_object, PRESENT_VALUE
+        )
+        if isinstance(value, ErrorRejectAbortNack):
+            raise value
+        return value == BinaryPV.active
+
+    async def wait_for_training(self, active):
+        """
+        Bring the server into the training state of a phase, a training
+        run is requested by writing active and starts on the next tick
+
+        Returns:
+        - bool True once the model-training BV reads `active`, False if
+          the server did not start training or is still training after
+          --training-wait seconds
+        """
+        if active:
+            if await self.is_training():
+                return True
+            await self.app.write_property(
+                self.target, self.training_object, PRESENT_VALUE, "active"
+            )
+            await asyncio.sleep(SERVER_TICK + 5.0)
+            return await self.is_training()
+
+        # a run already going, wait for it to finish
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.args.training_wait
+        while await self.is_training():
+            if loop.time() > deadline:
+                return False
+            await asyncio.sleep(1.0)
+        return True
+
+    async def watch_training(self, samples):
+        while True:
+            try:
+                samples.append(await self.is_training())
+            except ErrorRejectAbortNack:
+                pass
+            await asyncio.sleep(1.0)
+
+    async def run_phase(self):
+        """
+        Returns:
+        - tuple (dict of OperationStats by service, fraction of the phase
+          the server was training)
+        """
+        args = self.args
+        operations = {
+            "rp": (self.read_property, args.rp),
+            "rpm": (self.read_property_multiple, args.rpm),
+            "wp": (self.write_property, args.wp),
+            "cov": (self.subscribe_cov, args.cov),
+        }
+        stats = {name: OperationStats() for name in operations}
+        samples = []
+        watcher = asyncio.create_task(self.watch_training(samples))
+        try:
+            await asyncio.gather(
+                *(
+                    self.drive(request, rate, stats[name])
+                    for name, (request, rate) in operations.items()
+                )
+            )
+        finally:
+            watcher.cancel()
+        training = sum(samples) / len(samples) if samples else 0.0
+        return stats, training
+
+    async def run(self):
+        """
+        Returns:
+        - list of (phase, stats, training fraction), stats None for a
+          phase whose training state was never reached
+        """
+        self.write_value = await self.app.read_property(
+            self.target, self.write_object, PRESENT_VALUE
+        )
+        if isinstance(self.write_value, ErrorRejectAbortNack):
+            raise RuntimeError(f"cannot read {self.write_object}: {self.write_value}")
+
+        results = []
+        for phase in self.args.phases.split(","):
+            active = phase == "training"
+            _log.info("phase %s, waiting for training %s", phase, active)
+            try:
+                reached = await self.wait_for_training(active)
+            except ErrorRejectAbortNack as e:
+                # the server was started without --training-trigger
+                _log.warning("cannot read %s: %s", self.training_object, e)
+                reached = False
+            if not reached:
+                _log.warning("phase %s skipped, training state not reached", phase)
+                results.append((phase, None, None))
+                continue
+            _log.info("phase %s, running load for %ss", phase, self.args.duration)
+            stats, training = await self.run_phase()
+            results.append((phase, stats, training))
+        await self.cancel_subscriptions()
+        return results
+
+
+def format_report(results):
+    """
+    Returns:
+    - str table of sent, p50, p99, dropped and error counts per phase and
+      service
+    """
+    lines = [
+        f"{'phase':<10}{'service':<8}{'sent':>8}{'p50 ms':>10}{'p99 ms':>10}"
+        f"{'dropped':>9}{'errors':>8}"
+    ]
+    for phase, stats, training in results:
+        if stats is None:
+            lines.append(f"{phase:<10}skipped, training state not reached")
+            continue
+        for name, s in stats.items():
+            if not s.sent:
+                continue
+            p50, p99 = s.percentile(50), s.percentile(99)
+            lines.append(
+                f"{phase:<10}{name:<8}{s.sent:>8}"
+                f"{'-' if p50 is None else f'{p50:.1f}':>10}"
+                f"{'-' if p99 is None else f'{p99:.1f}':>10}"
+                f"{s.dropped:>9}{s.errors:>8}"
+            )
+        lines.append(f"{phase:<10}training active {training:.0%} of the phase")
+    return "\n".join(lines)
+
+
+async def main():
+    parser = SimpleArgumentParser()
+    parser.set_defaults(
+        address=CLIENT_ADDRESS, instance=CLIENT_INSTANCE, name="bacnet-benchmark"
+    )
+    parser.add_argument("--target", default="127.0.0.1", help="server address")
+    parser.add_argument("--rp", type=float, default=20.0, help="ReadProperty/s")
+    parser.add_argument(
+        "--rpm", type=float, default=5.0, help="ReadPropertyMultiple/s"
+    )
+    parser.add_argument("--wp", type=float, default=2.0, help="WriteProperty/s")
+    parser.add_argument("--cov", type=float, default=1.0, help="SubscribeCOV/s")
+    parser.add_argument(
+        "--duration", type=float, default=60.0, help="seconds of load per phase"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=5.0, help="seconds before a request drops"
+    )
+    parser.add_argument(
+        "--phases", default="idle,training", help="comma separated idle, training"
+    )
+    parser.add_argument(
+        "--training-wait",
+        type=float,
+        default=600.0,
+        help="seconds to wait for a running training to finish before idle",
+    )
+    parser.add_argument("--read-objects", nargs="+", default=list(READ_OBJECTS))
+    parser.add_argument(
+        "--write-object",
+        default=WRITE_OBJECT,
+        help="object whose presentValue is written back with the value it had",
+    )
+    parser.add_argument("--training-object", default=TRAINING_OBJECT)
+    args = parser.parse_args()
+
+    app = Application.from_args(args)
+    try:
+        results = await LoadGenerator(app, args).run()
+    finally:
+        app.close()
+    print(format_report(results))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,185 +1,614 @@
 import subprocess
 import configparser
-import csv
+import ast
+import os
 
 from bacpypes.debugging import bacpypes_debugging, ModuleLogger
 from bacpypes.consolelogging import ConfigArgumentParser
-from bacpypes.core import run
+from bacpypes.core import run, deferred
 from bacpypes.task import RecurringTask
 from bacpypes.app import BIPSimpleApplication
-from bacpypes.object import AnalogValueObject, register_object_type, BinaryValueObject
+from bacpypes.apdu import ReadRangeACK
+from bacpypes.basetypes import (
+    DateTime,
+    DeviceObjectPropertyReference,
+    LogRecord,
+    LogRecordLogDatum,
+)
+from bacpypes.constructeddata import ListOf, SequenceOfAny
+from bacpypes.errors import ExecutionError
+from bacpypes.object import (
+    AnalogValueObject,
+    register_object_type,
+    BinaryValueObject,
+    TrendLogObject,
+)
 from bacpypes.local.object import AnalogValueCmdObject
 from bacpypes.local.device import LocalDeviceObject
 from bacpypes.service.cov import ChangeOfValueServices
 from bacpypes.service.object import ReadWritePropertyMultipleServices
-from bacpypes.primitivedata import Real
+from bacpypes.primitivedata import Date, Real, Time
 
 import numpy as np
-import tensorflow as tf
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics import mean_squared_error
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, LSTM
-from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
-from datetime import datetime
+from collections import namedtuple
+from datetime import datetime, timedelta
+from math import isfinite
 import threading, time
 
+from diagnostics import StageTimers, prometheus_text, startup_report, write_textfile
+from forecasters import BatchPredictor, check_options, get_forecaster
+from history import GridResampler, HistoryBuffer, RollingStats, SlidingPercentiles
+from pipeline import AnalyticsWorker
+from registry import ModelRegistry
+from storage import BufferedHistoryWriter, EPOCH_SCALE, import_csv, open_history_store
+from training import TrainingWorker, run_training
+from trendlog import TrendSource, range_arguments, response_items, to_date_time
+
 _debug = 0
 _log = ModuleLogger(globals())
 
-register_object_type(AnalogValueCmdObject, vendor_id=999)
+
+@bacpypes_debugging
+class MonitoredAnalogValueCmdObject(AnalogValueCmdObject):
+    """
+    Commandable AV that reports every write of presentValue, with the
+    effective value after priority arbitration, to `_write_listener`
+    """
+
+    # private name, both stacks refuse to set attributes that are not properties
+    _write_listener = None
+
+    def WriteProperty(
+        self, property, value, arrayIndex=None, priority=None, direct=False
+    ):
+        result = super().WriteProperty(property, value, arrayIndex, priority, direct)
+        if property == "presentValue" and self._write_listener is not None:
+            self._write_listener(time.time(), float(self.presentValue))
+        return result
+
+
+register_object_type(MonitoredAnalogValueCmdObject, vendor_id=999)
+
+
+@bacpypes_debugging
+class HistoryTrendLogObject(TrendLogObject):
+    """
+    Trend log whose buffer is a HistoryBuffer of the forecast task, the
+    logBuffer is only readable with ReadRange
+    """
+
+    def __init__(self, source, **kwargs):
+        TrendLogObject.__init__(self, **kwargs)
+        self._source = source
+
+    def ReadProperty(self, propid, arrayIndex=None):
+        if propid == "bufferSize":
+            return self._source.capacity
+        if propid == "recordCount":
+            return len(self._source)
+        if propid == "totalRecordCount":
+            return self._source.total_count
+        if propid == "logBuffer":
+            raise ExecutionError(errorClass="property", errorCode="readAccessDenied")
+        return TrendLogObject.ReadProperty(self, propid, arrayIndex)
+
+    def read_log_buffer(self, by=None, reference=None, count=None, max_items=None):
+        """
+        Returns:
+        - tuple (records, first_sequence, flags) as TrendSource.read_range
+          with the records as LogRecords
+        """
+        records, first_sequence, flags = self._source.read_range(
+            by, reference, count, max_items
+        )
+        log_records = []
+        for timestamp, value in records:
+            date, time_of_day = to_date_time(timestamp)
+            log_records.append(
+                LogRecord(
+                    timestamp=DateTime(
+                        date=Date(date).value, time=Time(time_of_day).value
+                    ),
+                    logDatum=LogRecordLogDatum(realValue=value),
+                )
+            )
+        return log_records, first_sequence, flags
+
+
+register_object_type(HistoryTrendLogObject, vendor_id=999)
 
 INTERVAL = 60.0
 MODEL_TRAIN_HOUR = 0
 USE_CACHE_ON_START = True
-DAYS_TO_CACHE = 365 # modify later for SQLite db
+DAYS_TO_CACHE = 365  # retention of the history store
 LSTM_SEQUENCE_LENGTH = 120
+FORECASTER_ENGINE = "lstm"  # lstm, tree or ridge, [Forecaster] engine in the INI
+MODEL_REGISTRY_DIR = "models"  # versioned weights, scaler and metrics
+MODEL_VERSIONS_TO_KEEP = 5  # older versions are kept for rollback
+TRAINING_MODE = "process"  # or "thread" to train inside the BACnet process
+FULL_RETRAIN_EVERY_DAYS = 7  # fine-tune the previous model in between, 0 disables
+FINE_TUNE_RECENT_DAYS = 2  # newest data the nightly fine-tune trains on
+FINE_TUNE_REPLAY_WINDOWS = 1440  # older windows replayed alongside it
+HISTORY_BUFFER_SIZE = int(86400 / INTERVAL)  # one day, training reads the store
+PERCENTILE_WINDOW_DAYS = 30
+RATE_OF_CHANGE_WINDOW = 15  # samples in the rolling mean slope
+HISTORY_BACKEND = "columnar"  # or "sqlite"
+HISTORY_DIR = "history"
+HISTORY_DURABILITY = "flush"  # none, flush or fsync
+HISTORY_FLUSH_SAMPLES = 10  # a restart loses at most this many readings
+HISTORY_FLUSH_SECONDS = 600.0
+LEGACY_CSV_FILE = "data.csv"  # imported once into HISTORY_DIR if found
+INGEST_MODE = "poll"  # or "events" to record every write to input-power-meter
+WRITE_EVENTS_DIR = "write_events"  # raw timestamped writes in events mode
+WRITE_HOLD_SECONDS = 300.0  # a write counts this long, then minutes are gaps
+METER_INSTANCE_BLOCK = 100  # meter k numbers its objects from k * 100 + 1
+MAX_CONCURRENT_TRAINING = 1  # meters training at once, the rest wait a tick
+DIAGNOSTIC_INSTANCE_BASE = 9000  # process wide diagnostic AVs, clear of the meters
+METRICS_TEXTFILE = "opendsm.prom"  # for the node_exporter textfile collector, or None
 
 @bacpypes_debugging
 class SampleApplication(
     BIPSimpleApplication, ReadWritePropertyMultipleServices, ChangeOfValueServices
 ):
-    pass
+    def do_ReadRangeRequest(self, apdu):
+        """
+        Serve the log buffer of the history trend logs
+        """
+        obj = self.get_object_id(apdu.objectIdentifier)
+        if not obj:
+            raise ExecutionError(errorClass="object", errorCode="unknownObject")
+        if (
+            not isinstance(obj, HistoryTrendLogObject)
+            or apdu.propertyIdentifier != "logBuffer"
+        ):
+            raise ExecutionError(errorClass="property", errorCode="propertyIsNotAList")
+
+        try:
+            by, reference, count = range_arguments(apdu.range)
+        except ValueError:
+            # a reference time with wildcards or a special month or day
+            raise ExecutionError(errorClass="property", errorCode="valueOutOfRange")
+        # no more records than the requester takes in its APDUs and segments
+        max_items = response_items(
+            apdu.apduMaxResp,
+            apdu.apduMaxSegs,
+            apdu.apduSA
+            and self.localDevice.segmentationSupported
+            in ("segmentedTransmit", "segmentedBoth"),
+        )
+        try:
+            records, first_sequence, flags = obj.read_log_buffer(
+                by, reference, count, max_items
+            )
+        except ValueError:
+            raise ExecutionError(
+                errorClass="services", errorCode="parameterOutOfRange"
+            )
+
+        resp = ReadRangeACK(context=apdu)
+        resp.objectIdentifier = apdu.objectIdentifier
+        resp.propertyIdentifier = apdu.propertyIdentifier
+        resp.resultFlags = [int(flag) for flag in flags]
+        resp.itemCount = len(records)
+        resp.itemData = SequenceOfAny()
+        resp.itemData.cast_in(ListOf(LogRecord)(records))
+        if by in ("sequence", "time") and records:
+            resp.firstSequenceNumber = first_sequence
+        self.response(resp)
+
+
+# one meter's share of an analytics job, forecaster is None without a model
+MeterJob = namedtuple(
+    "MeterJob",
+    ("meter", "samples", "forecaster", "timestamp", "window", "latest_value"),
+)
+# what the analytics worker hands back for the core thread to publish
+MeterResult = namedtuple(
+    "MeterResult", ("meter", "forecast", "rate_of_change", "is_valley", "is_peak")
+)
+
+
+def meter_path(directory, name):
+    """
+    Returns:
+    - per meter sub directory of `directory`, the directory itself for
+      the unnamed meter of a single meter setup
+    """
+    return os.path.join(directory, name) if name else directory
 
 
 @bacpypes_debugging
 class DoDataScience(RecurringTask):
-    def __init__(
-        self,
-        interval,
-        input_power,
-        one_hr_future_pwr,
-        power_rate_of_change,
-        model_rsme,
-        model_training_time,
-        high_load_bv,
-        low_load_bv,
-    ):
+    """
+    Shared scheduler of all meters, run as a staged pipeline so the
+    bacpypes core thread only ingests and publishes:
+    1. Ingest, core thread: every meter stores its new readings and
+       decides on training, see PowerMeterForecast.prepare_forecast.
+    2. Analyze, worker thread: the rolling statistics take the new
+       readings and the input windows of the meters that have a model
+       are stacked and forecast in one batch.
+    3. Publish, core thread: the newest results are written to the AVs
+       and BVs as soon as the worker hands them back.
+    A tick that finds the worker still busy is coalesced, its readings
+    go out with the next job, as do the readings a failed job's
+    statistics did not get to; the reading they failed on is dropped.
+    Every stage is timed into `timers`, the cycle time and overruns,
+    cycles from tick to publish longer than the interval, are written to
+    the `diagnostics` AVs and METRICS_TEXTFILE after each publish.
+    """
+
+    def __init__(self, interval, meters, timers=None, diagnostics=None):
         super().__init__(interval * 1000)
         self.interval = interval
-        self.input_power = input_power
-        self.one_hr_future_pwr = one_hr_future_pwr
-        self.power_rate_of_change = power_rate_of_change
-        self.model_rsme = model_rsme
-        self.model_training_time = model_training_time
-        self.high_load_bv = high_load_bv
-        self.low_load_bv = low_load_bv
-        
-        self.power_forecast = PowerMeterForecast(
-            self.input_power,
-            self.one_hr_future_pwr,
-            self.power_rate_of_change,
-            self.model_rsme,
-            self.model_training_time,
-            self.high_load_bv,
-            self.low_load_bv,
-        )
+        self.meters = meters
+        self.predictor = BatchPredictor()
+        self.timers = timers or StageTimers()
+        self.diagnostics = diagnostics or {}
+        self.overruns = 0
+
         if USE_CACHE_ON_START:
-            _log.debug(f"USE_CACHE_ON_START True - Starting CSV file data loading.")
-            self.power_forecast.load_data_from_csv(on_start=True)
+            _log.debug(f"USE_CACHE_ON_START True - Starting history store loading.")
+            for meter in self.meters:
+                meter.load_history_from_store()
         else:
-            _log.debug(f"USE_CACHE_ON_START False - Skipping CSV file data loading.")
+            _log.debug(f"USE_CACHE_ON_START False - Skipping history store loading.")
+
+        # started after the warm up, from here on the worker owns the
+        # rolling statistics of every meter
+        self.worker = AnalyticsWorker(
+            self.analyze, on_result=lambda: deferred(self.publish)
+        )
 
     def process_task(self):
-        if _debug:
-            _log.debug("input_power: %s", self.input_power.presentValue)
-            _log.debug("one_hr_future_pwr: %s", self.one_hr_future_pwr.presentValue)
-            _log.debug(
-                "power_rate_of_change: %s", self.power_rate_of_change.presentValue
+        # anything the deferred publish has not picked up yet
+        self.publish()
+
+        # readings a failed job did not get to go out again, oldest first
+        failed = self.worker.failed.take()
+        if failed is not None:
+            for entry in failed[1]:
+                entry.meter.pending_samples[:0] = entry.samples
+
+        started = time.perf_counter()
+        with self.timers.stage("ingest"):
+            ready = set()
+            # the meter whose last scheduled training started first gets the
+            # next free training slot, so none waits behind the others
+            for meter in sorted(self.meters, key=lambda m: m.last_scheduled_training):
+                training = sum(m.model_is_training for m in self.meters)
+                if meter.prepare_forecast(training < MAX_CONCURRENT_TRAINING):
+                    ready.add(meter)
+
+            # one read of each bundle, whichever engine it holds is used whole
+            job = [
+                MeterJob(
+                    meter,
+                    meter.pending_samples,
+                    meter.serving.forecaster if meter in ready else None,
+                    meter.history.last()[0] if meter in ready else None,
+                    # copied, the ring keeps taking readings while the
+                    # worker forecasts
+                    (
+                        meter.history.values(meter.sequence_length).copy()
+                        if meter in ready
+                        else None
+                    ),
+                    meter.latest_value,
+                )
+                for meter in self.meters
+            ]
+        if self.worker.submit((started, job)):
+            for meter in self.meters:
+                meter.pending_samples = []
+        else:
+            _log.warning(
+                "Analytics still running, tick coalesced (%d so far)",
+                self.worker.coalesced,
             )
-            _log.debug("high_load_bv: %s", self.high_load_bv.presentValue)
-            _log.debug("low_load_bv: %s", self.low_load_bv.presentValue)
 
-        self.power_forecast.run_forecasting_cycle()
+    def analyze(self, job):
+        """
+        Analytics stage, runs on the worker thread
+
+        Returns:
+        - tuple (perf_counter time the tick started, list of MeterResult
+          of the meters forecast)
+        """
+        started, job = job
+        with self.timers.stage("statistics"):
+            for entry in job:
+                entry.meter.update_statistics(entry.samples)
+
+        ready = [entry for entry in job if entry.forecaster is not None]
+        if not ready:
+            return started, []
+
+        with self.timers.stage("predict"):
+            forecasts = self.predictor.predict(
+                [entry.forecaster for entry in ready],
+                [entry.timestamp for entry in ready],
+                np.stack([entry.window for entry in ready]),
+            )
+        _log.debug(
+            "Forecast %d of %d meters in one batch", len(ready), len(self.meters)
+        )
+
+        results = []
+        for entry, forecast in zip(ready, forecasts):
+            meter = entry.meter
+            with self.timers.stage("rate_of_change"):
+                rate_of_change = meter.calc_power_rate_of_change()
+            with self.timers.stage("percentiles"):
+                is_valley, is_peak = meter.check_percentiles(entry.latest_value)
+            results.append(
+                MeterResult(
+                    meter, float(forecast[-1]), rate_of_change, is_valley, is_peak
+                )
+            )
+        return started, results
+
+    def publish(self):
+        """
+        Publish stage, runs on the core thread
+        """
+        handed_back = self.worker.results.take()
+        if handed_back is None:
+            return
+        started, results = handed_back
+        with self.timers.stage("publish"):
+            for result in results:
+                result.meter.apply_forecast(result)
+        cycle_time = time.perf_counter() - started
+        self.timers.observe("cycle", cycle_time)
+        if cycle_time > self.interval:
+            self.overruns += 1
+        self.report_diagnostics()
+
+    def report_diagnostics(self):
+        cycle = self.timers.histogram("cycle")
+        values = {
+            "cycle_time": cycle.last,
+            "max_cycle_time": cycle.recent_max(),
+            "overrun_count": self.overruns,
+        }
+        for key, value in values.items():
+            if key in self.diagnostics:
+                self.diagnostics[key].presentValue = Real(value)
+
+        if not METRICS_TEXTFILE:
+            return
+        try:
+            write_textfile(
+                METRICS_TEXTFILE,
+                prometheus_text(
+                    self.timers,
+                    [
+                        ("cycle_seconds", "gauge", "Last cycle time.", cycle.last),
+                        (
+                            "cycle_max_seconds",
+                            "gauge",
+                            f"Longest of the last {cycle.window} cycles.",
+                            cycle.recent_max(),
+                        ),
+                        (
+                            "cycle_overruns_total",
+                            "counter",
+                            "Cycles that took longer than INTERVAL.",
+                            self.overruns,
+                        ),
+                        (
+                            "ticks_coalesced_total",
+                            "counter",
+                            "Ticks coalesced while the previous one was running.",
+                            self.worker.coalesced,
+                        ),
+                    ],
+                ),
+            )
+        except OSError as e:
+            _log.error(f"Could not write metrics to {METRICS_TEXTFILE}: {e}")
+
+    def close(self):
+        self.worker.stop()
 
 
 class BacnetServer:
-    def __init__(self, ini_file, address):
+    def __init__(
+        self, ini_file, address, forecaster=None, meters=("",), training_trigger=False
+    ):
         self.this_device = LocalDeviceObject(ini=ini_file)
         self.app = SampleApplication(self.this_device, address)
+        # a writable BV lets any BACnet client start training, benchmarks only
+        self.training_trigger = training_trigger
+
+        self.timers = StageTimers()
+        self.meters = []
+        self.trend_logs = []
+        for index, name in enumerate(meters):
+            objects = self.add_meter_objects(index, name)
+            meter = PowerMeterForecast(
+                **objects, name=name, forecaster=forecaster, timers=self.timers
+            )
+            if INGEST_MODE == "events":
+                objects["input_power"]._write_listener = meter.record_write
+            self.add_trend_logs(index, meter)
+            self.meters.append(meter)
 
-        self.input_power = AnalogValueCmdObject(
-            objectIdentifier=("analogValue", 1),
-            objectName="input-power-meter",
-            presentValue=-1.0,
-            statusFlags=[0, 0, 0, 0],
-            covIncrement=1.0,
-            description="writeable input for app buildings electricity power value",
-        )
-        self.app.add_object(self.input_power)
-
-        self.one_hr_future_pwr = AnalogValueObject(
-            objectIdentifier=("analogValue", 2),
-            objectName="one-hour-future-power",
-            presentValue=-1.0,
-            statusFlags=[0, 0, 0, 0],
-            covIncrement=1.0,
-            description="electrical power one hour into the future",
-        )
-        self.app.add_object(self.one_hr_future_pwr)
-
-        self.power_rate_of_change = AnalogValueObject(
-            objectIdentifier=("analogValue", 3),
-            objectName="power-rate-of-change",
-            presentValue=-1.0,
-            statusFlags=[0, 0, 0, 0],
-            covIncrement=1.0,
-            description="current electrical power rate of change",
-        )
-        self.app.add_object(self.power_rate_of_change)
-        
-        self.model_rsme = AnalogValueObject(
-            objectIdentifier=("analogValue", 4),
-            objectName="model-rsme",
-            presentValue=-1.0,
-            statusFlags=[0, 0, 0, 0],
-            covIncrement=1.0,
-            description="root mean squared error of models accuracy",
-        )
-        self.app.add_object(self.model_rsme)
-
-        self.model_training_time = AnalogValueObject(
-            objectIdentifier=("analogValue", 5),
-            objectName="model-training-time",
-            presentValue=-1.0,
-            statusFlags=[0, 0, 0, 0],
-            covIncrement=1.0,
-            description="model training time in minutes",
-        )
-        self.app.add_object(self.model_training_time)
-
-        self.high_load_bv = BinaryValueObject(
-            objectIdentifier=("binaryValue", 1),
-            objectName="high-load-conditions",
-            presentValue="inactive",
-            statusFlags=[0, 0, 0, 0],
-            description="peak power usage detected, shed loads if possible",
-        )
-        self.app.add_object(self.high_load_bv)
-
-        self.low_load_bv = BinaryValueObject(
-            objectIdentifier=("binaryValue", 2),
-            objectName="low-load-conditions",
-            presentValue="inactive",
-            statusFlags=[0, 0, 0, 0],
-            description="low power usage detected, charge TES or battery okay",
-        )
-        self.app.add_object(self.low_load_bv)
-
+        self.diagnostics = self.add_diagnostic_objects()
         self.task = DoDataScience(
-            INTERVAL,
-            self.input_power,
-            self.one_hr_future_pwr,
-            self.power_rate_of_change,
-            self.model_rsme,
-            self.model_training_time,
-            self.high_load_bv,
-            self.low_load_bv,
+            INTERVAL, self.meters, timers=self.timers, diagnostics=self.diagnostics
         )
         self.task.install_task()
 
+    def add_meter_objects(self, index, name):
+        """
+        Create the AVs and BVs of one meter. Meter `index` numbers its
+        objects from index * METER_INSTANCE_BLOCK + 1 and prefixes their
+        names with its `name`, so the first meter of an unnamed setup
+        keeps the original object names and instances. The model-training
+        BV is only created with `training_trigger`.
+
+        Returns:
+        - dict of the objects by PowerMeterForecast argument name
+        """
+        base = index * METER_INSTANCE_BLOCK
+        prefix = f"{name}-" if name else ""
+        objects = {
+            "input_power": MonitoredAnalogValueCmdObject(
+                objectIdentifier=("analogValue", base + 1),
+                objectName=f"{prefix}input-power-meter",
+                presentValue=-1.0,
+                statusFlags=[0, 0, 0, 0],
+                covIncrement=1.0,
+                description="writeable input for app buildings electricity power value",
+            ),
+            "one_hr_future_pwr": AnalogValueObject(
+                objectIdentifier=("analogValue", base + 2),
+                objectName=f"{prefix}one-hour-future-power",
+                presentValue=-1.0,
+                statusFlags=[0, 0, 0, 0],
+                covIncrement=1.0,
+                description="electrical power one hour into the future",
+            ),
+            "power_rate_of_change": AnalogValueObject(
+                objectIdentifier=("analogValue", base + 3),
+                objectName=f"{prefix}power-rate-of-change",
+                presentValue=-1.0,
+                statusFlags=[0, 0, 0, 0],
+                covIncrement=1.0,
+                description="current electrical power rate of change",
+            ),
+            "model_rsme": AnalogValueObject(
+                objectIdentifier=("analogValue", base + 4),
+                objectName=f"{prefix}model-rsme",
+                presentValue=-1.0,
+                statusFlags=[0, 0, 0, 0],
+                covIncrement=1.0,
+                description="root mean squared error of models accuracy",
+            ),
+            "model_training_time": AnalogValueObject(
+                objectIdentifier=("analogValue", base + 5),
+                objectName=f"{prefix}model-training-time",
+                presentValue=-1.0,
+                statusFlags=[0, 0, 0, 0],
+                covIncrement=1.0,
+                description="model training time in minutes",
+            ),
+            "high_load_bv": BinaryValueObject(
+                objectIdentifier=("binaryValue", base + 1),
+                objectName=f"{prefix}high-load-conditions",
+                presentValue="inactive",
+                statusFlags=[0, 0, 0, 0],
+                description="peak power usage detected, shed loads if possible",
+            ),
+            "low_load_bv": BinaryValueObject(
+                objectIdentifier=("binaryValue", base + 2),
+                objectName=f"{prefix}low-load-conditions",
+                presentValue="inactive",
+                statusFlags=[0, 0, 0, 0],
+                description="low power usage detected, charge TES or battery okay",
+            ),
+        }
+        if self.training_trigger:
+            objects["model_training_bv"] = BinaryValueObject(
+                objectIdentifier=("binaryValue", base + 3),
+                objectName=f"{prefix}model-training",
+                presentValue="inactive",
+                statusFlags=[0, 0, 0, 0],
+                description="model training running, write active to train now",
+            )
+        for obj in objects.values():
+            self.app.add_object(obj)
+        return objects
+
+    def add_diagnostic_objects(self):
+        """
+        Read-only AVs with the health of the shared forecasting cycle
+
+        Returns:
+        - dict of the objects by DoDataScience diagnostics key
+        """
+        objects = {
+            "cycle_time": AnalogValueObject(
+                objectIdentifier=("analogValue", DIAGNOSTIC_INSTANCE_BASE + 1),
+                objectName="cycle-time",
+                presentValue=-1.0,
+                statusFlags=[0, 0, 0, 0],
+                covIncrement=0.1,
+                description="seconds from tick to published outputs, last cycle",
+            ),
+            "max_cycle_time": AnalogValueObject(
+                objectIdentifier=("analogValue", DIAGNOSTIC_INSTANCE_BASE + 2),
+                objectName="max-cycle-time",
+                presentValue=-1.0,
+                statusFlags=[0, 0, 0, 0],
+                covIncrement=0.1,
+                description="longest cycle time in seconds over the last day",
+            ),
+            "overrun_count": AnalogValueObject(
+                objectIdentifier=("analogValue", DIAGNOSTIC_INSTANCE_BASE + 3),
+                objectName="cycle-overruns",
+                presentValue=0.0,
+                statusFlags=[0, 0, 0, 0],
+                covIncrement=1.0,
+                description="forecasting cycles that took longer than the interval",
+            ),
+        }
+        for obj in objects.values():
+            self.app.add_object(obj)
+        return objects
+
+    def add_trend_logs(self, index, meter):
+        """
+        In-memory history of a meter's input and outputs as TrendLogs,
+        read by front ends with ReadRange
+        """
+        base = index * METER_INSTANCE_BLOCK
+        for instance, (logged, history) in enumerate(
+            (
+                (meter.input_power, meter.history),
+                (meter.one_hr_future_pwr, meter.forecast_history),
+                (meter.power_rate_of_change, meter.rate_of_change_history),
+            ),
+            start=base + 1,
+        ):
+            trend_log = HistoryTrendLogObject(
+                TrendSource(history),
+                objectIdentifier=("trendLog", instance),
+                objectName=f"{logged.objectName}-trend",
+                description=f"history of {logged.objectName}",
+                enable=True,
+                stopWhenFull=False,
+                loggingType="polled",
+                logInterval=int(INTERVAL * 100),
+                logDeviceObjectProperty=DeviceObjectPropertyReference(
+                    objectIdentifier=logged.objectIdentifier,
+                    propertyIdentifier="presentValue",
+                ),
+                statusFlags=[0, 0, 0, 0],
+                eventState="normal",
+            )
+            self.app.add_object(trend_log)
+            self.trend_logs.append(trend_log)
+
+    def announce(self):
+        """
+        Broadcast an I-Am as soon as the stack is running, nothing heavier
+        than numpy is imported before this point, TensorFlow only loads in
+        the training process
+        """
+        self.app.i_am()
+        _log.info("I-Am sent %s", startup_report())
+
     def run(self):
-        run()
+        deferred(self.announce)
+        try:
+            run()
+        finally:
+            self.task.close()
+            # write out the readings still batched in memory
+            for meter in self.meters:
+                meter.close()
 
 
 class PowerMeterForecast:
@@ -192,7 +621,15 @@ class PowerMeterForecast:
         model_training_time,
         high_load_bv,
         low_load_bv,
+        model_training_bv=None,
+        name="",
+        forecaster=None,
+        timers=None,
     ):
+        # each meter keeps its history, events and models in its own folder
+        self.name = name
+        self.history_dir = meter_path(HISTORY_DIR, name)
+        self.registry_dir = meter_path(MODEL_REGISTRY_DIR, name)
         self.input_power = input_power
         self.one_hr_future_pwr = one_hr_future_pwr
         self.power_rate_of_change = power_rate_of_change
@@ -200,36 +637,108 @@ class PowerMeterForecast:
         self.model_training_time = model_training_time
         self.high_load_bv = high_load_bv
         self.low_load_bv = low_load_bv
+        self.model_training_bv = model_training_bv
+        # stage durations, shared with the scheduler when it passes them in
+        self.timers = timers or StageTimers()
 
         self.data_is_available = False
-        self.data_cache = [] # very small holds LSTM seq data only
+        # preallocated ring of readings, the binary store is the durable log
+        self.history = HistoryBuffer(HISTORY_BUFFER_SIZE)
+        # published outputs, kept only for the trend logs
+        self.forecast_history = HistoryBuffer(HISTORY_BUFFER_SIZE)
+        self.rate_of_change_history = HistoryBuffer(HISTORY_BUFFER_SIZE)
+        self.store = BufferedHistoryWriter(
+            open_history_store(
+                HISTORY_BACKEND,
+                self.history_dir,
+                retention_days=DAYS_TO_CACHE,
+                durability=HISTORY_DURABILITY,
+            ),
+            max_samples=HISTORY_FLUSH_SAMPLES,
+            max_delay=HISTORY_FLUSH_SECONDS,
+        )
+        self.percentile_window = SlidingPercentiles(
+            PERCENTILE_WINDOW_DAYS * 86400,
+            expected_size=int(PERCENTILE_WINDOW_DAYS * 86400 / INTERVAL),
+        )
+        self.power_stats = RollingStats(window=RATE_OF_CHANGE_WINDOW)
+        # readings stored since the last analytics job, the statistics
+        # above are updated on the analytics worker
+        self.pending_samples = []
+
+        # events mode: every BAS write is logged, the minute grid is resampled
+        self.resampler = GridResampler(INTERVAL, max_hold=WRITE_HOLD_SECONDS)
+        self.write_events = None
+        if INGEST_MODE == "events":
+            self.write_events = BufferedHistoryWriter(
+                open_history_store(
+                    HISTORY_BACKEND,
+                    meter_path(WRITE_EVENTS_DIR, name),
+                    retention_days=DAYS_TO_CACHE,
+                    durability=HISTORY_DURABILITY,
+                ),
+                max_samples=HISTORY_FLUSH_SAMPLES,
+                max_delay=HISTORY_FLUSH_SECONDS,
+            )
 
         self.current_power_last_15mins_avg_rate_of_change = None
         self.current_power_lv_rate_of_change = None
         self.forecasted_value_60 = None
+        self.latest_value = None  # reading the pending forecast was made from
         self.is_valley = None
         self.is_peak = None
         self.peak_valley_last_adjustment_time = None
         self.peak_valley_req_time_delta = 900  # seconds
 
+        # engine name and its training options, see read_forecaster_settings
+        self.forecaster = forecaster or {"engine": FORECASTER_ENGINE, "options": {}}
+
         # Sequence lengths to experiment with in LSTM
         self.sequence_length = LSTM_SEQUENCE_LENGTH
         self.best_mse = float("inf")
         self.rmse = 0
-        self.scaler = MinMaxScaler(feature_range=(0, 1))
-        self.model = None
+        self.registry = ModelRegistry(
+            self.registry_dir, keep_versions=MODEL_VERSIONS_TO_KEEP
+        )
+        # (version, model, scaler, metadata) replaced as one immutable
+        # bundle, a forecast never pairs a model with another run's scaler
+        self.serving = None
+        self.model_restore_pending = True
+        self.training_worker = TrainingWorker()
         self.last_train_time = None
-        self.training_started_today = False
         self.total_training_time_minutes = 0
         self.model_train_hour = MODEL_TRAIN_HOUR
+        # start of the last scheduled run, the first one is due at the
+        # next train hour after startup
+        self.last_scheduled_training = datetime.now()
+        # written to the model-training BV, kept until a run starts
+        self.training_requested = False
         self.model_is_training = False
 
+    @property
+    def model_is_training(self):
+        return self._model_is_training
+
+    @model_is_training.setter
+    def model_is_training(self, value):
+        self._model_is_training = value
+        if self.model_training_bv is not None:
+            self.model_training_bv.presentValue = "active" if value else "inactive"
+
+    def close(self):
+        self.training_worker.terminate()
+        self.store.close()
+        if self.write_events is not None:
+            self.write_events.close()
+
     def set_one_hr_future_pwr(self, value):
         self.one_hr_future_pwr.presentValue = Real(value)
+        self.forecast_history.append(time.time(), value)
         _log.debug("one_hr_future_pwr: %s", self.one_hr_future_pwr.presentValue)
 
     def set_power_rate_of_change(self, value):
         self.power_rate_of_change.presentValue = Real(value)
+        self.rate_of_change_history.append(time.time(), value)
         _log.debug("power_rate_of_change: %s", self.power_rate_of_change.presentValue)
         
     def set_model_rsme(self, value):
@@ -255,7 +764,7 @@ class PowerMeterForecast:
         return self.one_hr_future_pwr.presentValue
 
     def get_if_a_model_is_available(self):
-        return self.model is not None
+        return self.serving is not None
 
     def get_power_rate_of_change(self):
         return self.power_rate_of_change.presentValue
@@ -286,44 +795,62 @@ class PowerMeterForecast:
             # Update the last adjustment time
             self.peak_valley_last_adjustment_time = datetime.now()
 
-    def save_all_data_to_csv(self, filename="data.csv"):
-        with open(filename, "w", newline="") as csvfile:
-            writer = csv.writer(csvfile)
-            for data in self.data_cache:
-                timestamp, value = data
-                row = [timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"), value]
-                writer.writerow(row)
+    def import_legacy_csv(self, filename=LEGACY_CSV_FILE):
+        """
+        One time conversion of a data.csv log from older versions into
+        the unnamed meter, skipped once the history store holds any data
+        """
+        if self.name or len(self.store) or not os.path.exists(filename):
+            return 0
 
-    def save_a_row_of_data_to_csv(self, timestamp, new_data, filename="data.csv"):
-        with open(filename, "a", newline="") as csvfile:
-            writer = csv.writer(csvfile)
-            row = [timestamp.strftime("%Y-%m-%d %H:%M:%S.%f"), new_data]
-            writer.writerow(row)
+        try:
+            imported = import_csv(filename, self.store)
+            _log.debug(
+                f"Imported {imported} rows from '{filename}' into '{self.history_dir}'"
+            )
+            return imported
+        except Exception as e:
+            _log.error(f"Error importing data from CSV: {e}")
+            return 0
 
-    def load_data_from_csv(self, filename="data.csv", on_start=False):
-        local_cache = []
+    def load_history_from_store(self):
+        """
+        Warm the in-memory history and percentile window from the
+        history store so ticks never have to read it back
+        """
+        self.import_legacy_csv()
 
+        # Read from the tail of the store only, boot cost is bounded by the
+        # forecast input and percentile windows instead of the whole history
         try:
-            with open(filename, "r") as csvfile:
-                reader = csv.reader(csvfile)
-                for row in reader:
-                    timestamp = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S.%f")
-                    value = row[1]
-                    local_cache.append((timestamp, value))
-        except FileNotFoundError:
-            _log.debug(f"CSV file '{filename}' not found. Skipping data loading.")
+            timestamps, values = self.store.tail(self.history.capacity)
+            if len(timestamps):
+                window_start = int(timestamps[-1]) - int(
+                    self.percentile_window.window_seconds * EPOCH_SCALE
+                )
+                window_timestamps, window_values = self.store.read_range(
+                    start=window_start
+                )
         except Exception as e:
-            _log.error(f"Error loading data from CSV: {e}")
+            _log.error(f"Error loading data from history store: {e}")
+            return
 
-        # Check if data is available based on the sequence length
-        self.data_is_available = len(local_cache) >= self.sequence_length
+        self.history.clear()
+        self.history.extend(timestamps / EPOCH_SCALE, values)
+        self.data_is_available = len(self.history) >= self.sequence_length
 
-        if on_start:
-            # Fill self.data_cache with the last 120 floats
-            if len(local_cache) >= self.sequence_length:
-                self.data_cache = local_cache[-self.sequence_length:]
+        warm_up = self.power_stats.window + 1
+        for timestamp, value in zip(
+            self.history.timestamps(warm_up).tolist(),
+            self.history.values(warm_up).tolist(),
+        ):
+            self.power_stats.update(timestamp, value)
 
-        return local_cache
+        if len(self.history):
+            for timestamp, value in zip(
+                (window_timestamps / EPOCH_SCALE).tolist(), window_values.tolist()
+            ):
+                self.percentile_window.push(timestamp, value)
 
     def poll_sensor_data(self, sensor_reading=None):
         sensor_reading = self.get_input_power()
@@ -331,20 +858,58 @@ class PowerMeterForecast:
             return datetime.now(), sensor_reading
         return None, None
 
-    def fetch_and_store_data(self):
-        timestamp, new_data = self.poll_sensor_data()
-
-        if timestamp is None:
-            return False
-
-        self.data_cache.append((timestamp, new_data))
-
-        if len(self.data_cache) > self.sequence_length:
-            self.data_cache = self.data_cache[-self.sequence_length :]
-
-        self.save_a_row_of_data_to_csv(timestamp, new_data)
+    def record_write(self, timestamp, value):
+        """
+        Called by input-power-meter on every write in events mode
+        """
+        if not isfinite(value):
+            _log.warning("Input power %r not recorded", value)
+            return
+        self.write_events.append(timestamp, value)
+        self.resampler.add(timestamp, value)
 
-        return True
+    def fetch_and_store_data(self):
+        with self.timers.stage("fetch"):
+            if INGEST_MODE == "events":
+                # time weighted minute means of the writes, minutes the BAS
+                # stopped writing for are left out instead of repeated
+                samples = [
+                    (timestamp, mean)
+                    for timestamp, mean, _, _ in self.resampler.close(time.time())
+                ]
+            else:
+                timestamp, new_data = self.poll_sensor_data()
+                if timestamp is None:
+                    return False
+                if not isfinite(new_data):
+                    _log.warning("Input power %r not stored", new_data)
+                    return False
+                samples = [(timestamp, float(new_data))]
+
+        with self.timers.stage("store"):
+            for timestamp, value in samples:
+                self.history.append(timestamp, value)
+                self.pending_samples.append((timestamp, value))
+                self.store.append(timestamp, value)
+        self.data_is_available = len(self.history) >= self.sequence_length
+
+        return bool(samples)
+
+    def update_statistics(self, samples):
+        """
+        Push readings into the percentile window and rolling stats, called
+        on the analytics worker with the readings of one job. Readings are
+        removed from `samples` as they are taken, one that raises included,
+        so a failed job only leaves the readings after it to retry.
+        """
+        taken = 0
+        try:
+            for timestamp, value in samples:
+                taken += 1
+                self.percentile_window.push(timestamp, value)
+                self.power_stats.update(timestamp, value)
+        finally:
+            del samples[:taken]
 
     def calc_power_rate_of_change(self):
         """
@@ -355,43 +920,13 @@ class PowerMeterForecast:
         - float
         """
 
-        # Load ALL data from the CSV source
-        data = self.load_data_from_csv()
-
-        if len(data) < 2:
+        # Slopes are maintained incrementally as each reading is stored
+        if len(self.power_stats) < 2:
             return 0.0  # Not enough data points to calculate rate of change
 
-        timestamps = [item[0] for item in data]
-        y_values = [
-            float(item[1]) for item in data
-        ]  # Convert y_values to float
-
-        # Convert timestamps to datetime objects
-        timestamps = [
-            ts
-            if isinstance(ts, datetime)
-            else datetime.strptime(ts, "%Y-%m-%d %H:%M:%S.%f")
-            for ts in timestamps
-        ]
-
-        # Calculate time differences in seconds
-        time_diffs = [
-            (timestamps[i] - timestamps[i - 1]).total_seconds()
-            for i in range(1, len(timestamps))
-        ]
-
-        # Calculate rate of change
-        gradient = np.diff(y_values)
-        current_rate_of_change = gradient[-1] / time_diffs[-1]
-
-        if len(time_diffs) >= 15:
-            avg_rate_of_change = (gradient[-1] - gradient[-15]) / sum(time_diffs[-15:])
-        else:
-            avg_rate_of_change = current_rate_of_change
-
-        self.current_power_last_15mins_avg = avg_rate_of_change
-        self.current_power_lv_rate_of_change = current_rate_of_change
-        return current_rate_of_change
+        self.current_power_last_15mins_avg_rate_of_change = self.power_stats.mean_slope
+        self.current_power_lv_rate_of_change = self.power_stats.slope
+        return self.current_power_lv_rate_of_change
 
     def check_percentiles(self, current_value):
         """
@@ -402,18 +937,12 @@ class PowerMeterForecast:
         Returns:
         - bool of percentiles of cached data
         """
-        # Load ALL data from the CSV source
-        data = self.load_data_from_csv()
-        
-        if len(data) < 2:
+        if len(self.percentile_window) < 2:
             return False, False  # Not enough data points to calculate percentiles
 
-        # Extract y-values directly without dealing with timestamps
-        y_values = [float(item[1]) for item in data]  # Updated line
-
-        # Calculate percentiles using numpy
-        percentile_30 = np.percentile(y_values, 30)
-        percentile_90 = np.percentile(y_values, 90)
+        # Order statistics are maintained incrementally over the trailing window
+        percentile_30 = self.percentile_window.percentile(30)
+        percentile_90 = self.percentile_window.percentile(90)
 
         # Calculate percentiles relative to the current value
         is_below_30th = current_value < percentile_30
@@ -421,178 +950,223 @@ class PowerMeterForecast:
 
         return is_below_30th, is_above_90th
 
-    def scale_data(self):
+    def training_config(self):
+        """
+        Everything the training pipeline needs to find the data, plain
+        values only so it can be handed to a spawned process
+        """
+        return {
+            "backend": HISTORY_BACKEND,
+            "directory": self.history_dir,
+            "seq_length": self.sequence_length,
+            "pred_length": 60,
+            "engine": self.forecaster["engine"],
+            "engine_options": self.forecaster["options"],
+            "registry": self.registry_dir,
+            "keep_versions": MODEL_VERSIONS_TO_KEEP,
+            "full_retrain_days": FULL_RETRAIN_EVERY_DAYS,
+            "recent_windows": int(FINE_TUNE_RECENT_DAYS * 86400 / INTERVAL),
+            "replay_windows": FINE_TUNE_REPLAY_WINDOWS,
+        }
+
+    def latest_train_hour(self, now):
         """
-        Scale the input data using the MinMaxScaler for LSTM training
-
         Returns:
-        - scaled_data: Scaled data
+        - datetime of the latest train hour at or before `now`
         """
-        _log.debug("scale data hit")
-        
-        data = self.load_data_from_csv()
-
-        # Extract float values
-        float_values = [float(item[1]) for item in data]
-
-        # Scale float values
-        float_values_array = np.array(float_values).reshape(-1, 1)
-        self.scaler_float = MinMaxScaler()  # Store the scaler as an instance attribute
-        scaled_float_values = self.scaler_float.fit_transform(float_values_array)
-
-        _log.debug(
-            f"scaled_float_values shape: {scaled_float_values.shape}, \
-            scaled_float_values type: {type(scaled_float_values)}"
+        train_hour = now.replace(
+            hour=self.model_train_hour, minute=0, second=0, microsecond=0
         )
+        if train_hour > now:
+            train_hour -= timedelta(days=1)
+        return train_hour
 
-        return scaled_float_values
-
-    def create_dataset(self, data, seq_length, pred_length):
+    def training_due(self, now):
         """
-        Called when LSTM is trained
-        Saves data to CSV format
-
         Returns:
-        - numpy arrays of X, y
+        - bool True once a train hour has passed since the last scheduled
+          run, a meter stays due until a training slot is free for it
         """
-        _log.debug(f"data shape: {data.shape}, data type: {type(data)}")
-        
-        X, y = [], []
-        for i in range(seq_length, len(data) - pred_length):
-            X.append(data[i - seq_length : i, 0])
-            y.append(data[i : i + pred_length, 0])
+        return self.last_scheduled_training < self.latest_train_hour(now)
 
-        dataX = np.array(X)
-        dataY = np.array(y)
+    def start_model_training(self):
+        """
+        Train in a child process by default so Keras never holds the GIL
+        or the memory of the BACnet process, TRAINING_MODE = "thread"
+        keeps the old in-process behaviour
+        """
+        self.model_is_training = True
 
-        _log.debug(f"dataX shape: {dataX.shape}, dataX type: {type(dataX)}")
-        _log.debug(f"dataY shape: {dataY.shape}, dataY type: {type(dataY)}")
+        # the trainer reads the store from disk, write out batched readings
+        self.store.flush()
 
-        return dataX, dataY
+        if TRAINING_MODE == "process":
+            try:
+                self.training_worker.start(self.training_config())
+            except Exception as e:
+                _log.error(f"Could not start the training process: {e}")
+                self.model_is_training = False
+        else:
+            model_training_thread = threading.Thread(target=self.train_model_thread)
+            model_training_thread.start()
 
     def train_model_thread(self):
-        best_mse = float("inf")
-        best_length = self.sequence_length
-        self.model_is_training = True
-
         try:
             _log.debug("Fit Model Called!")
+            result = run_training(self.training_config())
+        except Exception as e:
+            _log.error(f"An error occurred during the model training: {e}")
+            self.model_is_training = False
+            if _debug:
+                exit(1)
+            return
 
-            # Scale the data using the same MinMaxScaler
-            # all data comes from CSV file
-            scaled_data = self.scale_data()
-            _log.debug(
-                f"scaled_data type: {type(scaled_data)}, scaled_data value: {scaled_data}"
-            )
-
-            # Load your preprocessed data for the fixed sequence length
-            X, Y = self.create_dataset(
-                scaled_data, seq_length=best_length, pred_length=60
-            )
-
-            _log.debug(f"X shape: {X.shape}, Y shape: {Y.shape}")
-            _log.debug(f"X type: {type(X)}, Y type: {type(Y)}")
-
-            X = np.reshape(X, (X.shape[0], X.shape[1], 1))
+        self.apply_training_result(result)
 
-            # Split data into train and test
-            train_size = int(0.67 * len(X))
-            X_train, y_train = X[:train_size], Y[:train_size]
-            X_test, y_test = X[train_size:], Y[train_size:]
+    def poll_model_training(self):
+        """
+        Non-blocking check on the training process, called every tick
+        """
+        for kind, payload in self.training_worker.poll():
+            if kind == "progress" and "epoch" in payload:
+                _log.debug(
+                    "Training epoch %s loss %.5f val_loss %.5f",
+                    payload["epoch"],
+                    payload["loss"],
+                    payload["val_loss"],
+                )
+            elif kind == "progress":
+                # the tree and ridge engines report stages, not epochs
+                _log.debug("Training progress %s", payload)
+            elif kind == "done":
+                self.apply_training_result(payload)
+            else:
+                _log.error(f"An error occurred during the model training: {payload}")
+                self.model_is_training = False
 
-            _log.debug(
-                f"X_train shape: {X_train.shape}, y_train shape: {y_train.shape}"
-            )
-            _log.debug(f"X_test shape: {X_test.shape}, y_test shape: {y_test.shape}")
-
-            # Define and compile your LSTM model
-            model = Sequential()
-            model.add(LSTM(50, return_sequences=True, input_shape=(best_length, 1)))
-            model.add(LSTM(50, return_sequences=False))
-            model.add(Dense(60))
-            model.compile(optimizer="adam", loss="mean_squared_error")
-
-            # Define the EarlyStopping callback with patience
-            early_stop = EarlyStopping(
-                monitor="val_loss", patience=5, verbose=1, restore_best_weights=True
-            )
+    def serve_model_version(self, version=None):
+        """
+        Load a registry version, the current one by default, and swap it
+        in with a single assignment so the forecast loop never pauses
 
-            # Define the ModelCheckpoint callback to save the best model
-            model_checkpoint = ModelCheckpoint(
-                "best_model.h5", monitor="val_loss", save_best_only=True
+        Returns:
+        - bool True if a model is now served from that version
+        """
+        try:
+            bundle = self.registry.load(version)
+        except Exception as e:
+            _log.error(f"Could not load model version {version}: {e}")
+            return False
+        if bundle is None:
+            return False
+        if bundle.metadata.get("seq_length", self.sequence_length) != self.sequence_length:
+            _log.error(
+                f"Model version {bundle.version} expects {bundle.metadata['seq_length']} "
+                f"readings, LSTM_SEQUENCE_LENGTH is {self.sequence_length}"
             )
+            return False
 
-            start_time = time.time()
-
-            # Train LSTM model with validation data and early stopping
-            history = model.fit(
-                X_train,
-                y_train,
-                batch_size=64,
-                epochs=200,
-                validation_data=(X_test, y_test),
-                callbacks=[early_stop, model_checkpoint],
+        self.serving = bundle
+        self.rmse = bundle.metadata.get("rmse", 0)
+        self.total_training_time_minutes = bundle.metadata.get(
+            "training_time_minutes", 0
+        )
+        if "published_at" in bundle.metadata:
+            self.last_train_time = datetime.fromtimestamp(
+                bundle.metadata["published_at"]
             )
 
-            # Validate model
-            predictions = model.predict(X_test)
-            _log.debug(f"predictions shape: {predictions.shape}")
-
-            predictions = self.scaler_float.inverse_transform(predictions)
-            y_test_original = self.scaler_float.inverse_transform(y_test)
-            _log.debug(f"y_test_original shape: {y_test_original.shape}")
-
-            mse = mean_squared_error(y_test_original, predictions)
-            self.rmse = np.sqrt(mse)
-
-        except Exception as e:
-            _log.debug(f"An error occurred during the model training: {e}")
-            if _debug:
-                exit(1)
-
-        self.total_training_time_minutes = (time.time() - start_time) / 60
-        self.last_train_time = datetime.now()
-        self.rmse = np.sqrt(best_mse)
-        
         # update bacnet API so metrics can be logged on control sys
         self.set_model_training_time(self.total_training_time_minutes)
         self.set_model_rsme(self.rmse)
-        
-        # Load the best model
-        self.model = tf.keras.models.load_model("best_model.h5")
-        _log.debug(f"Model Training Success")
+        _log.debug("Serving model version %s", bundle.version)
+        return True
+
+    def restore_model(self):
+        """
+        Serve the last published model after a restart instead of waiting
+        for the next MODEL_TRAIN_HOUR, tried once on the first forecast
+        """
+        if not self.model_restore_pending:
+            return
+        self.model_restore_pending = False
+        if self.serving is None and self.serve_model_version():
+            _log.debug("Restored model version %s", self.serving.version)
+
+    def rollback_model(self):
+        """
+        Go back to the version published before the one being served
+        """
+        try:
+            version = self.registry.rollback()
+        except ValueError as e:
+            _log.error(f"Model rollback failed: {e}")
+            return False
+        return self.serve_model_version(version)
+
+    def apply_training_result(self, result):
+        """
+        Swap in the freshly trained model, the trainer has already
+        published it to the registry and only sends back its version
+        """
+        if self.serve_model_version(result["version"]):
+            _log.debug(
+                "Model Training Success, %s training of %s epochs",
+                result.get("mode", "full"),
+                result.get("epochs"),
+            )
         self.model_is_training = False
 
-    def run_forecasting_cycle(self):
+    def prepare_forecast(self, training_allowed=True):
         """
-        Executes a forecasting cycle, performing the following steps:
+        Ingest stage of a forecasting cycle on the core thread, the
+        analytics worker forecasts all meters in one batch afterwards:
         1. Fetches and stores data, returning early if no data is available.
         2. Checks if the data cache meets the required length for forecasting.
-        3. Initiates model training at a specific hour, if not already started.
-        4. Once the LSTM model is trained:
-        - Forecasts the next hour's power usage values.
-        - Calculates the rate of change of power usage.
-        - Identifies peak and valley points in the power usage distribution.
-        - Sets the power state based on the identified peak and valley points.
+        3. Initiates model training once the train hour has passed, or
+           a run was requested on the model-training BV, and
+           `training_allowed`, other meters may be training. A meter
+           that has to wait stays due past the train hour.
+        4. Restores the served model after a restart.
+
+        Returns:
+        - bool True if the meter has a model and its input window is ready
         """
+        self.poll_model_training()
+
+        # with --training-trigger, active written by the benchmark asks for a
+        # run, pending until the meter has the readings to train on; after
+        # every tick the BV reads whether training is running
+        if self.model_training_bv is not None:
+            if (
+                self.model_training_bv.presentValue == "active"
+                and not self.model_is_training
+                and not self.training_requested
+            ):
+                self.training_requested = True
+                if not self.data_is_available:
+                    _log.info(
+                        "Training requested, starts once %d readings are stored",
+                        self.sequence_length,
+                    )
+            self.model_training_bv.presentValue = (
+                "active" if self.model_is_training else "inactive"
+            )
+
         data_available = self.fetch_and_store_data()
         if not data_available:
             _log.debug("Data not available. Returning early.")
-            return
+            return False
 
         now = datetime.now()
-        data_cache_len = len(self.data_cache)
+        data_cache_len = len(self.history)
 
         if _debug:
             _log.debug("Data Cache Length: %s", data_cache_len)
             _log.debug("Current Hour: %s", now.hour)
             _log.debug("Current Minute: %s", now.minute)
-            _log.debug(
-                "Model Train Hour: %s %s",
-                self.model_train_hour,
-                self.model_train_hour + 1,
-            )
-            _log.debug("Training Started Today: %s", self.training_started_today)
+            _log.debug("Model Train Hour: %s", self.model_train_hour)
+            _log.debug("Last Scheduled Training: %s", self.last_scheduled_training)
             _log.debug("Model Availability: %s", self.get_if_a_model_is_available())
             _log.debug("Model RMSE: %.2f", self.rmse)
             _log.debug(
@@ -602,57 +1176,59 @@ class PowerMeterForecast:
                 self.last_train_time,
             )
 
-        if not self.data_cache:
+        if not self.history:
             _log.debug("Data Cache is empty - RETURN")
-            return
+            return False
 
-        data_cache_lv = self.data_cache[-1][1]
+        _, data_cache_lv = self.history.last()
         if _debug:
             _log.debug("Data Cache last value: %s", data_cache_lv)
 
         if data_cache_lv == -1.0:
             _log.debug("data_cache_lv == -1.0 - RETURN")
-            return
+            return False
 
         if not self.data_is_available:
             _log.debug("self.data_is_available is False - RETURN")
-            return
+            return False
 
+        scheduled = self.training_due(now)
         if (
-            now.hour == self.model_train_hour
-            and not self.training_started_today
+            (scheduled or self.training_requested)
             and not self.model_is_training
+            and training_allowed
         ):
-            _log.debug("train model thread GO!")
-            model_training_thread = threading.Thread(target=self.train_model_thread)
-            model_training_thread.start()
-            self.training_started_today = True
+            _log.debug("train model GO!")
+            self.start_model_training()
+            self.training_requested = False
+            if scheduled:
+                self.last_scheduled_training = now
 
-        elif now.hour == self.model_train_hour + 1:
-            self.training_started_today = False
+        self.restore_model()
 
         if not self.get_if_a_model_is_available():
             _log.debug("Model not trained yet, no data science - RETURN")
-            return
-
-        # Only use the last `self.sequence_length` values from `data_cache` for forecasting
-        last_seq_vals = [item[1] for item in self.data_cache[-self.sequence_length:]]
-        last_seq_vals = np.array(last_seq_vals, dtype=float).reshape(1, self.sequence_length, 1)
+            return False
 
-        forecast = self.model.predict(last_seq_vals)
-        forecast = self.scaler_float.inverse_transform(forecast)
+        self.latest_value = data_cache_lv
+        return True
 
-        # Retrieve the last forecasted value for electric reading one hour into the future
-        self.forecasted_value_60 = float(forecast[0][-1])
+    def apply_forecast(self, result):
+        """
+        Publish stage of a forecasting cycle on the core thread, given the
+        MeterResult of the analytics worker:
+        - Publishes the value one hour into the future.
+        - Publishes the rate of change of power usage.
+        - Sets the power state based on the identified peak and valley points.
+        """
+        self.forecasted_value_60 = result.forecast
 
         _log.debug("Last forecasted value: %s", self.forecasted_value_60)
 
         self.set_one_hr_future_pwr(self.forecasted_value_60)
+        self.set_power_rate_of_change(result.rate_of_change)
 
-        self.calc_power_rate_of_change()
-        self.set_power_rate_of_change(self.current_power_lv_rate_of_change)
-
-        self.is_valley, self.is_peak = self.check_percentiles(data_cache_lv)
+        self.is_valley, self.is_peak = result.is_valley, result.is_peak
         self.set_power_state_based_on_peak_valley()
 
 
@@ -685,6 +1261,63 @@ def update_ini_with_constants(new_address):
         config.write(configfile)
 
 
+def read_forecaster_settings(filename="BACpypes.ini"):
+    """
+    Forecasting engine from the [Forecaster] section of the INI file, the
+    other keys in the section are options of the engine's training, e.g.
+
+    [Forecaster]
+    engine = ridge
+    alpha = 0.001
+
+    Returns:
+    - dict with engine name and options
+    """
+    config = configparser.ConfigParser()
+    config.read(filename)
+    if "Forecaster" not in config:
+        return {"engine": FORECASTER_ENGINE, "options": {}}
+
+    section = dict(config["Forecaster"])
+    engine = section.pop("engine", FORECASTER_ENGINE).strip().lower()
+    get_forecaster(engine)  # fail at startup on a typo, not at midnight
+
+    options = {}
+    for key, value in section.items():
+        try:
+            options[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            options[key] = value
+    check_options(engine, options)
+    return {"engine": engine, "options": options}
+
+
+def read_meter_settings(filename="BACpypes.ini"):
+    """
+    Meter names from the [Meters] section of the INI file, each meter
+    gets its own BACnet objects, history and models, e.g.
+
+    [Meters]
+    names = main, chiller, lab
+
+    Returns:
+    - list of meter names, one unnamed meter without the section
+    """
+    config = configparser.ConfigParser()
+    config.read(filename)
+    if "Meters" not in config:
+        return [""]
+
+    names = [
+        name.strip()
+        for name in config["Meters"].get("names", "").split(",")
+        if name.strip()
+    ]
+    if len(set(names)) != len(names):
+        raise ValueError(f"duplicate meter names in [Meters]: {names}")
+    return names or [""]
+
+
 def main():
     detected_ip_address = get_ip_address()
     use_constants = False
@@ -698,9 +1331,26 @@ def main():
         update_ini_with_constants(detected_ip_address)
 
     parser = ConfigArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--training-trigger",
+        action="store_true",
+        help="serve a writable model-training BV that starts a run, for benchmarks",
+    )
     args = parser.parse_args()
 
-    bacnet_server = BacnetServer(args.ini, args.ini.address)
+    forecaster = read_forecaster_settings()
+    _log.debug("Forecaster engine: %s %s", forecaster["engine"], forecaster["options"])
+
+    meters = read_meter_settings()
+    _log.debug("Meters: %s", meters)
+
+    bacnet_server = BacnetServer(
+        args.ini,
+        args.ini.address,
+        forecaster=forecaster,
+        meters=meters,
+        training_trigger=args.training_trigger,
+    )
 
     bacnet_server.run()
 
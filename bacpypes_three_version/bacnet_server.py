@@ -1,22 +1,46 @@
-import asyncio, time
+import asyncio, contextlib, multiprocessing, os, queue, sys, time
+from concurrent.futures import ProcessPoolExecutor
 
 from bacpypes3.debugging import ModuleLogger
 from bacpypes3.argparse import SimpleArgumentParser
 from bacpypes3.primitivedata import Real
+from bacpypes3.apdu import ReadRangeACK
 from bacpypes3.app import Application
+from bacpypes3.basetypes import (
+    BinaryPV,
+    DateTime,
+    DeviceObjectPropertyReference,
+    LogRecord,
+    LogRecordLogDatum,
+    PropertyIdentifier,
+    Segmentation,
+)
+from bacpypes3.constructeddata import ListOf
+from bacpypes3.errors import ExecutionError
 from bacpypes3.local.analog import AnalogValueObject
 from bacpypes3.local.binary import BinaryValueObject
 from bacpypes3.local.cmd import Commandable
+from bacpypes3.local.object import Object
+from bacpypes3.local.oos import OutOfService
+from bacpypes3.object import TrendLogObject
 
 import numpy as np
-import pandas as pd
 
-from sklearn.model_selection import TimeSeriesSplit
-from sklearn.tree import DecisionTreeRegressor
-from sklearn.multioutput import MultiOutputRegressor
-from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.model_selection import GridSearchCV
 from datetime import datetime
+from math import isfinite
+
+# shared helpers live next to the legacy server in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from diagnostics import StageTimers, prometheus_text, startup_report, write_textfile
+from history import ColumnarRing, GridResampler, RollingStats, SlidingPercentiles
+from storage import (
+    BufferedHistoryWriter,
+    EPOCH_SCALE,
+    open_history_store,
+    to_epoch_us,
+)
+from training import TrainingCancelled, train_tree_grid
+from trendlog import TrendSource, range_arguments, response_items
 
 _debug = 0
 _log = ModuleLogger(globals())
@@ -25,19 +49,191 @@ INTERVAL = 60.0  # dont adjust
 MODEL_TRAIN_HOUR = 0  # midnight
 DEFAULT_PV = -1.0
 DAYS_TO_CACHE = 31
+CACHE_DTYPE = np.float32  # sensor values, halves the cache memory
+PERCENTILE_WINDOW_DAYS = 30
+RATE_OF_CHANGE_WINDOW = 15  # samples in the rolling mean slope
+FORECAST_HORIZON = 60  # cache rows ahead the model forecasts, one per INTERVAL
+HISTORY_BACKEND = "sqlite"  # or "columnar"
+HISTORY_DIR = "history"
+HISTORY_DURABILITY = "flush"  # none, flush or fsync
+HISTORY_FLUSH_SAMPLES = 10  # a restart loses at most this many readings
+HISTORY_FLUSH_SECONDS = 600.0
+INGEST_MODE = "poll"  # or "events" to record every write to input-power-meter
+WRITE_EVENTS_DIR = "write_events"  # raw timestamped writes in events mode
+WRITE_HOLD_SECONDS = 300.0  # a write counts this long, then minutes are gaps
+TRAINING_TIMEOUT_MINUTES = 120.0  # cancel the grid search after this long
+TRAINING_PROGRESS_SECONDS = 5.0  # how often training progress is logged
+METRICS_TEXTFILE = "opendsm.prom"  # for the node_exporter textfile collector, or None
+# objects whose cached history is served as a TrendLog, by cache column
+TREND_LOG_COLUMNS = (
+    ("input_power", "input_power_pv"),
+    ("one_hr_future_pwr", "one_hr_future_pwr_pv"),
+    ("power_rate_of_change", "power_rate_of_change_pv"),
+)
+
+
+def _is_present_value(attr):
+    # the attribute name, its hyphenated form or a PropertyIdentifier (85)
+    return attr in ("presentValue", "present-value") or attr == 85
 
 
 class CommandableAnalogValueObject(Commandable, AnalogValueObject):
     """
-    Commandable Analog Value Object
+    Commandable Analog Value Object, every write of presentValue is
+    reported to `_write_listener` with the value after priority arbitration
     """
 
+    # private name, both stacks refuse to set attributes that are not properties
+    _write_listener = None
+
+    async def write_property(self, attr, value, index=None, priority=None):
+        await super().write_property(attr, value, index=index, priority=priority)
+        if _is_present_value(attr) and self._write_listener is not None:
+            self._write_listener(time.time(), float(self.presentValue))
+
+
+class DiagnosticValueObject(OutOfService, AnalogValueObject):
+    """
+    Analog Value whose presentValue BACnet clients can read but not write
+    """
+
+
+class HistoryTrendLogObject(Object, TrendLogObject):
+    """
+    Trend log whose buffer is a column of the in-memory history, the
+    logBuffer is only readable with ReadRange
+    """
+
+    def __init__(self, source, **kwargs):
+        self._source = source
+        super().__init__(**kwargs)
+
+    @property
+    def bufferSize(self):
+        return self._source.capacity
+
+    @property
+    def recordCount(self):
+        return len(self._source)
+
+    @property
+    def totalRecordCount(self):
+        return self._source.total_count
+
+    @property
+    def logBuffer(self):
+        raise ExecutionError(errorClass="property", errorCode="readAccessDenied")
+
+    def read_log_buffer(self, by=None, reference=None, count=None, max_items=None):
+        """
+        Returns:
+        - tuple (records, first_sequence, flags) as TrendSource.read_range
+          with the records as LogRecords
+        """
+        records, first_sequence, flags = self._source.read_range(
+            by, reference, count, max_items
+        )
+        records = [
+            LogRecord(
+                timestamp=DateTime(datetime.fromtimestamp(timestamp)),
+                logDatum=LogRecordLogDatum(realValue=value),
+            )
+            for timestamp, value in records
+        ]
+        return records, first_sequence, flags
+
+
+class TrendLogApplication(Application):
+    """
+    Application that serves ReadRange on the history trend logs
+    """
+
+    async def do_ReadRangeRequest(self, apdu):
+        obj = self.get_object_id(apdu.objectIdentifier)
+        if obj is None:
+            raise ExecutionError(errorClass="object", errorCode="unknownObject")
+        if (
+            not isinstance(obj, HistoryTrendLogObject)
+            or apdu.propertyIdentifier != PropertyIdentifier.logBuffer
+        ):
+            raise ExecutionError(errorClass="property", errorCode="propertyIsNotAList")
+
+        try:
+            by, reference, count = range_arguments(apdu.range)
+        except ValueError:
+            # a reference time with wildcards or a special month or day
+            raise ExecutionError(errorClass="property", errorCode="valueOutOfRange")
+        # no more records than the requester takes in its APDUs and segments
+        max_items = response_items(
+            apdu.apduMaxResp,
+            apdu.apduMaxSegs,
+            apdu.apduSA
+            and self.device_object.segmentationSupported
+            in (Segmentation.segmentedTransmit, Segmentation.segmentedBoth),
+        )
+        try:
+            records, first_sequence, flags = obj.read_log_buffer(
+                by, reference, count, max_items
+            )
+        except ValueError:
+            raise ExecutionError(
+                errorClass="services", errorCode="parameterOutOfRange"
+            )
+
+        resp = ReadRangeACK(context=apdu)
+        resp.objectIdentifier = apdu.objectIdentifier
+        resp.propertyIdentifier = apdu.propertyIdentifier
+        resp.resultFlags = [int(flag) for flag in flags]
+        resp.itemCount = len(records)
+        resp.itemData = ListOf(LogRecord)(records)
+        if by in ("sequence", "time") and records:
+            resp.firstSequenceNumber = first_sequence
+        await self.response(resp)
+
+
+class ChangePublisher:
+    """
+    Writes presentValue of output objects only when it changes, analog
+    values by more than the object's covIncrement and binary values on
+    any state change, so subscribers see no COV churn from rewrites
+    """
+
+    def __init__(self):
+        self.last = {}
+        self.published = 0
+        self.suppressed = 0
+
+    def publish(self, obj, value):
+        """
+        Returns:
+        - bool True if presentValue was written
+        """
+        last = self.last.get(id(obj))
+        if isinstance(value, str):
+            changed = value != last
+        else:
+            value = float(value)
+            increment = float(getattr(obj, "covIncrement", None) or 0.0)
+            changed = last is None or abs(value - last) > increment
+
+        if not changed:
+            self.suppressed += 1
+            return False
+
+        obj.presentValue = value if isinstance(value, str) else Real(value)
+        self.last[id(obj)] = value
+        self.published += 1
+        return True
+
 
 class SampleApplication:
     def __init__(self, args, **kwargs):
         self.args = args
         # Initialize the BACnet application
-        self.app = Application.from_args(args)
+        self.app = TrendLogApplication.from_args(args)
+        # only served with --training-trigger, see create_objects
+        self.model_training_bv = None
+        self.training_requested = False  # kept until a run starts
 
         # Store additional keyword arguments as attributes and add them to the BACnet application
         for key, value in kwargs.items():
@@ -45,10 +241,11 @@ class SampleApplication:
             # Assuming that the value is an instance of a BACnet object that should be added to the application
             self.app.add_object(value)
 
-        self.one_hr_future_pwr_lv = DEFAULT_PV
-        self.power_rate_of_change_lv = DEFAULT_PV
-        self.high_load_bv_lv = "inactive"
-        self.low_load_bv_lv = "inactive"
+        # outputs are written when their values change, not on a timer
+        self.publisher = ChangePublisher()
+        # stage durations of the forecasting cycle, see report_diagnostics
+        self.timers = StageTimers()
+        self.overruns = 0
 
         self.max_power_found = 0
         self.columns = [
@@ -60,8 +257,81 @@ class SampleApplication:
             "low_load_bv_pv",
         ] + [f"generic_input_var_{i}_pv" for i in range(1, 11)]
 
-        # Initialize the DataFrame with the columns and set 'timestamp' as the index
-        self.data_cache = pd.DataFrame(columns=self.columns).set_index("timestamp")
+        # Preallocated columnar ring, one column per input except 'timestamp'
+        self.CACHE_LIMIT = 1440 * DAYS_TO_CACHE
+        self.data_cache = ColumnarRing(
+            self.CACHE_LIMIT, self.columns[1:], dtype=CACHE_DTYPE
+        )
+        self.percentile_window = SlidingPercentiles(
+            PERCENTILE_WINDOW_DAYS * 86400,
+            expected_size=int(PERCENTILE_WINDOW_DAYS * 86400 / INTERVAL),
+        )
+
+        # durable log of every input column, warms the caches below on start
+        self.store = BufferedHistoryWriter(
+            open_history_store(
+                HISTORY_BACKEND,
+                HISTORY_DIR,
+                columns=self.columns[1:],
+                retention_days=DAYS_TO_CACHE,
+                durability=HISTORY_DURABILITY,
+            ),
+            max_samples=HISTORY_FLUSH_SAMPLES,
+            max_delay=HISTORY_FLUSH_SECONDS,
+        )
+        # warm the cache from the store, bounded by the cache window
+        timestamps, values = self.store.read_columns(
+            start=to_epoch_us(time.time() - DAYS_TO_CACHE * 86400)
+        )
+        self.data_cache.extend(timestamps / EPOCH_SCALE, values)
+
+        # the cache doubles as the trend log buffers, read with ReadRange
+        self.trend_logs = []
+        for instance, (name, column) in enumerate(TREND_LOG_COLUMNS, start=1):
+            logged = getattr(self, name)
+            trend_log = HistoryTrendLogObject(
+                TrendSource(self.data_cache, column),
+                objectIdentifier=("trendLog", instance),
+                objectName=f"{logged.objectName}-trend",
+                description=f"history of {logged.objectName}",
+                enable=True,
+                stopWhenFull=False,
+                loggingType="polled",
+                logInterval=int(INTERVAL * 100),
+                logDeviceObjectProperty=DeviceObjectPropertyReference(
+                    objectIdentifier=logged.objectIdentifier,
+                    propertyIdentifier="presentValue",
+                ),
+                statusFlags=[0, 0, 0, 0],
+                eventState="normal",
+                reliability="noFaultDetected",
+            )
+            self.app.add_object(trend_log)
+            self.trend_logs.append(trend_log)
+
+        window_start = to_epoch_us(time.time() - PERCENTILE_WINDOW_DAYS * 86400)
+        for timestamp, value in zip(*self.store.read_range(start=window_start)):
+            self.percentile_window.push(timestamp / EPOCH_SCALE, value)
+
+        self.power_stats = RollingStats(window=RATE_OF_CHANGE_WINDOW)
+        for timestamp, value in zip(*self.store.tail(RATE_OF_CHANGE_WINDOW + 1)):
+            self.power_stats.update(timestamp / EPOCH_SCALE, value)
+
+        # events mode: every BAS write is logged, the minute grid is resampled
+        self.power_resampler = GridResampler(INTERVAL, max_hold=WRITE_HOLD_SECONDS)
+        self.write_events = None
+        if INGEST_MODE == "events":
+            self.write_events = BufferedHistoryWriter(
+                open_history_store(
+                    HISTORY_BACKEND,
+                    WRITE_EVENTS_DIR,
+                    retention_days=DAYS_TO_CACHE,
+                    durability=HISTORY_DURABILITY,
+                ),
+                max_samples=HISTORY_FLUSH_SAMPLES,
+                max_delay=HISTORY_FLUSH_SECONDS,
+            )
+            self.input_power._write_listener = self.record_write
 
         self.current_power_last_15mins_avg_rate_of_change = None
         self.current_power_lv_rate_of_change = None
@@ -75,46 +345,25 @@ class SampleApplication:
         self.total_training_time_minutes = 0
         self.model_train_hour = MODEL_TRAIN_HOUR
 
-        self.CACHE_LIMIT = 1440 * DAYS_TO_CACHE
+        # training runs in a spawned worker process, never on the event loop
+        self.training_executor = ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.training_task = None
+        self.training_cancel = None
+        self.training_progress = None
+
         self.SPIKE_THRESHOLD_POWER_PER_MINUTE = 20
         self.BUILDING_POWER_SETPOINT = 20
 
-        # create a task to update the values
-        asyncio.create_task(self.update_bacnet_api())
         asyncio.create_task(self.run_forecasting_cycle())
 
-    async def update_bacnet_api(self):
-        while True:
-            try:
-                await asyncio.sleep(1)
-
-                # Check if 'one_hr_future_pwr' is an attribute of self
-                if hasattr(self, "one_hr_future_pwr"):
-                    self.one_hr_future_pwr.presentValue = Real(
-                        self.one_hr_future_pwr_lv
-                    )
-
-                # Similarly, for other attributes, check their existence before accessing
-                if hasattr(self, "power_rate_of_change"):
-                    self.power_rate_of_change.presentValue = Real(
-                        self.power_rate_of_change_lv
-                    )
-
-                if hasattr(self, "high_load_bv"):
-                    self.high_load_bv.presentValue = self.high_load_bv_lv
-
-                if hasattr(self, "low_load_bv"):
-                    self.low_load_bv.presentValue = self.low_load_bv_lv
-
-            except Exception as e:
-                _log.error(f"Error in update_bacnet_api: {e}")
-
     async def get_one_hr_future_pwr(self):
         if hasattr(self, "one_hr_future_pwr"):
             return self.one_hr_future_pwr.presentValue
 
     async def get_if_a_model_is_available(self):
-        return hasattr(self.model, "coefs_")
+        return self.model is not None
 
     async def get_power_rate_of_change(self):
         if hasattr(self, "power_rate_of_change"):
@@ -122,57 +371,41 @@ class SampleApplication:
 
     async def set_power_state_based_on_peak_valley(self):
         if self.is_peak:
-            self.high_load_bv_lv("active")
-            self.low_load_bv_lv("inactive")
+            high_load, low_load = "active", "inactive"
             _log.debug("Setting BVs to Peak!")
         elif self.is_valley:
-            self.high_load_bv_lv("inactive")
-            self.low_load_bv_lv("active")
+            high_load, low_load = "inactive", "active"
             _log.debug("Setting BVs to Valley!")
         else:
-            self.high_load_bv_lv("inactive")
-            self.low_load_bv_lv("inactive")
-            _log.debug("Setting BVs to Valley!")
+            high_load, low_load = "inactive", "inactive"
+            _log.debug("Setting BVs to Normal!")
 
-    async def create_dataset(self, y, input_window=60, forecast_horizon=1):
-        dataX, dataY = [], []
-        length = len(y) - input_window - forecast_horizon + 1
-        _log.debug(f"LENGTH: {length}")
-        for i in range(length):
-            dataX.append(y[i : (i + input_window)])
-            dataY.append(y[i + input_window : i + input_window + forecast_horizon])
-        return np.array(dataX), np.array(dataY)
+        self.publisher.publish(self.high_load_bv, high_load)
+        self.publisher.publish(self.low_load_bv, low_load)
 
     async def calc_power_rate_of_change(self):
-        if self.data_cache.empty:
+        if not len(self.power_stats):
             _log.debug(
                 "Data cache is empty, cannot calculate power rate of change - RETURN"
             )
             return
 
-        # Assume 'input_power_pv' is the name of the column you're interested in.
-        gradient = self.data_cache["input_power_pv"].diff().dropna()
-        current_rate_of_change = gradient.iloc[-1] if len(gradient) > 0 else 0
-
-        # Here we assume your data cache has data at a regular interval, e.g., one value per minute
-        window_size = 15  # for 15 minutes
-        if len(gradient) >= window_size:
-            avg_rate_of_change = gradient.iloc[-window_size:].mean()
-        else:
-            avg_rate_of_change = current_rate_of_change
-
-        self.current_power_last_15mins_avg = avg_rate_of_change
-        self.current_power_lv_rate_of_change = current_rate_of_change
+        # slopes are kept per second, report them per minute like the
+        # interval to interval diff they replace
+        self.current_power_last_15mins_avg_rate_of_change = (
+            self.power_stats.mean_slope * 60
+        )
+        self.current_power_lv_rate_of_change = self.power_stats.slope * 60
         _log.debug("Power rate of change calculated.")
 
     async def check_percentiles(self, current_value):
-        if self.data_cache.empty:
+        if not len(self.percentile_window):
             _log.debug("Data cache is empty, cannot check percentiles.")
             return False, False
 
-        # Assume 'input_power_pv' is the name of the column you're interested in.
-        percentile_30 = self.data_cache["input_power_pv"].quantile(0.3)
-        percentile_90 = self.data_cache["input_power_pv"].quantile(0.9)
+        # Order statistics of input_power_pv maintained over the trailing window
+        percentile_30 = self.percentile_window.percentile(30)
+        percentile_90 = self.percentile_window.percentile(90)
 
         is_below_30th = current_value < percentile_30
         is_above_90th = current_value > percentile_90
@@ -180,62 +413,156 @@ class SampleApplication:
         _log.debug("Percentiles checked.")
         return is_below_30th, is_above_90th
 
-    async def train_model_thread_async(self):
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self.train_model_thread)
+    def model_features(self, rows):
+        """
+        Model inputs of cache rows, every column except input power
+
+        Returns:
+        - numpy array (n, len(columns) - 2)
+        """
+        return np.delete(rows, self.columns.index("input_power_pv") - 1, axis=1)
+
+    def training_data(self):
+        """
+        Features of each cache row and the input power FORECAST_HORIZON
+        rows later, copied out of the cache when they are pickled to the
+        training process
+
+        Returns:
+        - numpy arrays X, y
+        """
+        rows = self.data_cache.rows()
+        power = rows[:, self.columns.index("input_power_pv") - 1]
+        return self.model_features(rows)[:-FORECAST_HORIZON], power[FORECAST_HORIZON:]
+
+    def start_model_training(self):
+        """
+        Kick off training in the background and return straight away, the
+        forecasting cycle keeps its cadence
+        """
+        if self.training_task is not None and not self.training_task.done():
+            _log.debug("Model training already running.")
+            return
+        self.training_task = asyncio.create_task(self.train_model_async())
+        if self.model_training_bv is not None:
+            self.model_training_bv.presentValue = "active"
+            self.training_task.add_done_callback(self.training_finished)
+
+    def training_finished(self, task):
+        self.model_training_bv.presentValue = "inactive"
+
+    def cancel_model_training(self):
+        """
+        Ask a running training to stop, it exits before its next fit
+        """
+        if self.training_cancel is not None:
+            self.training_cancel.set()
+
+    async def report_training_progress(self):
+        while True:
+            await asyncio.sleep(TRAINING_PROGRESS_SECONDS)
+            try:
+                while True:
+                    info = self.training_progress.get_nowait()
+                    _log.debug(
+                        "Training candidate %s of %s, score %.4f, best %.4f",
+                        info["candidate"],
+                        info["candidates"],
+                        info["score"],
+                        info["best_score"],
+                    )
+            except queue.Empty:
+                pass
+            except Exception as e:
+                _log.error(f"Error reading training progress: {e}")
+                return
+
+    async def train_model_async(self):
+        loop = asyncio.get_running_loop()
+        _log.debug("Preparing dataset for model training.")
+        X, y = self.training_data()
+
+        # manager proxies can be handed to the pool worker, unlike plain
+        # multiprocessing events and queues; starting it blocks, so off loop
+        manager = await loop.run_in_executor(
+            None, multiprocessing.get_context("spawn").Manager
+        )
+        self.training_cancel = manager.Event()
+        self.training_progress = manager.Queue()
+        reporter = asyncio.create_task(self.report_training_progress())
+
+        _log.debug(f"MODEL training GO! {time.ctime()}")
+        future = loop.run_in_executor(
+            self.training_executor,
+            train_tree_grid,
+            X,
+            y,
+            self.training_progress,
+            self.training_cancel,
+        )
 
-    async def train_model_thread(self):
         try:
-            _log.debug("Preparing dataset for model training.")
-
-            y = self.data_cache["input_power_pv"]
-
-            feature_columns = [
-                col for col in self.data_cache.columns if col not in ["input_power_pv"]
-            ]
-            X = self.data_cache[feature_columns]
-
-            # Initialize the time series cross-validator
-            tscv = TimeSeriesSplit(n_splits=5)
-
-            # Initialize the model as a multi-output regressor
-            model = MultiOutputRegressor(DecisionTreeRegressor(random_state=0))
-
-            # Define parameter grid for hyperparameter tuning
-            parameter_grid = {
-                "estimator__max_depth": [None, 10, 20],
-                "estimator__min_samples_split": [2, 5, 10],
-                "estimator__min_samples_leaf": [1, 2, 4],
-            }
-
-            # Grid search with time series cross-validation
-            grid_search = GridSearchCV(
-                model, parameter_grid, cv=tscv, scoring="neg_mean_squared_error"
+            model, result = await asyncio.wait_for(
+                asyncio.shield(future), TRAINING_TIMEOUT_MINUTES * 60
             )
-
-            start_time = time.time()
-            _log.debug(f"MODEL training GO! {time.ctime()}")
-
-            grid_search.fit(X, y)
-
-            end_time = time.time()
-            _log.debug(f"MODEL training All Done! {time.ctime()}")
-
-            # Extract the best model
-            self.model = grid_search.best_estimator_
-
-            # Training time in minutes
-            self.total_training_time_minutes = (end_time - start_time) / 60
-            self.last_train_time = datetime.now()
-
-            _log.debug(
-                f"Model trained successfully in {self.total_training_time_minutes:.2f} minutes on {self.last_train_time}."
+        except asyncio.TimeoutError:
+            _log.error(
+                f"Model training exceeded {TRAINING_TIMEOUT_MINUTES} minutes, cancelling."
             )
-
+            self.training_cancel.set()
+            try:
+                await future
+            except Exception:
+                pass
+            return
+        except asyncio.CancelledError:
+            self.training_cancel.set()
+            raise
+        except TrainingCancelled:
+            _log.debug("Model training cancelled.")
+            return
         except Exception as e:
-            _log.debug(f"An error occurred during the model training: {e}")
+            _log.error(f"An error occurred during the model training: {e}")
             if _debug:
                 raise e  # Instead of exiting, we raise the exception for debugging
+            return
+        finally:
+            reporter.cancel()
+            self.training_cancel = self.training_progress = None
+            await loop.run_in_executor(None, manager.shutdown)
+
+        _log.debug(f"MODEL training All Done! {time.ctime()}")
+
+        # swapped in on the loop thread, forecasts never see a half trained model
+        self.model = model
+        self.total_training_time_minutes = result["training_time_minutes"]
+        self.last_train_time = datetime.now()
+
+        _log.debug(
+            f"Model trained successfully in {self.total_training_time_minutes:.2f} minutes on {self.last_train_time}, best params {result['best_params']}."
+        )
+
+    async def close(self):
+        """
+        Stop training and write out the readings still batched in memory
+        """
+        self.cancel_model_training()
+        if self.training_task is not None and not self.training_task.done():
+            self.training_task.cancel()
+            # its finally shuts the manager down, before the pool goes away
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.training_task
+        self.training_executor.shutdown(wait=False, cancel_futures=True)
+        self.store.close()
+        if self.write_events is not None:
+            self.write_events.close()
+
+    def record_write(self, timestamp, value):
+        """
+        Called by input-power-meter on every write in events mode
+        """
+        self.write_events.append(timestamp, value)
+        self.power_resampler.add(timestamp, value)
 
     async def get_input_sensor_values(self):
         # Dictionary to store the sensor values
@@ -267,96 +594,186 @@ class SampleApplication:
         return None, None
 
     async def fetch_and_store_data(self):
-        timestamp, new_data = await self.poll_sensor_data()
+        with self.timers.stage("fetch"):
+            timestamp, new_data = await self.poll_sensor_data()
 
         if timestamp is None:
             return False
 
         _log.debug("new_data: %s", new_data)
         
-        # Convert timestamp to the correct datetime type
-        timestamp = pd.to_datetime(timestamp)
-        new_data_df = pd.DataFrame(new_data, index=[timestamp])
-
-        # Debugging: Print the contents of new_data_df
-        _log.debug("new_data_df: %s", new_data_df)
-
-        # Append the new DataFrame to the data_cache DataFrame
-        self.data_cache = pd.concat([self.data_cache, new_data_df])
+        # sensor names map onto the *_pv history columns
+        new_data = {f"{key}_pv": value for key, value in new_data.items()}
+
+        if INGEST_MODE == "events":
+            # one row per resampled minute of input power writes, the other
+            # columns are polled, minutes without writes are left out
+            rows = [
+                (bucket, dict(new_data, input_power_pv=mean))
+                for bucket, mean, _, _ in self.power_resampler.close(timestamp)
+            ]
+        else:
+            rows = [(timestamp, new_data)]
 
-        # Sort the DataFrame by index just in case timestamps are out of order
-        self.data_cache = self.data_cache.sort_index()
+        with self.timers.stage("store"):
+            for timestamp, row in rows:
+                self.store.append(timestamp, [row[col] for col in self.columns[1:]])
 
-        # Check the DataFrame length and drop oldest rows if necessary
-        if len(self.data_cache) > self.CACHE_LIMIT:
-            self.data_cache = self.data_cache.iloc[-self.CACHE_LIMIT:]
+                # O(1) append, the oldest row is overwritten once the ring is full
+                self.data_cache.append(timestamp, row)
+                # a NaN or inf reading would poison the rolling sums for good
+                if isfinite(row["input_power_pv"]):
+                    self.percentile_window.push(timestamp, row["input_power_pv"])
+                    self.power_stats.update(timestamp, row["input_power_pv"])
 
-        return True
+        return bool(rows)
 
     async def run_forecasting_cycle(self):
         while True:
             await asyncio.sleep(INTERVAL)
-            _log.debug("run_forecasting_cycle GO!")
+            started = time.perf_counter()
+            try:
+                await self.forecasting_cycle()
+            except Exception:
+                # one bad reading or model error costs a cycle, not the task
+                _log.exception("Forecasting cycle failed")
+            self.report_diagnostics(time.perf_counter() - started)
+
+    async def forecasting_cycle(self):
+        _log.debug("run_forecasting_cycle GO!")
+
+        # with --training-trigger, active written by the benchmark asks for a
+        # run, pending until there is a reading to train on; after every
+        # tick the BV reads whether training is running
+        if self.model_training_bv is not None:
+            training = (
+                self.training_task is not None and not self.training_task.done()
+            )
+            if self.model_training_bv.presentValue == BinaryPV.active and not training:
+                self.training_requested = True
+            self.model_training_bv.presentValue = "active" if training else "inactive"
 
-            data_available = await self.fetch_and_store_data()
+        data_available = await self.fetch_and_store_data()
 
-            now = datetime.now()
-            data_cache_len = self.data_cache.shape[0]
-            power_meter_lv = self.data_cache["input_power_pv"].iloc[-1]
+        now = datetime.now()
+        data_cache_len = len(self.data_cache)
+        power_meter_lv = self.data_cache.last("input_power_pv")
 
-            if _debug:
-                _log.debug("Data Cache Length: %s", data_cache_len)
-                _log.debug("power_meter_lv LV: %s", power_meter_lv)
-                _log.debug("Current Hour: %s", now.hour)
-                _log.debug("Current Minute: %s", now.minute)
-                _log.debug(
-                    "Training Started Today: %s",
-                    self.training_started_today,
-                )
-                _log.debug(
-                    "Model Availability: %s", await self.get_if_a_model_is_available()
-                )
-                _log.debug(
-                    "Model training time: %.2f minutes on %s",
-                    self.total_training_time_minutes,
-                    self.last_train_time,
-                )
+        if _debug:
+            _log.debug("Data Cache Length: %s", data_cache_len)
+            _log.debug("power_meter_lv LV: %s", power_meter_lv)
+            _log.debug("Current Hour: %s", now.hour)
+            _log.debug("Current Minute: %s", now.minute)
+            _log.debug(
+                "Training Started Today: %s",
+                self.training_started_today,
+            )
+            _log.debug(
+                "Model Availability: %s", await self.get_if_a_model_is_available()
+            )
+            _log.debug(
+                "Model training time: %.2f minutes on %s",
+                self.total_training_time_minutes,
+                self.last_train_time,
+            )
 
-            if not data_available:
-                _log.debug("Data Cache is empty - CONTINUE")
-                continue 
-            
-            if self.data_cache["input_power_pv"].iloc[-1] == -1:
-                _log.debug("Data Cache is empty - CONTINUE")
-                continue
+        if not data_available:
+            _log.debug("Data Cache is empty - RETURN")
+            return
 
-            if now.hour == self.model_train_hour and not self.training_started_today:
-                # Start model training asynchronously
-                await self.train_model_thread_async()
-                self.training_started_today = True
-            elif now.hour == 1:
-                self.training_started_today = False
+        if power_meter_lv == -1:
+            _log.debug("Data Cache is empty - RETURN")
+            return
 
-            if not await self.get_if_a_model_is_available():
-                _log.debug("Model not trained yet, no data science - CONTINUE")
-                continue
+        scheduled = (
+            now.hour == self.model_train_hour and not self.training_started_today
+        )
+        if scheduled or self.training_requested:
+            # Start model training in the worker process, don't wait on it
+            self.start_model_training()
+            self.training_requested = False
+            if scheduled:
+                self.training_started_today = True
+        elif now.hour == 1:
+            self.training_started_today = False
 
-            y = np.array([item[1] for item in self.data_cache])
-            self.forecasted_value_60 = self.model.predict(y[-60:].reshape(1, -1))[0]
-            self.one_hr_future_pwr_lv(self.forecasted_value_60)
+        if not await self.get_if_a_model_is_available():
+            _log.debug("Model not trained yet, no data science - RETURN")
+            return
 
-            self.calc_power_rate_of_change()
-            self.power_rate_of_change_lv(self.current_power_lv_rate_of_change)
+        with self.timers.stage("predict"):
+            # the latest row holds the features the model was trained on
+            X = self.model_features(self.data_cache.rows(1))
+            self.forecasted_value_60 = self.model.predict(X)[0]
+        with self.timers.stage("rate_of_change"):
+            await self.calc_power_rate_of_change()
+        with self.timers.stage("percentiles"):
+            self.is_valley, self.is_peak = await self.check_percentiles(
+                power_meter_lv
+            )
 
-            self.is_valley, self.is_peak = self.check_percentiles(power_meter_lv)
+        with self.timers.stage("publish"):
+            self.publisher.publish(
+                self.one_hr_future_pwr, np.ravel(self.forecasted_value_60)[-1]
+            )
+            if self.current_power_lv_rate_of_change is not None:
+                self.publisher.publish(
+                    self.power_rate_of_change, self.current_power_lv_rate_of_change
+                )
             await self.set_power_state_based_on_peak_valley()
 
+        _log.debug(
+            "Outputs published %s, suppressed %s",
+            self.publisher.published,
+            self.publisher.suppressed,
+        )
 
-async def main():
-    args = SimpleArgumentParser().parse_args()
-    if _debug:
-        _log.debug("args: %r", args)
 
+    def report_diagnostics(self, cycle_time):
+        """
+        Record one cycle and write the diagnostic AVs and METRICS_TEXTFILE
+        """
+        self.timers.observe("cycle", cycle_time)
+        if cycle_time > INTERVAL:
+            self.overruns += 1
+        cycle = self.timers.histogram("cycle")
+        self.publisher.publish(self.cycle_time, cycle.last)
+        self.publisher.publish(self.max_cycle_time, cycle.recent_max())
+        self.publisher.publish(self.overrun_count, self.overruns)
+
+        if not METRICS_TEXTFILE:
+            return
+        try:
+            write_textfile(
+                METRICS_TEXTFILE,
+                prometheus_text(
+                    self.timers,
+                    [
+                        ("cycle_seconds", "gauge", "Last cycle time.", cycle.last),
+                        (
+                            "cycle_max_seconds",
+                            "gauge",
+                            f"Longest of the last {cycle.window} cycles.",
+                            cycle.recent_max(),
+                        ),
+                        (
+                            "cycle_overruns_total",
+                            "counter",
+                            "Cycles that took longer than INTERVAL.",
+                            self.overruns,
+                        ),
+                    ],
+                ),
+            )
+        except OSError as e:
+            _log.error(f"Could not write metrics to {METRICS_TEXTFILE}: {e}")
+
+def create_objects(training_trigger=False):
+    """
+    Returns:
+    - dict of the served BACnet objects by SampleApplication attribute,
+      the writable model-training BV only with `training_trigger`
+    """
     # Define the AnalogValueObjects and BinaryValueObjects before using them
     input_power = CommandableAnalogValueObject(
         objectIdentifier=("analogValue", 1),
@@ -381,7 +798,7 @@ async def main():
         objectName="power-rate-of-change",
         presentValue=DEFAULT_PV,
         statusFlags=[0, 0, 0, 0],
-        covIncrement=10.0,
+        covIncrement=0.1,  # kW per minute, also the publish threshold
         description="current electrical power rate of change",
     )
 
@@ -401,10 +818,61 @@ async def main():
         description="low electrical load values detected",
     )
 
-    # Create generic input variables in a loop
-    generic_input_vars = {}
+    # read-only health of the forecasting cycle
+    cycle_time = DiagnosticValueObject(
+        objectIdentifier=("analogValue", 14),
+        objectName="cycle-time",
+        presentValue=DEFAULT_PV,
+        statusFlags=[0, 0, 0, 0],
+        outOfService=False,
+        covIncrement=0.1,
+        description="seconds the last forecasting cycle took",
+    )
+
+    max_cycle_time = DiagnosticValueObject(
+        objectIdentifier=("analogValue", 15),
+        objectName="max-cycle-time",
+        presentValue=DEFAULT_PV,
+        statusFlags=[0, 0, 0, 0],
+        outOfService=False,
+        covIncrement=0.1,
+        description="longest cycle time in seconds over the last day",
+    )
+
+    overrun_count = DiagnosticValueObject(
+        objectIdentifier=("analogValue", 16),
+        objectName="cycle-overruns",
+        presentValue=0.0,
+        statusFlags=[0, 0, 0, 0],
+        outOfService=False,
+        covIncrement=0.5,
+        description="forecasting cycles that took longer than the interval",
+    )
+
+    objects = dict(
+        input_power=input_power,
+        one_hr_future_pwr=one_hr_future_pwr,
+        power_rate_of_change=power_rate_of_change,
+        high_load_bv=high_load_bv,
+        low_load_bv=low_load_bv,
+        cycle_time=cycle_time,
+        max_cycle_time=max_cycle_time,
+        overrun_count=overrun_count,
+    )
+
+    if training_trigger:
+        # lets any BACnet client start training, for bacnet_benchmark.py
+        objects["model_training_bv"] = BinaryValueObject(
+            objectIdentifier=("binaryValue", 3),
+            objectName="model-training",
+            presentValue="inactive",
+            statusFlags=[0, 0, 0, 0],
+            description="model training running, write active to train now",
+        )
+
+    # generic input variables for the model
     for i in range(1, 11):
-        generic_input_vars[f"generic_input_var_{i}"] = CommandableAnalogValueObject(
+        objects[f"generic_input_var_{i}"] = CommandableAnalogValueObject(
             objectIdentifier=("analogValue", 3 + i),
             objectName=f"input-generic-sensor-{i}",
             presentValue=DEFAULT_PV,
@@ -412,29 +880,45 @@ async def main():
             covIncrement=10.0,
             description="writeable generic explainer var for model",
         )
+    return objects
 
-    # Instantiate the SampleApplication
-    app = SampleApplication(
-        args,
-        input_power=input_power,
-        one_hr_future_pwr=one_hr_future_pwr,
-        power_rate_of_change=power_rate_of_change,
-        high_load_bv=high_load_bv,
-        low_load_bv=low_load_bv,
-        **generic_input_vars,  # Add the generic input variables to the application
+
+async def main():
+    parser = SimpleArgumentParser()
+    parser.add_argument(
+        "--training-trigger",
+        action="store_true",
+        help="serve a writable model-training BV that starts a run, for benchmarks",
     )
+    args = parser.parse_args()
+    if _debug:
+        _log.debug("args: %r", args)
+
+    # Instantiate the SampleApplication with the objects it serves
+    app = SampleApplication(args, **create_objects(args.training_trigger))
 
     if _debug:
         _log.debug("app: %r", app)
 
-    await asyncio.Future()
+    # announce the device right away, sklearn is only imported by the
+    # training worker and when its first model comes back
+    app.app.i_am()
+    _log.info("I-Am sent %s", startup_report())
 
-# Run the main coroutine
-try:
-    asyncio.run(main())
-except (KeyboardInterrupt, asyncio.CancelledError):
-    if _debug:
-        _log.debug("Operation was interrupted")
-except Exception as e:
-    if _debug:
-        _log.error(f"An unexpected error occurred: {e}")
+    try:
+        await asyncio.Future()
+    finally:
+        await app.close()
+
+
+# Run the main coroutine, guarded because the spawned training worker
+# imports this module again
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        if _debug:
+            _log.debug("Operation was interrupted")
+    except Exception as e:
+        if _debug:
+            _log.error(f"An unexpected error occurred: {e}")
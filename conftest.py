@@ -0,0 +1 @@
+# Makes the flat root modules importable from tests/
@@ -0,0 +1,274 @@
+"""
+Process level measurements reported by both BACnet servers.
+
+Besides start up time and memory, every stage of the forecasting cycle is
+timed into a RollingHistogram. The histograms are exported as a Prometheus
+text file that the node_exporter textfile collector can scrape.
+"""
+import bisect
+import contextlib
+import os
+import resource
+import threading
+import time
+
+_IMPORT_TIME = time.time()
+
+# histogram upper bounds in seconds, from an in-memory step to a stalled tick
+DURATION_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+ROLLING_SAMPLES = 1440  # durations kept per stage for the rolling view, a day of ticks
+METRICS_PREFIX = "opendsm"
+
+
+def process_start_time():
+    """
+    Returns:
+    - float epoch seconds the process was started, from /proc on Linux,
+      otherwise the time this module was first imported
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # field 22, after the parenthesised command name which may hold spaces
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return _IMPORT_TIME
+    return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def process_uptime():
+    """
+    Returns:
+    - float seconds since the process started
+    """
+    return time.time() - process_start_time()
+
+
+def rss_bytes():
+    """
+    Returns:
+    - int resident set size now, peak RSS where /proc is not available
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def startup_report():
+    """
+    Returns:
+    - str one line summary of time since start and memory, for the log
+    """
+    return f"{process_uptime():.2f} s after process start, RSS {rss_bytes() / 2**20:.1f} MB"
+
+
+class RollingHistogram:
+    """
+    Bucketed durations of the last `window` observations, next to the
+    cumulative bucket counts and sum since start that Prometheus expects.
+    An observation costs a binary search over the buckets, only one
+    thread may observe.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS, window=ROLLING_SAMPLES):
+        self.buckets = tuple(buckets)
+        self.window = int(window)
+        # one more count than bounds, the last one is the +Inf bucket
+        self.recent_counts = [0] * (len(self.buckets) + 1)
+        self.total_counts = [0] * (len(self.buckets) + 1)
+        self.total_count = 0
+        self.total_sum = 0.0
+        self.last = None
+        self._recent = []
+        self._oldest = 0
+
+    def __len__(self):
+        return len(self._recent)
+
+    def observe(self, seconds):
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        if len(self._recent) < self.window:
+            self._recent.append(seconds)
+        else:
+            evicted = self._recent[self._oldest]
+            self.recent_counts[bisect.bisect_left(self.buckets, evicted)] -= 1
+            self._recent[self._oldest] = seconds
+            self._oldest = (self._oldest + 1) % self.window
+        self.recent_counts[bucket] += 1
+        self.total_counts[bucket] += 1
+        self.total_count += 1
+        self.total_sum += seconds
+        self.last = seconds
+
+    def recent_max(self):
+        """
+        Returns:
+        - float longest of the recent observations, None before the first
+        """
+        return max(self._recent) if self._recent else None
+
+    def recent_quantile(self, q):
+        """
+        Returns:
+        - float `q` (0 to 1) quantile of the recent observations,
+          interpolated within its bucket like Prometheus'
+          histogram_quantile and never more than their max, None before
+          the first observation
+        """
+        n = len(self._recent)
+        if not n:
+            return None
+        rank = q * n
+        longest = self.recent_max()
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, list(self.recent_counts)):
+            if count and seen + count >= rank:
+                return min(lower + (bound - lower) * (rank - seen) / count, longest)
+            seen += count
+            lower = bound
+        return longest
+
+
+class StageTimers:
+    """
+    RollingHistogram per named stage of the forecasting cycle, created on
+    first use. Each stage must be timed from one thread, different stages
+    may run on different threads, read them with `items()` while they do.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS, window=ROLLING_SAMPLES):
+        self.buckets = buckets
+        self.window = window
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.stages.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(
+                    name, RollingHistogram(self.buckets, self.window)
+                )
+        return histogram
+
+    def items(self):
+        """
+        Returns:
+        - list of (stage, RollingHistogram) sorted by stage, a snapshot
+          that a thread adding a stage cannot change
+        """
+        with self._lock:
+            return sorted(self.stages.items())
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time the body of a with block as stage `name`
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def prometheus_text(timers, metrics=(), prefix=METRICS_PREFIX):
+    """
+    `metrics` are extra (name, type, help, value) samples such as the
+    cycle time gauges, names are prefixed with `prefix`
+
+    Returns:
+    - str Prometheus text exposition of the stage histograms, their
+      rolling p50, p99 and max, and `metrics`
+    """
+    stages = timers.items()
+    name = f"{prefix}_stage_duration_seconds"
+    lines = [
+        f"# HELP {name} Duration of each stage of the forecasting cycle.",
+        f"# TYPE {name} histogram",
+    ]
+    for stage, histogram in stages:
+        cumulative = 0
+        bounds = [f"{bound:g}" for bound in histogram.buckets] + ["+Inf"]
+        for bound, count in zip(bounds, list(histogram.total_counts)):
+            cumulative += count
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.total_sum!r}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {histogram.total_count}')
+
+    name = f"{prefix}_stage_recent_seconds"
+    lines += [
+        f"# HELP {name} Stage duration over its last {timers.window} runs.",
+        f"# TYPE {name} gauge",
+    ]
+    for stage, histogram in stages:
+        for stat, value in (
+            ("p50", histogram.recent_quantile(0.5)),
+            ("p99", histogram.recent_quantile(0.99)),
+            ("max", histogram.recent_max()),
+        ):
+            lines.append(
+                f'{name}{{stage="{stage}",stat="{stat}"}} {_format_value(value)}'
+            )
+
+    for metric, kind, help_text, value in metrics:
+        lines += [
+            f"# HELP {prefix}_{metric} {help_text}",
+            f"# TYPE {prefix}_{metric} {kind}",
+            f"{prefix}_{metric} {_format_value(value)}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path, text):
+    """
+    Replace `path` with `text` atomically so the textfile collector never
+    reads half a file, the temporary name does not end in .prom so the
+    collector skips it
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        f.write(text)
+    os.replace(temporary, path)
@@ -0,0 +1,558 @@
+"""
+Interchangeable forecasting engines for the power forecast.
+
+Every engine trains from the raw (timestamps, values) history into a
+directory and is loaded back from that directory for serving, so the
+model registry and the BACnet server never need to know which one runs:
+
+- lstm: the Keras LSTM, served by the numpy runtime in forecasting.py
+- tree: one multi-output sklearn DecisionTreeRegressor
+- ridge: numpy-only ridge regression, trains in seconds with no
+  TensorFlow or sklearn
+
+The tree and ridge engines use lag and calendar features and predict
+the change from the latest reading for each minute of the horizon.
+
+`BatchPredictor` forecasts many meters per call, models of the same
+engine and shape run stacked along a leading meter axis.
+"""
+import os
+import pickle
+from datetime import datetime
+
+import numpy as np
+
+from forecasting import MinMaxScaling, NumpyLSTMModel
+from windowing import sliding_windows, window_count
+
+VALIDATION_FRACTION = 0.33
+FEATURE_CHUNK = 65536  # windows turned into features at a time
+
+
+def lag_positions(seq_length):
+    """
+    Lags used as features, 1 is the latest reading: every minute of the
+    last quarter hour, then every 15 minutes back to `seq_length`
+
+    Returns:
+    - numpy int array
+    """
+    return np.unique(
+        np.concatenate(
+            (np.arange(1, min(15, seq_length) + 1), np.arange(30, seq_length + 1, 15))
+        )
+    )
+
+
+def _local_seconds(epoch_seconds):
+    """
+    Shift epoch seconds to local wall clock seconds, the UTC offset is
+    looked up once per UTC day so DST changes are followed
+    """
+    epoch_seconds = np.asarray(epoch_seconds, dtype=np.float64)
+    days, inverse = np.unique(epoch_seconds // 86400, return_inverse=True)
+    offsets = np.array(
+        [
+            datetime.fromtimestamp(day * 86400).astimezone().utcoffset().total_seconds()
+            for day in days
+        ]
+    )
+    return epoch_seconds + offsets[inverse.reshape(epoch_seconds.shape)]
+
+
+def calendar_features(epoch_seconds):
+    """
+    Returns:
+    - numpy array (n, 5) of time of day and day of week on the unit
+      circle plus a weekend flag
+    """
+    local = _local_seconds(epoch_seconds)
+    day_angle = (local % 86400) / 86400 * 2 * np.pi
+    weekday = (local // 86400 + 3) % 7  # 1970-01-01 was a Thursday, Monday is 0
+    week_angle = weekday / 7 * 2 * np.pi
+    return np.column_stack(
+        (
+            np.sin(day_angle),
+            np.cos(day_angle),
+            np.sin(week_angle),
+            np.cos(week_angle),
+            weekday >= 5,
+        )
+    )
+
+
+def lag_calendar_features(timestamps, windows, seq_length):
+    """
+    Feature rows for (n, seq_length) input windows whose last reading was
+    taken at `timestamps`
+
+    Returns:
+    - numpy float64 arrays X (n, features) and the latest reading (n,)
+    """
+    windows = np.asarray(windows, dtype=np.float64)
+    lags = windows[:, seq_length - lag_positions(seq_length)]
+    latest = lags[:, 0]
+    # older lags relative to the latest reading, plus the level itself
+    relative = lags[:, 1:] - latest[:, np.newaxis]
+    features = (relative, latest[:, np.newaxis], calendar_features(timestamps))
+    return np.hstack(features), latest
+
+
+def iter_feature_chunks(timestamps, values, seq_length, pred_length, index):
+    """
+    Lazily turn the training windows at positions `index` into features
+    and targets relative to the latest reading, FEATURE_CHUNK windows at
+    a time
+
+    Returns:
+    - generator of numpy arrays X, target (b, pred_length)
+    """
+    X_windows, y_windows = sliding_windows(values, seq_length, pred_length)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    for i in range(0, len(index), FEATURE_CHUNK):
+        chunk = index[i : i + FEATURE_CHUNK]
+        X, latest = lag_calendar_features(
+            timestamps[chunk + seq_length - 1], X_windows[chunk], seq_length
+        )
+        yield X, y_windows[chunk] - latest[:, np.newaxis]
+
+
+def _time_split(n, stride=1):
+    train_size = int((1 - VALIDATION_FRACTION) * n)
+    return np.arange(0, train_size, stride), np.arange(train_size, n, stride)
+
+
+class Forecaster:
+    """
+    Engine interface. `train` is a classmethod that writes the engine's
+    files into a directory and returns its metrics, `load` builds a
+    serving instance from that directory and `predict` turns the latest
+    readings into a forecast in kW. `OPTIONS` names the keyword options
+    of `train` that may be set in the INI file.
+    """
+
+    name = None
+    OPTIONS = ()
+
+    def __init__(self, seq_length, pred_length):
+        self.seq_length = int(seq_length)
+        self.pred_length = int(pred_length)
+
+    @classmethod
+    def train(cls, timestamps, values, directory, seq_length, pred_length, **options):
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, directory, metadata):
+        raise NotImplementedError
+
+    def predict(self, timestamps, values):
+        """
+        Returns:
+        - numpy array (pred_length,) forecast for the minutes after the
+          last of `values`, given at least `seq_length` readings
+        """
+        raise NotImplementedError
+
+    def batch_key(self):
+        """
+        Returns:
+        - hashable key, forecasters with equal keys can be stacked
+        """
+        return type(self), self.seq_length, self.pred_length
+
+    @classmethod
+    def stack(cls, forecasters):
+        """
+        Combine forecasters sharing a `batch_key` for batched inference
+
+        Returns:
+        - callable (timestamps (m,), windows (m, seq_length)) returning the
+          (m, pred_length) forecasts, timestamps are of the latest readings
+        """
+
+        def predict(timestamps, windows):
+            return np.stack(
+                [
+                    forecaster.predict(timestamps[i : i + 1], windows[i])
+                    for i, forecaster in enumerate(forecasters)
+                ]
+            )
+
+        return predict
+
+
+class LSTMForecaster(Forecaster):
+    name = "lstm"
+    OPTIONS = ("seed",)  # the fine-tune windows come from the training config
+    ARTIFACT_FILE = "model.npz"  # numpy weights and scaler range
+    CHECKPOINT_FILE = "keras.h5"  # warm start of the next fine-tune
+
+    def __init__(self, model, scaler, seq_length, pred_length):
+        super().__init__(seq_length, pred_length)
+        self.model = model
+        self.scaler = scaler
+
+    @classmethod
+    def train(
+        cls,
+        timestamps,
+        values,
+        directory,
+        seq_length,
+        pred_length,
+        progress=None,
+        **options,
+    ):
+        from training import train_lstm
+
+        return train_lstm(
+            values,
+            os.path.join(directory, cls.ARTIFACT_FILE),
+            seq_length,
+            pred_length=pred_length,
+            checkpoint_path=os.path.join(directory, cls.CHECKPOINT_FILE),
+            progress=progress,
+            **options,
+        )
+
+    @classmethod
+    def load(cls, directory, metadata):
+        path = os.path.join(directory, cls.ARTIFACT_FILE)
+        model = NumpyLSTMModel.load(path)
+        return cls(
+            model,
+            MinMaxScaling.load(path),
+            metadata["seq_length"],
+            metadata.get("pred_length", model.dense_layers[-1][1].shape[0]),
+        )
+
+    def predict(self, timestamps, values):
+        values = np.asarray(values)[-self.seq_length :]
+        x = self.scaler.transform(values.reshape(-1, 1))
+        forecast = self.model.predict(x.reshape(1, self.seq_length, 1))
+        return self.scaler.inverse_transform(forecast)[0]
+
+    def batch_key(self):
+        return super().batch_key() + self.model.shape_key()
+
+    @classmethod
+    def stack(cls, forecasters):
+        if forecasters[0].model.return_sequences:
+            return super().stack(forecasters)
+
+        model = NumpyLSTMModel.stack([forecaster.model for forecaster in forecasters])
+        # one (min, range) row per meter, scaling broadcasts over the windows
+        data_min = np.stack([f.scaler.data_min for f in forecasters])
+        data_range = np.stack([f.scaler._range for f in forecasters])
+
+        def predict(timestamps, windows):
+            x = (np.asarray(windows, dtype=np.float64) - data_min) / data_range
+            forecast = model.predict(x[:, :, np.newaxis])
+            return forecast * data_range + data_min
+
+        return predict
+
+
+class TreeForecaster(Forecaster):
+    name = "tree"
+    OPTIONS = ("max_depth", "min_samples_leaf", "sample_stride")
+    MODEL_FILE = "tree.pkl"
+
+    def __init__(self, model, seq_length, pred_length):
+        super().__init__(seq_length, pred_length)
+        self.model = model
+
+    @classmethod
+    def train(
+        cls,
+        timestamps,
+        values,
+        directory,
+        seq_length,
+        pred_length,
+        progress=None,
+        max_depth=12,
+        min_samples_leaf=20,
+        sample_stride=5,
+    ):
+        """
+        Fit on every `sample_stride`-th window, neighbouring minutes are
+        nearly identical samples and the tree cost grows with n log n
+        """
+        from sklearn.tree import DecisionTreeRegressor
+
+        n = window_count(len(values), seq_length, pred_length)
+        if n < 2:
+            raise ValueError(
+                f"{len(values)} readings is not enough for training windows"
+            )
+
+        def fit(index):
+            chunks = iter_feature_chunks(
+                timestamps, values, seq_length, pred_length, index
+            )
+            X, y = (np.vstack(parts) for parts in zip(*chunks))
+            model = DecisionTreeRegressor(
+                max_depth=max_depth, min_samples_leaf=min_samples_leaf, random_state=0
+            )
+            return model.fit(X.astype(np.float32), y)
+
+        # validate on the newest third, then refit on everything
+        train_index, test_index = _time_split(n, sample_stride)
+        model = fit(train_index)
+        squared_error, count = 0.0, 0
+        for X, y in iter_feature_chunks(
+            timestamps, values, seq_length, pred_length, test_index
+        ):
+            errors = model.predict(X.astype(np.float32)) - y
+            squared_error += float(np.sum(errors**2))
+            count += errors.size
+        if progress is not None:
+            progress({"stage": "validated", "windows": len(train_index)})
+
+        model = fit(np.arange(0, n, sample_stride))
+        with open(os.path.join(directory, cls.MODEL_FILE), "wb") as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return {"rmse": float(np.sqrt(squared_error / count)), "mode": "full"}
+
+    @classmethod
+    def load(cls, directory, metadata):
+        with open(os.path.join(directory, cls.MODEL_FILE), "rb") as f:
+            model = pickle.load(f)
+        return cls(model, metadata["seq_length"], model.n_outputs_)
+
+    def predict(self, timestamps, values):
+        values = np.asarray(values)[-self.seq_length :]
+        X, latest = lag_calendar_features(
+            np.asarray(timestamps)[-1:], values[np.newaxis, :], self.seq_length
+        )
+        return self.model.predict(X.astype(np.float32))[0] + latest[0]
+
+    @classmethod
+    def stack(cls, forecasters):
+        seq_length = forecasters[0].seq_length
+
+        def predict(timestamps, windows):
+            # features are built once, each tree still predicts on its own
+            X, latest = lag_calendar_features(timestamps, windows, seq_length)
+            X = X.astype(np.float32)
+            forecasts = np.stack(
+                [
+                    forecaster.model.predict(X[i : i + 1])[0]
+                    for i, forecaster in enumerate(forecasters)
+                ]
+            )
+            return forecasts + latest[:, np.newaxis]
+
+        return predict
+
+
+class RidgeForecaster(Forecaster):
+    """
+    Ridge regression solved in closed form from X'X and X'y, accumulated
+    chunk by chunk so training memory stays at one chunk of features.
+    Features are standardized so one `alpha` suits all of them.
+    """
+
+    name = "ridge"
+    OPTIONS = ("alpha",)
+    MODEL_FILE = "ridge.npz"
+
+    def __init__(self, coef, intercept, mean, scale, seq_length):
+        super().__init__(seq_length, coef.shape[1])
+        self.coef = coef
+        self.intercept = intercept
+        self.mean = mean
+        self.scale = scale
+
+    @staticmethod
+    def _solve(timestamps, values, seq_length, pred_length, index, alpha):
+        count, sum_x, sum_y, gram, cross = 0, 0.0, 0.0, 0.0, 0.0
+        shift_x = shift_y = None
+        for X, y in iter_feature_chunks(
+            timestamps, values, seq_length, pred_length, index
+        ):
+            if shift_x is None:
+                # sums around the first chunk's mean, raw sums of kW
+                # squared cancel badly when the centering is applied
+                shift_x, shift_y = X.mean(axis=0), y.mean(axis=0)
+            X, y = X - shift_x, y - shift_y
+            count += len(X)
+            sum_x = sum_x + X.sum(axis=0)
+            sum_y = sum_y + y.sum(axis=0)
+            gram = gram + X.T @ X
+            cross = cross + X.T @ y
+
+        mean_x, mean_y = sum_x / count, sum_y / count
+        gram = gram - count * np.outer(mean_x, mean_x)
+        cross = cross - count * np.outer(mean_x, mean_y)
+
+        scale = np.sqrt(np.maximum(np.diag(gram), 0.0) / count)
+        scale[scale < 1e-12] = 1.0
+        gram = gram / np.outer(scale, scale)
+        cross = cross / scale[:, np.newaxis]
+
+        coef = np.linalg.solve(gram + alpha * count * np.eye(len(gram)), cross)
+        return coef, mean_y + shift_y, mean_x + shift_x, scale
+
+    @classmethod
+    def train(
+        cls,
+        timestamps,
+        values,
+        directory,
+        seq_length,
+        pred_length,
+        progress=None,
+        alpha=1e-3,
+    ):
+        n = window_count(len(values), seq_length, pred_length)
+        if n < 2:
+            raise ValueError(
+                f"{len(values)} readings is not enough for training windows"
+            )
+
+        train_index, test_index = _time_split(n)
+        solution = cls._solve(
+            timestamps, values, seq_length, pred_length, train_index, alpha
+        )
+        model = cls(*solution, seq_length)
+        squared_error, count = 0.0, 0
+        for X, y in iter_feature_chunks(
+            timestamps, values, seq_length, pred_length, test_index
+        ):
+            errors = model._predict_features(X) - y
+            squared_error += float(np.sum(errors**2))
+            count += errors.size
+        if progress is not None:
+            progress({"stage": "validated", "windows": len(train_index)})
+
+        coef, intercept, mean, scale = cls._solve(
+            timestamps, values, seq_length, pred_length, np.arange(n), alpha
+        )
+        np.savez(
+            os.path.join(directory, cls.MODEL_FILE),
+            coef=coef,
+            intercept=intercept,
+            mean=mean,
+            scale=scale,
+        )
+        return {"rmse": float(np.sqrt(squared_error / count)), "mode": "full"}
+
+    @classmethod
+    def load(cls, directory, metadata):
+        with np.load(os.path.join(directory, cls.MODEL_FILE)) as data:
+            return cls(
+                data["coef"],
+                data["intercept"],
+                data["mean"],
+                data["scale"],
+                metadata["seq_length"],
+            )
+
+    def _predict_features(self, X):
+        return ((X - self.mean) / self.scale) @ self.coef + self.intercept
+
+    def predict(self, timestamps, values):
+        values = np.asarray(values)[-self.seq_length :]
+        X, latest = lag_calendar_features(
+            np.asarray(timestamps)[-1:], values[np.newaxis, :], self.seq_length
+        )
+        return self._predict_features(X)[0] + latest[0]
+
+    def batch_key(self):
+        return super().batch_key() + self.coef.shape
+
+    @classmethod
+    def stack(cls, forecasters):
+        seq_length = forecasters[0].seq_length
+        coef = np.stack([f.coef for f in forecasters])
+        intercept = np.stack([f.intercept for f in forecasters])
+        mean = np.stack([f.mean for f in forecasters])
+        scale = np.stack([f.scale for f in forecasters])
+
+        def predict(timestamps, windows):
+            X, latest = lag_calendar_features(timestamps, windows, seq_length)
+            X = ((X - mean) / scale)[:, np.newaxis, :]
+            return (X @ coef)[:, 0, :] + intercept + latest[:, np.newaxis]
+
+        return predict
+
+
+class BatchPredictor:
+    """
+    One inference call per engine for the forecasts of many meters.
+    Meters whose forecasters share a `batch_key` are stacked together,
+    the stacked weights are kept until one of those forecasters changes.
+    """
+
+    def __init__(self):
+        self._stacks = {}  # batch key -> (forecasters, stacked predict)
+
+    def predict(self, forecasters, timestamps, windows):
+        """
+        Returns:
+        - numpy array (m, pred_length) of the forecasts for m meters given
+          their forecasters, latest reading times (m,) and input windows
+          (m, seq_length)
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        windows = np.asarray(windows, dtype=np.float64)
+        groups = {}
+        for i, forecaster in enumerate(forecasters):
+            groups.setdefault(forecaster.batch_key(), []).append(i)
+
+        forecasts = [None] * len(forecasters)
+        for key, index in groups.items():
+            members = [forecasters[i] for i in index]
+            cached = self._stacks.get(key)
+            if cached is None or len(cached[0]) != len(members) or any(
+                a is not b for a, b in zip(cached[0], members)
+            ):
+                cached = (members, type(members[0]).stack(members))
+                self._stacks[key] = cached
+            for i, forecast in zip(index, cached[1](timestamps[index], windows[index])):
+                forecasts[i] = forecast
+
+        # keys no meter uses any more would pin old models in memory
+        for key in set(self._stacks) - set(groups):
+            del self._stacks[key]
+        return np.stack(forecasts)
+
+
+FORECASTERS = {
+    engine.name: engine for engine in (LSTMForecaster, TreeForecaster, RidgeForecaster)
+}
+
+
+def get_forecaster(name):
+    try:
+        return FORECASTERS[name]
+    except KeyError:
+        raise ValueError(
+            f"unknown forecaster {name!r}, use one of {sorted(FORECASTERS)}"
+        ) from None
+
+
+def check_options(name, options):
+    """
+    Raise ValueError for training options engine `name` does not take,
+    so a misspelled INI key fails at startup instead of at training time
+    """
+    unknown = sorted(set(options) - set(get_forecaster(name).OPTIONS))
+    if unknown:
+        raise ValueError(
+            f"unknown {name} forecaster options {unknown}, "
+            f"use any of {list(get_forecaster(name).OPTIONS)}"
+        )
+    return options
+
+
+def load_forecaster(directory, metadata):
+    """
+    Returns:
+    - serving instance of the engine named in a registry version's
+      metadata, versions from before engines were pluggable are LSTMs
+    """
+    return get_forecaster(metadata.get("engine", "lstm")).load(directory, metadata)
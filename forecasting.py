@@ -0,0 +1,369 @@
+"""
+Model runtime for the power forecast.
+
+The LSTM is trained with Keras but serving one 1x120x1 window per minute
+through `model.predict` pays for graph dispatch, callbacks and keeping the
+whole TensorFlow runtime resident. After training the LSTM and Dense
+weights are exported to a .npz file and `NumpyLSTMModel` replays the same
+forward pass with plain numpy, no TensorFlow import needed.
+"""
+import numpy as np
+
+SUPPORTED_ACTIVATIONS = ("tanh", "sigmoid", "linear")
+
+
+def _activation_name(layer, attribute):
+    activation = getattr(layer, attribute, None)
+    if activation is None and hasattr(layer, "cell"):
+        activation = getattr(layer.cell, attribute)
+    name = getattr(activation, "__name__", str(activation))
+    if name not in SUPPORTED_ACTIVATIONS:
+        raise ValueError(f"{type(layer).__name__} {attribute} {name!r} is not supported")
+    return name
+
+
+class MinMaxScaling:
+    """
+    Numpy twin of sklearn's MinMaxScaler(feature_range=(0, 1)) so the
+    serving process can scale and unscale without importing sklearn.
+    The fitted range is saved next to the model weights.
+    """
+
+    def __init__(self, data_min=None, data_max=None):
+        self.data_min = None if data_min is None else np.asarray(data_min, dtype=np.float64)
+        self.data_max = None if data_max is None else np.asarray(data_max, dtype=np.float64)
+
+    @property
+    def _range(self):
+        data_range = self.data_max - self.data_min
+        # constant features scale by 1 like sklearn does
+        return np.where(data_range == 0.0, 1.0, data_range)
+
+    def fit(self, X):
+        X = np.asarray(X, dtype=np.float64).reshape(len(X), -1)
+        self.data_min = X.min(axis=0)
+        self.data_max = X.max(axis=0)
+        return self
+
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.data_min) / self._range
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    def inverse_transform(self, X):
+        return np.asarray(X, dtype=np.float64) * self._range + self.data_min
+
+    def to_arrays(self):
+        return {"scaler_data_min": self.data_min, "scaler_data_max": self.data_max}
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["scaler_data_min"], data["scaler_data_max"])
+
+
+def export_keras_lstm(model, path, **extra_arrays):
+    """
+    Save the weights of a Sequential stack of LSTM and Dense layers
+    (Dropout is skipped, it does nothing at inference) to a .npz file
+    that `NumpyLSTMModel.load` can read without TensorFlow.
+    `extra_arrays`, such as the scaler range, are stored alongside.
+    """
+    arrays, kinds = dict(extra_arrays), []
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind in ("InputLayer", "Dropout"):
+            continue
+
+        i = len(kinds)
+        if kind == "LSTM":
+            if _activation_name(layer, "activation") != "tanh" or _activation_name(
+                layer, "recurrent_activation"
+            ) != "sigmoid":
+                raise ValueError("only tanh/sigmoid LSTM layers can be exported")
+            kernel, recurrent_kernel, bias = layer.get_weights()
+            arrays[f"layer{i}_kernel"] = kernel
+            arrays[f"layer{i}_recurrent_kernel"] = recurrent_kernel
+            arrays[f"layer{i}_bias"] = bias
+            arrays[f"layer{i}_return_sequences"] = np.array(layer.return_sequences)
+        elif kind == "Dense":
+            if _activation_name(layer, "activation") != "linear":
+                raise ValueError("only linear Dense layers can be exported")
+            kernel, bias = layer.get_weights()
+            arrays[f"layer{i}_kernel"] = kernel
+            arrays[f"layer{i}_bias"] = bias
+        else:
+            raise ValueError(f"layer type {kind} cannot be exported to numpy")
+        kinds.append(kind)
+
+    np.savez(path, kinds=np.array(kinds), **arrays)
+
+
+class NumpyLSTMModel:
+    """
+    Pure numpy forward pass of a Keras LSTM/Dense stack, same output as
+    `model.predict` up to float rounding.
+
+    At this size the cost is numpy call overhead per time step, not
+    arithmetic, so the step loop is kept as short as possible:
+
+    - the input projection of the whole sequence is one matmul
+    - gates are reordered to (i, f, o, g) and the sigmoid gates pre-scaled
+      by 0.5, so one tanh over all gates gives tanh(z) for the candidate
+      and sigmoid(z) = 0.5 * tanh(z / 2) + 0.5 for the rest
+    - stacked LSTM layers run as one wavefront: step t advances layer l
+      at time t - l, which is a single wider LSTM with a block recurrent
+      matrix, so two layers of 120 steps cost 121 steps instead of 240
+
+    `stack` combines models of the same shape into one whose weights
+    carry a leading model axis, window i of a batch runs through model i
+    with the same number of numpy calls as a single window.
+    """
+
+    def __init__(self, layers, dtype=np.float32):
+        self.dtype = dtype
+        self.lstm_layers = []
+        self.dense_layers = []
+        self.stacked = False
+
+        for layer in layers:
+            if layer["kind"] == "LSTM":
+                if self.dense_layers:
+                    raise ValueError("LSTM layers must come before Dense layers")
+                self.lstm_layers.append(self._prepare_lstm(layer, dtype))
+            else:
+                self.dense_layers.append(
+                    (
+                        np.asarray(layer["kernel"], dtype=dtype),
+                        np.asarray(layer["bias"], dtype=dtype),
+                    )
+                )
+
+        self.return_sequences = bool(
+            self.lstm_layers and self.lstm_layers[-1]["return_sequences"]
+        )
+        if any(not layer["return_sequences"] for layer in self.lstm_layers[:-1]):
+            raise ValueError("inner LSTM layers must return sequences")
+        if self.lstm_layers and not self.return_sequences:
+            self._build_wavefront(dtype)
+
+    @staticmethod
+    def _prepare_lstm(layer, dtype):
+        units = layer["recurrent_kernel"].shape[0]
+        # Keras order is (i, f, g, o), move the tanh candidate last
+        order = np.concatenate(
+            [np.arange(k * units, (k + 1) * units) for k in (0, 1, 3, 2)]
+        )
+        scale = np.full(4 * units, 0.5)
+        scale[3 * units :] = 1.0
+        return {
+            "units": units,
+            "kernel": (layer["kernel"][:, order] * scale).astype(dtype),
+            "recurrent_kernel": (layer["recurrent_kernel"][:, order] * scale).astype(
+                dtype
+            ),
+            "bias": (layer["bias"][order] * scale).astype(dtype),
+            "return_sequences": bool(layer.get("return_sequences", False)),
+        }
+
+    def _build_wavefront(self, dtype):
+        units = [layer["units"] for layer in self.lstm_layers]
+        offsets = np.concatenate(([0], np.cumsum(units)))
+        total = int(offsets[-1])
+
+        def gate_columns(l, k):
+            # columns of gate k for layer l in the gate major fused layout
+            return slice(k * total + offsets[l], k * total + offsets[l + 1])
+
+        recurrent = np.zeros((total, 4 * total), dtype=dtype)
+        bias = np.zeros(4 * total, dtype=dtype)
+        for l, layer in enumerate(self.lstm_layers):
+            u = units[l]
+            rows = slice(offsets[l], offsets[l + 1])
+            for k in range(4):
+                cols = gate_columns(l, k)
+                recurrent[rows, cols] = layer["recurrent_kernel"][:, k * u : (k + 1) * u]
+                bias[cols] = layer["bias"][k * u : (k + 1) * u]
+                if l:
+                    below = slice(offsets[l - 1], offsets[l])
+                    recurrent[below, cols] = layer["kernel"][:, k * u : (k + 1) * u]
+
+        first = self.lstm_layers[0]
+        input_kernel = np.zeros((first["kernel"].shape[0], 4 * total), dtype=dtype)
+        for k in range(4):
+            input_kernel[:, gate_columns(0, k)] = first["kernel"][
+                :, k * units[0] : (k + 1) * units[0]
+            ]
+
+        self._fused = {
+            "total": total,
+            "offsets": offsets,
+            "recurrent_kernel": recurrent,
+            "input_kernel": input_kernel,
+            "bias": bias,
+        }
+
+    @classmethod
+    def load(cls, path, dtype=np.float32):
+        with np.load(path) as data:
+            layers = []
+            for i, kind in enumerate(data["kinds"]):
+                layer = {"kind": str(kind)}
+                for name in ("kernel", "recurrent_kernel", "bias", "return_sequences"):
+                    key = f"layer{i}_{name}"
+                    if key in data:
+                        layer[name] = data[key]
+                layers.append(layer)
+        return cls(layers, dtype=dtype)
+
+    def shape_key(self):
+        """
+        Returns:
+        - tuple of the weight shapes, models with equal keys can be stacked
+        """
+        shapes = [layer["kernel"].shape for layer in self.lstm_layers]
+        shapes += [kernel.shape for kernel, _ in self.dense_layers]
+        return self.return_sequences, tuple(shapes)
+
+    @classmethod
+    def stack(cls, models):
+        """
+        Returns:
+        - NumpyLSTMModel running model i on window i of a batch of
+          len(models) windows, the models must share `shape_key()` and
+          end with a single sequence
+        """
+        first = models[0]
+        if first.stacked or first.return_sequences or not first.lstm_layers:
+            raise ValueError("only LSTM models returning one output can be stacked")
+        if any(model.shape_key() != first.shape_key() for model in models):
+            raise ValueError("stacked models must have the same weight shapes")
+
+        stacked = cls.__new__(cls)
+        stacked.dtype = first.dtype
+        stacked.lstm_layers = first.lstm_layers  # only their sizes are used
+        stacked.return_sequences = False
+        stacked.stacked = True
+        stacked.dense_layers = [
+            (
+                np.stack([model.dense_layers[i][0] for model in models]),
+                np.stack([model.dense_layers[i][1] for model in models]),
+            )
+            for i in range(len(first.dense_layers))
+        ]
+        stacked._fused = dict(
+            first._fused,
+            **{
+                name: np.stack([model._fused[name] for model in models])
+                for name in ("recurrent_kernel", "input_kernel", "bias")
+            },
+        )
+        return stacked
+
+    @classmethod
+    def from_keras(cls, model, dtype=np.float32):
+        import io
+
+        buffer = io.BytesIO()
+        export_keras_lstm(model, buffer)
+        buffer.seek(0)
+        return cls.load(buffer, dtype=dtype)
+
+    @staticmethod
+    def _run_cell(z_inputs, recurrent_kernel, units, steps, outputs=None, reset=None):
+        """
+        Step loop shared by the single layer and fused paths. `z_inputs`
+        is (steps, batch, 4 * units) with the bias already added, a 3-d
+        `recurrent_kernel` holds one matrix per batch row.
+        """
+        batch = z_inputs.shape[1]
+        dtype = z_inputs.dtype
+        h = np.zeros((batch, units), dtype=dtype)
+        c = np.zeros((batch, units), dtype=dtype)
+        z = np.empty((batch, 4 * units), dtype=dtype)
+        per_row = recurrent_kernel.ndim == 3
+        h_rows = h[:, np.newaxis, :]
+        z_rows = z[:, np.newaxis, :]
+
+        # views into the fixed buffers are made once, not per step
+        sigmoid_gates = z[:, : 3 * units]
+        i_gate = z[:, :units]
+        f_gate = z[:, units : 2 * units]
+        o_gate = z[:, 2 * units : 3 * units]
+        g_gate = z[:, 3 * units :]
+
+        for t in range(steps):
+            if per_row:
+                np.matmul(h_rows, recurrent_kernel, out=z_rows)
+            else:
+                np.dot(h, recurrent_kernel, out=z)
+            z += z_inputs[t]
+            np.tanh(z, out=z)
+            sigmoid_gates *= 0.5
+            sigmoid_gates += 0.5
+            c *= f_gate
+            g_gate *= i_gate
+            c += g_gate
+            np.tanh(c, out=h)
+            h *= o_gate
+            if outputs is not None:
+                outputs[t] = h
+            if reset is not None and t < len(reset):
+                # layers that have not reached time 0 yet stay at zero state
+                h[:, reset[t] :] = 0.0
+                c[:, reset[t] :] = 0.0
+        return h
+
+    def _lstm_sequence(self, x, layer):
+        steps = x.shape[1]
+        z_inputs = np.ascontiguousarray(
+            (x @ layer["kernel"] + layer["bias"]).transpose(1, 0, 2)
+        )
+        outputs = np.empty((steps, x.shape[0], layer["units"]), dtype=x.dtype)
+        self._run_cell(
+            z_inputs, layer["recurrent_kernel"], layer["units"], steps, outputs
+        )
+        return outputs.transpose(1, 0, 2)
+
+    def _lstm_wavefront(self, x):
+        fused = self._fused
+        depth = len(self.lstm_layers)
+        batch, steps, _ = x.shape
+        extra = depth - 1
+
+        z_inputs = np.empty((steps + extra, batch, 4 * fused["total"]), dtype=x.dtype)
+        z_inputs[:steps] = (x @ fused["input_kernel"]).transpose(1, 0, 2)
+        z_inputs[steps:] = 0.0
+        z_inputs += fused["bias"]
+
+        h = self._run_cell(
+            z_inputs,
+            fused["recurrent_kernel"],
+            fused["total"],
+            steps + extra,
+            reset=[int(fused["offsets"][t + 1]) for t in range(extra)],
+        )
+        return h[:, fused["offsets"][-2] :]
+
+    def predict(self, x):
+        """
+        Returns:
+        - numpy array (batch, outputs) for x of shape (batch, steps, features)
+        """
+        x = np.asarray(x, dtype=self.dtype)
+        if x.ndim == 2:
+            x = x[:, :, np.newaxis]
+
+        if self.lstm_layers and not self.return_sequences:
+            x = self._lstm_wavefront(x)
+        else:
+            for layer in self.lstm_layers:
+                x = self._lstm_sequence(x, layer)
+
+        for kernel, bias in self.dense_layers:
+            if self.stacked:
+                x = (x[:, np.newaxis, :] @ kernel)[:, 0, :] + bias
+            else:
+                x = x @ kernel + bias
+        return x
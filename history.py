@@ -0,0 +1,577 @@
+"""
+In-memory history of power meter readings used by the forecasting loop.
+
+The BACnet servers append one reading per INTERVAL and every analytics
+step (forecast input window, rate of change, percentiles, training) reads
+from here instead of re-parsing the CSV log on each tick.
+"""
+from collections import deque
+from datetime import datetime
+from math import isfinite, log
+from random import random
+
+import numpy as np
+
+
+class HistoryBuffer:
+    """
+    Fixed capacity circular buffer of (timestamp, value) readings backed
+    by preallocated numpy arrays. Appends are O(1) and once the buffer is
+    full the oldest reading is overwritten.
+
+    Timestamps are stored as float epoch seconds, values as float64.
+    Arrays returned by `timestamps()` and `values()` may be views into the
+    buffer, copy them if they need to outlive the next append.
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("HistoryBuffer capacity must be at least 1")
+        self.capacity = int(capacity)
+        self._timestamps = np.empty(self.capacity, dtype=np.float64)
+        self._values = np.empty(self.capacity, dtype=np.float64)
+        self._head = 0  # next write position
+        self._size = 0
+        self.total_count = 0  # readings ever appended, numbers trend log records
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __iter__(self):
+        for timestamp, value in zip(self.timestamps(), self.values()):
+            yield datetime.fromtimestamp(timestamp), float(value)
+
+    def append(self, timestamp, value):
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+
+        self._timestamps[self._head] = timestamp
+        self._values[self._head] = value
+        self._head = (self._head + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+        self.total_count += 1
+
+    def extend(self, timestamps, values):
+        """
+        Bulk append, used when warm starting from a stored history.
+        Only the newest `capacity` readings are kept.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)[-self.capacity :]
+        values = np.asarray(values, dtype=np.float64)[-self.capacity :]
+        n = len(values)
+        if n == 0:
+            return
+
+        first = min(n, self.capacity - self._head)
+        self._timestamps[self._head : self._head + first] = timestamps[:first]
+        self._values[self._head : self._head + first] = values[:first]
+        self._timestamps[: n - first] = timestamps[first:]
+        self._values[: n - first] = values[first:]
+
+        self._head = (self._head + n) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+        self.total_count += n
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+
+    def _ordered(self, array, n):
+        n = self._size if n is None else min(int(n), self._size)
+        start = (self._head - n) % self.capacity
+        if start + n <= self.capacity:
+            return array[start : start + n]
+        return np.concatenate((array[start:], array[: start + n - self.capacity]))
+
+    def timestamps(self, n=None):
+        """
+        Returns:
+        - numpy array of the last `n` epoch timestamps (all when None), oldest first
+        """
+        return self._ordered(self._timestamps, n)
+
+    def values(self, n=None):
+        """
+        Returns:
+        - numpy array of the last `n` values (all when None), oldest first
+        """
+        return self._ordered(self._values, n)
+
+    def last(self):
+        """
+        Returns:
+        - tuple of the newest (epoch timestamp, value) or (None, None) if empty
+        """
+        if not self._size:
+            return None, None
+        idx = (self._head - 1) % self.capacity
+        return float(self._timestamps[idx]), float(self._values[idx])
+
+
+class ColumnarRing:
+    """
+    Fixed capacity ring of timestamped rows with one preallocated numpy
+    column per name, the multi column sibling of HistoryBuffer. Appends
+    are O(1) and memory use is fixed at construction.
+
+    `to_frame()` materializes a pandas DataFrame on demand and reuses it
+    until the next append, so training gets the familiar DataFrame without
+    the per tick concat and sort.
+    """
+
+    def __init__(self, capacity, columns, dtype=np.float64):
+        if capacity < 1:
+            raise ValueError("ColumnarRing capacity must be at least 1")
+        self.capacity = int(capacity)
+        self.columns = tuple(columns)
+        self._index = {name: i for i, name in enumerate(self.columns)}
+        self._timestamps = np.empty(self.capacity, dtype=np.float64)
+        self._data = np.empty((self.capacity, len(self.columns)), dtype=dtype)
+        self._head = 0
+        self._size = 0
+        self.total_count = 0
+        self._frame = None
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp, row):
+        """
+        Append one row, given as a mapping of column name to value or a
+        sequence ordered like `columns`
+        """
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        if isinstance(row, dict):
+            row = [row[name] for name in self.columns]
+
+        self._timestamps[self._head] = timestamp
+        self._data[self._head] = row
+        self._head = (self._head + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+        self.total_count += 1
+        self._frame = None
+
+    def extend(self, timestamps, rows):
+        """
+        Bulk append of epoch second timestamps and a (n, len(columns)) array
+        """
+        rows = np.asarray(rows).reshape(-1, len(self.columns))[-self.capacity :]
+        timestamps = np.asarray(timestamps, dtype=np.float64)[-self.capacity :]
+        n = len(rows)
+        if n == 0:
+            return
+
+        first = min(n, self.capacity - self._head)
+        self._timestamps[self._head : self._head + first] = timestamps[:first]
+        self._data[self._head : self._head + first] = rows[:first]
+        self._timestamps[: n - first] = timestamps[first:]
+        self._data[: n - first] = rows[first:]
+
+        self._head = (self._head + n) % self.capacity
+        self._size = min(self._size + n, self.capacity)
+        self.total_count += n
+        self._frame = None
+
+    def _ordered(self, array, n):
+        n = self._size if n is None else min(int(n), self._size)
+        start = (self._head - n) % self.capacity
+        if start + n <= self.capacity:
+            return array[start : start + n]
+        return np.concatenate((array[start:], array[: start + n - self.capacity]))
+
+    def timestamps(self, n=None):
+        return self._ordered(self._timestamps, n)
+
+    def column(self, name, n=None):
+        """
+        Returns:
+        - numpy array of the last `n` values of one column, oldest first
+        """
+        return self._ordered(self._data[:, self._index[name]], n)
+
+    def rows(self, n=None):
+        """
+        Returns:
+        - numpy array (n, len(columns)) of the last `n` rows, oldest first
+        """
+        return self._ordered(self._data, n)
+
+    def last(self, name):
+        if not self._size:
+            return None
+        return self._data[(self._head - 1) % self.capacity, self._index[name]].item()
+
+    def to_frame(self):
+        """
+        Returns:
+        - pandas DataFrame indexed by UTC timestamp, oldest row first
+        """
+        if self._frame is None:
+            import pandas as pd
+
+            index = pd.to_datetime(self.timestamps(), unit="s")
+            self._frame = pd.DataFrame(
+                self.rows(),
+                index=index,
+                columns=self.columns,
+                copy=True,
+            )
+        return self._frame
+
+
+class _SkiplistNode:
+    __slots__ = ("value", "next", "width")
+
+    def __init__(self, value, next, width):
+        self.value = value
+        self.next = next
+        self.width = width
+
+
+class IndexableSkiplist:
+    """
+    Sorted multiset of floats with expected O(log n) insert, remove and
+    lookup by rank. Each link stores how many items it skips so the i-th
+    smallest value can be found without walking the bottom level.
+    """
+
+    def __init__(self, expected_size=1024):
+        self.size = 0
+        self.maxlevels = int(1 + log(max(expected_size, 2), 2))
+        self._nil = _SkiplistNode(float("inf"), [], [])
+        self._head = _SkiplistNode(
+            None, [self._nil] * self.maxlevels, [1] * self.maxlevels
+        )
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("skiplist index out of range")
+
+        node = self._head
+        i += 1
+        for level in reversed(range(self.maxlevels)):
+            while node.width[level] <= i:
+                i -= node.width[level]
+                node = node.next[level]
+        return node.value
+
+    def insert(self, value):
+        if not isfinite(value):
+            raise ValueError(f"cannot index non-finite value {value!r}")
+
+        # last node on each level whose successor is greater than value
+        chain = [None] * self.maxlevels
+        steps_at_level = [0] * self.maxlevels
+        node = self._head
+        for level in reversed(range(self.maxlevels)):
+            while node.next[level].value <= value:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        depth = min(self.maxlevels, 1 - int(log(1.0 - random(), 2.0)))
+        new_node = _SkiplistNode(value, [None] * depth, [None] * depth)
+        steps = 0
+        for level in range(depth):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(depth, self.maxlevels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, value):
+        chain = [None] * self.maxlevels
+        node = self._head
+        for level in reversed(range(self.maxlevels)):
+            while node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+
+        if value != chain[0].next[0].value:
+            raise KeyError(value)
+
+        depth = len(chain[0].next[0].next)
+        for level in range(depth):
+            prev_node = chain[level]
+            prev_node.width[level] += prev_node.next[level].width[level] - 1
+            prev_node.next[level] = prev_node.next[level].next[level]
+        for level in range(depth, self.maxlevels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+
+class SlidingPercentiles:
+    """
+    Incrementally maintained order statistics over the readings of a
+    trailing time window. Pushing a reading and expiring the oldest ones
+    cost O(log n) each and a percentile query costs O(log n), so the peak
+    and valley checks no longer scale with how much history is kept.
+    NaN and infinite readings have no rank and are left out.
+    """
+
+    def __init__(self, window_seconds, expected_size=1024):
+        self.window_seconds = float(window_seconds)
+        self._readings = deque()
+        self._sorted = IndexableSkiplist(expected_size)
+
+    def __len__(self):
+        return len(self._readings)
+
+    def push(self, timestamp, value):
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        value = float(value)
+
+        if isfinite(value):
+            self._sorted.insert(value)
+            self._readings.append((timestamp, value))
+        self.expire(timestamp)
+
+    def expire(self, now):
+        """
+        Drop readings older than the window relative to `now` epoch seconds
+        """
+        oldest_allowed = now - self.window_seconds
+        while self._readings and self._readings[0][0] < oldest_allowed:
+            _, value = self._readings.popleft()
+            self._sorted.remove(value)
+
+    def percentile(self, q):
+        """
+        Linear interpolation between closest ranks, same as the numpy
+        default so results match `np.percentile` over the window.
+
+        Returns:
+        - float or None if the window is empty
+        """
+        n = len(self._sorted)
+        if not n:
+            return None
+
+        rank = (n - 1) * q / 100.0
+        lower = int(rank)
+        fraction = rank - lower
+        lower_value = self._sorted[lower]
+        if fraction == 0.0 or lower + 1 >= n:
+            return lower_value
+        return lower_value + (self._sorted[lower + 1] - lower_value) * fraction
+
+
+class RollingStats:
+    """
+    Online statistics of a reading stream, updated once per sample in O(1).
+
+    Keeps the instantaneous slope, the mean slope over the last `window`
+    samples, an EWMA and the mean, variance, min and max of the last
+    `window` values. Slopes are in value units per second.
+    """
+
+    def __init__(self, window=15, ewma_alpha=None):
+        if window < 1:
+            raise ValueError("RollingStats window must be at least 1")
+        self.window = int(window)
+        self.ewma_alpha = 2.0 / (window + 1) if ewma_alpha is None else ewma_alpha
+
+        # window + 1 readings give `window` slopes
+        self._readings = deque(maxlen=self.window + 1)
+        self._min_candidates = deque()  # (sequence, value) increasing values
+        self._max_candidates = deque()  # (sequence, value) decreasing values
+        self._sequence = 0
+        self._shift = None  # keeps the running sums well conditioned
+        self._sum = 0.0
+        self._sum_sq = 0.0
+
+        self.slope = None
+        self.mean_slope = None
+        self.ewma = None
+
+    def __len__(self):
+        return min(len(self._readings), self.window)
+
+    def update(self, timestamp, value):
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        value = float(value)
+
+        if self._readings:
+            last_timestamp, last_value = self._readings[-1]
+            dt = timestamp - last_timestamp
+            self.slope = (value - last_value) / dt if dt > 0 else 0.0
+        else:
+            self.slope = 0.0
+
+        if self._shift is None:
+            self._shift = value
+        self._readings.append((timestamp, value))
+
+        shifted = value - self._shift
+        self._sum += shifted
+        self._sum_sq += shifted * shifted
+        if len(self._readings) > self.window:
+            # the oldest reading only anchors the slope, drop it from the sums
+            expired = self._readings[0][1] - self._shift
+            self._sum -= expired
+            self._sum_sq -= expired * expired
+
+        first_timestamp, first_value = self._readings[0]
+        span = timestamp - first_timestamp
+        self.mean_slope = (value - first_value) / span if span > 0 else self.slope
+
+        self.ewma = (
+            value
+            if self.ewma is None
+            else self.ewma + self.ewma_alpha * (value - self.ewma)
+        )
+
+        oldest_sequence = self._sequence - self.window + 1
+        while self._min_candidates and self._min_candidates[-1][1] >= value:
+            self._min_candidates.pop()
+        self._min_candidates.append((self._sequence, value))
+        while self._min_candidates[0][0] < oldest_sequence:
+            self._min_candidates.popleft()
+
+        while self._max_candidates and self._max_candidates[-1][1] <= value:
+            self._max_candidates.pop()
+        self._max_candidates.append((self._sequence, value))
+        while self._max_candidates[0][0] < oldest_sequence:
+            self._max_candidates.popleft()
+
+        self._sequence += 1
+
+    @property
+    def mean(self):
+        n = len(self)
+        return self._shift + self._sum / n if n else None
+
+    @property
+    def variance(self):
+        n = len(self)
+        if not n:
+            return None
+        mean_shifted = self._sum / n
+        return max(self._sum_sq / n - mean_shifted * mean_shifted, 0.0)
+
+    @property
+    def min(self):
+        return self._min_candidates[0][1] if self._min_candidates else None
+
+    @property
+    def max(self):
+        return self._max_candidates[0][1] if self._max_candidates else None
+
+
+class GridResampler:
+    """
+    Turns irregular timestamped writes into a regular grid of
+    `interval` second buckets aligned to the epoch. Each written value
+    holds until the next write, like a BACnet presentValue, and a bucket
+    reports the time weighted mean and the max of what it held, so a
+    spike written between two polls still moves the minute value.
+
+    A value is held for at most `max_hold` seconds after its write,
+    buckets with nothing held are skipped rather than filled with a
+    stale repeat, so a BAS that stops writing leaves a gap.
+    """
+
+    def __init__(self, interval=60.0, max_hold=300.0):
+        if interval <= 0:
+            raise ValueError("GridResampler interval must be positive")
+        self.interval = float(interval)
+        self.max_hold = float(max_hold)
+        self._bucket = None  # start of the bucket being filled
+        self._cursor = None  # time integrated up to
+        self._value = None
+        self._last_write = None
+        self._reset_bucket()
+        self._ready = []
+
+    def _reset_bucket(self):
+        self._weighted = 0.0
+        self._covered = 0.0
+        self._max = None
+        self._writes = 0
+
+    def _hold_end(self):
+        return self._last_write + self.max_hold
+
+    def _finish_bucket(self):
+        if self._covered > 0:
+            self._ready.append(
+                (self._bucket, self._weighted / self._covered, self._max, self._writes)
+            )
+        self._bucket += self.interval
+        self._reset_bucket()
+        if self._value is not None and self._hold_end() > self._bucket:
+            # the held value carries into the new bucket
+            self._max = self._value
+
+    def _integrate(self, until):
+        while self._cursor < until:
+            if self._writes == 0 and (
+                self._value is None or self._hold_end() <= self._cursor
+            ):
+                # nothing held, jump straight to the bucket holding `until`
+                bucket = until // self.interval * self.interval
+                if bucket > self._bucket:
+                    self._bucket, self._cursor = bucket, bucket
+                    self._reset_bucket()
+                    continue
+
+            bucket_end = self._bucket + self.interval
+            step_end = min(until, bucket_end)
+            if self._value is not None:
+                held = min(step_end, self._hold_end()) - self._cursor
+                if held > 0:
+                    self._weighted += self._value * held
+                    self._covered += held
+            self._cursor = step_end
+            if step_end >= bucket_end:
+                self._finish_bucket()
+
+    def add(self, timestamp, value):
+        """
+        Record a write, writes are expected in time order and an older
+        timestamp is treated as arriving now
+        """
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        value = float(value)
+
+        if self._bucket is None:
+            self._bucket = timestamp // self.interval * self.interval
+            self._cursor = timestamp
+        timestamp = max(timestamp, self._cursor)
+
+        self._integrate(timestamp)
+        self._value = value
+        self._last_write = timestamp
+        self._max = value if self._max is None else max(self._max, value)
+        self._writes += 1
+
+    def close(self, now):
+        """
+        Returns:
+        - list of (bucket start, mean, max, writes) for every bucket that
+          ended by `now` and held a value, oldest first
+        """
+        if isinstance(now, datetime):
+            now = now.timestamp()
+        if self._bucket is not None:
+            self._integrate(now)
+        ready, self._ready = self._ready, []
+        return ready
@@ -0,0 +1,113 @@
+"""
+Staged forecasting pipeline around the single bacpypes core thread.
+
+The core thread ingests readings and publishes results to the BACnet
+objects, everything slower runs as a stage function on one worker
+thread. Jobs and results are handed over through LatestSlot, a one
+element deque whose append and popleft are atomic in CPython, so neither
+thread takes a lock and the reader only ever sees the newest item. The
+worker holds at most one job: a tick that arrives while it is still busy
+is coalesced into the next one instead of queued behind it.
+"""
+import collections
+import logging
+import threading
+
+_log = logging.getLogger(__name__)
+
+
+class LatestSlot:
+    """
+    Single item handoff between two threads, a put replaces an item that
+    was never taken
+    """
+
+    def __init__(self):
+        self._slot = collections.deque(maxlen=1)
+
+    def put(self, item):
+        self._slot.append(item)
+
+    def take(self):
+        """
+        Returns:
+        - the newest item put since the last take, None if there is none
+        """
+        try:
+            return self._slot.popleft()
+        except IndexError:
+            return None
+
+
+class AnalyticsWorker:
+    """
+    Daemon thread running `stage(job)` for one job at a time. Results go
+    to the `results` slot and `on_result` is called from the worker
+    thread after each one, e.g. to schedule the publish on the core
+    thread. A stage that raises is logged with its traceback and produces
+    no result, its job goes to the `failed` slot so the submitter can
+    send again whatever the stage did not get to.
+    """
+
+    def __init__(self, stage, on_result=None, name="analytics"):
+        self.stage = stage
+        self.on_result = on_result
+        self.results = LatestSlot()
+        self.failed = LatestSlot()
+        self.submitted = 0
+        self.coalesced = 0
+        self.failures = 0
+        self._jobs = LatestSlot()
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self):
+        return not self._idle.is_set()
+
+    def submit(self, job):
+        """
+        Hand `job` to the worker, only ever called from one thread
+
+        Returns:
+        - bool True if the worker took the job, False if it is still busy
+          with the previous one and this tick was coalesced
+        """
+        if self.busy:
+            self.coalesced += 1
+            return False
+        self._idle.clear()
+        self._jobs.put(job)
+        self.submitted += 1
+        self._wake.set()
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopping:
+                return
+            job = self._jobs.take()
+            if job is None:
+                continue
+            try:
+                self.results.put(self.stage(job))
+            except Exception:
+                _log.exception("analytics stage failed, job %d", self.submitted)
+                self.failures += 1
+                self.failed.put(job)
+                self._idle.set()
+                continue
+            self._idle.set()
+            if self.on_result is not None:
+                self.on_result()
+
+    def stop(self, timeout=5.0):
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(timeout)
@@ -0,0 +1,183 @@
+"""
+Versioned on-disk registry of trained forecast models.
+
+Every training run is staged in a scratch directory and published as a
+new immutable version directory holding the files of its forecasting
+engine (for the LSTM the serving weights and scaler plus the Keras
+checkpoint used to warm start the next run) and metadata.json with the
+engine name and metrics. A CURRENT file names the version being served.
+Both the version directory and the pointer are switched with a rename,
+so a crash mid-write leaves the previous model untouched, and older
+versions are kept for rollback.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections import namedtuple
+
+from forecasters import load_forecaster
+
+_log = logging.getLogger(__name__)
+
+METADATA_FILE = "metadata.json"
+CURRENT_FILE = "CURRENT"
+STAGING_PREFIX = ".staging-"
+
+# loaded forecaster and metadata of one version, swapped in as a unit
+ModelBundle = namedtuple("ModelBundle", ("version", "forecaster", "metadata"))
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ModelRegistry:
+    """
+    Directory of numbered model versions plus a CURRENT pointer,
+    `keep_versions` of the newest versions survive pruning and the one
+    being served is never deleted
+    """
+
+    def __init__(self, directory="models", keep_versions=5):
+        if keep_versions < 2:
+            raise ValueError("keep_versions must be at least 2 to allow rollback")
+        self.directory = directory
+        self.keep_versions = int(keep_versions)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, version, filename=None):
+        path = os.path.join(self.directory, version)
+        return path if filename is None else os.path.join(path, filename)
+
+    def versions(self):
+        """
+        Returns:
+        - list of published version names, oldest first
+        """
+        return sorted(
+            name
+            for name in os.listdir(self.directory)
+            if name.isdigit() and os.path.isdir(self.path(name))
+        )
+
+    def current_version(self):
+        """
+        Returns:
+        - str version named by CURRENT, None before the first publish
+        """
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE)) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return version if version and os.path.isdir(self.path(version)) else None
+
+    def metadata(self, version):
+        with open(self.path(version, METADATA_FILE)) as f:
+            return json.load(f)
+
+    def staging(self):
+        """
+        Returns:
+        - path of a fresh scratch directory to train into, on the same
+          filesystem as the versions so publishing is a rename
+        """
+        return tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=self.directory)
+
+    def discard(self, staging):
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def publish(self, staging, metadata, make_current=True):
+        """
+        Write metadata into `staging`, fsync it, rename it to the next
+        version number and point CURRENT at it
+
+        Returns:
+        - str new version name
+        """
+        metadata = dict(metadata, published_at=time.time())
+        with open(os.path.join(staging, METADATA_FILE), "w") as f:
+            json.dump(metadata, f, indent=2, sort_keys=True)
+
+        for name in os.listdir(staging):
+            with open(os.path.join(staging, name), "rb") as f:
+                os.fsync(f.fileno())
+
+        versions = self.versions()
+        version = f"{int(versions[-1]) + 1 if versions else 1:06d}"
+        os.rename(staging, self.path(version))
+        _fsync_path(self.directory)
+        _log.info(f"published model version {version}")
+
+        if make_current:
+            self.promote(version)
+        self.prune()
+        return version
+
+    def promote(self, version):
+        """
+        Atomically point CURRENT at `version`
+        """
+        if not os.path.isdir(self.path(version)):
+            raise ValueError(f"unknown model version {version!r}")
+
+        pointer = os.path.join(self.directory, CURRENT_FILE)
+        with open(pointer + ".tmp", "w") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer + ".tmp", pointer)
+        _fsync_path(self.directory)
+
+    def rollback(self):
+        """
+        Point CURRENT at the version published before the current one
+
+        Returns:
+        - str version now current
+        """
+        versions = self.versions()
+        current = self.current_version()
+        older = [v for v in versions if current is None or v < current]
+        if not older:
+            raise ValueError("no older model version to roll back to")
+        self.promote(older[-1])
+        _log.info(f"rolled back model from {current} to {older[-1]}")
+        return older[-1]
+
+    def prune(self):
+        current = self.current_version()
+        for version in self.versions()[: -self.keep_versions]:
+            if version != current:
+                shutil.rmtree(self.path(version), ignore_errors=True)
+
+        # scratch directories of runs that died before publishing
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(STAGING_PREFIX) and time.time() - os.path.getmtime(
+                path
+            ) > 86400:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def load(self, version=None):
+        """
+        Load the forecaster of `version`, the current one by default
+
+        Returns:
+        - ModelBundle, None if nothing has been published yet
+        """
+        version = self.current_version() if version is None else version
+        if version is None:
+            return None
+
+        metadata = self.metadata(version)
+        return ModelBundle(
+            version, load_forecaster(self.path(version), metadata), metadata
+        )
@@ -0,0 +1,723 @@
+"""
+Persistent history stores for power meter readings.
+
+The forecasting loop keeps its working set in memory (see history.py),
+these stores are the durable log that survives restarts and is mapped
+for model training.
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import chain
+
+import numpy as np
+
+EPOCH_SCALE = 1_000_000  # timestamps are stored as int64 epoch microseconds
+CSV_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+SECONDS_PER_DAY = 86400
+US_PER_DAY = SECONDS_PER_DAY * EPOCH_SCALE
+
+# none: leave writes in process buffers, flush: hand them to the OS,
+# fsync: wait until they are on disk
+DURABILITY_MODES = ("none", "flush", "fsync")
+
+
+def check_durability(durability):
+    if durability not in DURABILITY_MODES:
+        raise ValueError(
+            f"unknown durability {durability!r}, use one of {DURABILITY_MODES}"
+        )
+    return durability
+
+
+def to_epoch_us(timestamp):
+    """
+    Convert a datetime or float epoch seconds to int64 epoch microseconds
+    """
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.timestamp()
+    return int(round(timestamp * EPOCH_SCALE))
+
+
+class ColumnarHistoryStore:
+    """
+    Append-only binary store with an int64 epoch microsecond column and
+    one float64 column per value, split into one segment per UTC day.
+
+    Every column of a segment is its own flat file so a range read is a
+    memory map plus a binary search on the timestamp column. Ranges that
+    fall inside one segment come back as zero-copy views, longer ranges
+    are concatenated. Segments older than `retention_days` are deleted
+    when a new day starts. `durability` decides whether each append is
+    flushed to the OS or also fsynced.
+
+    The binary search needs every segment sorted, so readings older than
+    the newest stored one are dropped and counted in `dropped`.
+    """
+
+    TIMESTAMP_COLUMN = "timestamp"
+
+    def __init__(
+        self, directory, columns=("value",), retention_days=None, durability="flush"
+    ):
+        self.directory = directory
+        self.columns = tuple(columns)
+        self.retention_days = retention_days
+        self.durability = check_durability(durability)
+        self._lock = threading.Lock()
+        self._segment = None
+        self._files = {}
+        self._last_timestamp = None
+        self.dropped = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self.segments()
+        if segments:
+            self._segment = segments[-1]
+            self._last_timestamp = self._newest_timestamp(self._segment)
+
+    def _path(self, segment, column):
+        suffix = "i8" if column == self.TIMESTAMP_COLUMN else "f8"
+        return os.path.join(self.directory, f"{segment}.{column}.{suffix}")
+
+    @staticmethod
+    def _segment_name(day):
+        return datetime.fromtimestamp(
+            int(day) * SECONDS_PER_DAY, tz=timezone.utc
+        ).strftime("%Y%m%d")
+
+    @staticmethod
+    def _segment_day(segment):
+        day = datetime.strptime(segment, "%Y%m%d").replace(tzinfo=timezone.utc)
+        return int(day.timestamp()) // SECONDS_PER_DAY
+
+    @classmethod
+    def _segment_for(cls, epoch_us):
+        return cls._segment_name(epoch_us // US_PER_DAY)
+
+    def segments(self):
+        """
+        Returns:
+        - sorted list of segment names (UTC days as YYYYMMDD)
+        """
+        marker = f".{self.TIMESTAMP_COLUMN}.i8"
+        return sorted(
+            name[: -len(marker)]
+            for name in os.listdir(self.directory)
+            if name.endswith(marker)
+        )
+
+    def _newest_timestamp(self, segment):
+        path = self._path(segment, self.TIMESTAMP_COLUMN)
+        count = os.path.getsize(path) // 8
+        if not count:
+            return None
+        with open(path, "rb") as f:
+            f.seek((count - 1) * 8)
+            return int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+
+    def _open_segment(self, segment):
+        self._close_files()
+        self._segment = segment
+        for column in (self.TIMESTAMP_COLUMN,) + self.columns:
+            self._files[column] = open(self._path(segment, column), "ab")
+        if self.durability == "fsync":
+            # make the new segment files themselves survive a power cut
+            fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self._prune_locked(segment)
+
+    def _close_files(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def append(self, timestamp, values):
+        """
+        Append one reading, `values` is a float for a single column store
+        or a sequence ordered like `columns`
+        """
+        return self.append_many(
+            [to_epoch_us(timestamp)],
+            np.asarray(values, dtype=np.float64).reshape(1, len(self.columns)),
+        )
+
+    def append_many(self, timestamps, rows):
+        """
+        Append a batch of readings. `timestamps` are int64 epoch
+        microseconds and `rows` has shape (n, len(columns)).
+
+        Returns:
+        - int number of readings written, late ones are dropped
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.float64).reshape(len(timestamps), -1)
+        if not len(timestamps):
+            return 0
+
+        with self._lock:
+            # keep every segment sorted, drop readings behind the newest one
+            newest = np.maximum.accumulate(timestamps)
+            if self._last_timestamp is not None:
+                newest = np.maximum(newest, self._last_timestamp)
+            keep = timestamps >= newest
+            self.dropped += int(len(keep) - np.count_nonzero(keep))
+            timestamps, rows = timestamps[keep], rows[keep]
+            if not len(timestamps):
+                return 0
+
+            days = timestamps // US_PER_DAY
+            bounds = np.flatnonzero(np.diff(days)) + 1
+            for start, stop in zip(
+                np.concatenate(([0], bounds)), np.concatenate((bounds, [len(days)]))
+            ):
+                segment = self._segment_name(days[start])
+                if segment != self._segment or not self._files:
+                    self._open_segment(segment)
+
+                self._files[self.TIMESTAMP_COLUMN].write(
+                    timestamps[start:stop].tobytes()
+                )
+                for i, column in enumerate(self.columns):
+                    self._files[column].write(
+                        np.ascontiguousarray(rows[start:stop, i]).tobytes()
+                    )
+
+            self._last_timestamp = int(timestamps[-1])
+            self._sync_locked(self.durability)
+            return len(timestamps)
+
+    def _sync_locked(self, durability):
+        if durability == "none":
+            return
+        for f in self._files.values():
+            f.flush()
+            if durability == "fsync":
+                os.fsync(f.fileno())
+
+    def _map(self, segment, column):
+        paths = [self._path(segment, self.TIMESTAMP_COLUMN), self._path(segment, column)]
+        try:
+            # a torn write can leave one column a record short
+            count = min(os.path.getsize(path) for path in paths) // 8
+        except FileNotFoundError:
+            return None, None
+        if not count:
+            return None, None
+
+        timestamps = np.memmap(paths[0], dtype=np.int64, mode="r", shape=(count,))
+        values = np.memmap(paths[1], dtype=np.float64, mode="r", shape=(count,))
+        return timestamps, values
+
+    def iter_segments(self, start=None, end=None, column=None):
+        """
+        Yield zero-copy (timestamps, values) views per segment for readings
+        with start <= timestamp < end, both in epoch microseconds
+        """
+        column = self.columns[0] if column is None else column
+        if self.durability == "none":
+            # readers map the files, hand buffered rows to the OS first
+            self.flush()
+
+        first = self._segment_for(start) if start is not None else None
+        last = self._segment_for(end) if end is not None else None
+
+        for segment in self.segments():
+            if (first is not None and segment < first) or (
+                last is not None and segment > last
+            ):
+                continue
+
+            timestamps, values = self._map(segment, column)
+            if timestamps is None:
+                continue
+
+            lo = 0 if start is None else np.searchsorted(timestamps, start, "left")
+            hi = len(timestamps) if end is None else np.searchsorted(
+                timestamps, end, "left"
+            )
+            if hi > lo:
+                yield timestamps[lo:hi], values[lo:hi]
+
+    def read_range(self, start=None, end=None, column=None):
+        """
+        Read one column for start <= timestamp < end (epoch microseconds,
+        None for open ended), the first column when `column` is None.
+
+        Returns:
+        - tuple of numpy arrays (int64 epoch microseconds, float64 values)
+        """
+        parts = list(self.iter_segments(start, end, column))
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        if len(parts) == 1:
+            return parts[0]
+        return (
+            np.concatenate([timestamps for timestamps, _ in parts]),
+            np.concatenate([values for _, values in parts]),
+        )
+
+    def read_columns(self, start=None, end=None, columns=None):
+        """
+        Returns:
+        - tuple of (int64 epoch microseconds, float64 array of shape (n, len(columns)))
+        """
+        columns = self.columns if columns is None else tuple(columns)
+        timestamps, values = None, []
+        for column in columns:
+            column_timestamps, column_values = self.read_range(start, end, column)
+            if timestamps is None or len(column_timestamps) < len(timestamps):
+                timestamps = column_timestamps
+            values.append(column_values)
+
+        count = len(timestamps)
+        return timestamps, np.column_stack([v[:count] for v in values])
+
+    def tail(self, n, column=None):
+        """
+        Read the newest `n` readings of one column, mapping segments from
+        the newest backwards so the cost does not grow with the history.
+
+        Returns:
+        - tuple of numpy arrays (int64 epoch microseconds, float64 values)
+        """
+        column = self.columns[0] if column is None else column
+        if self.durability == "none":
+            self.flush()
+
+        parts, remaining = [], int(n)
+        for segment in reversed(self.segments()):
+            if remaining <= 0:
+                break
+            timestamps, values = self._map(segment, column)
+            if timestamps is None:
+                continue
+            parts.append((timestamps[-remaining:], values[-remaining:]))
+            remaining -= len(parts[-1][0])
+
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        if len(parts) == 1:
+            return parts[0]
+        parts.reverse()
+        return (
+            np.concatenate([timestamps for timestamps, _ in parts]),
+            np.concatenate([values for _, values in parts]),
+        )
+
+    def __len__(self):
+        return sum(
+            os.path.getsize(self._path(segment, self.TIMESTAMP_COLUMN)) // 8
+            for segment in self.segments()
+        )
+
+    def prune(self):
+        with self._lock:
+            self._prune_locked(self._segment)
+
+    def _prune_locked(self, newest_segment):
+        if not self.retention_days or newest_segment is None:
+            return
+
+        oldest_kept = self._segment_name(
+            self._segment_day(newest_segment) - self.retention_days
+        )
+        for segment in self.segments():
+            if segment >= oldest_kept:
+                break
+            for column in (self.TIMESTAMP_COLUMN,) + self.columns:
+                try:
+                    os.remove(self._path(segment, column))
+                except FileNotFoundError:
+                    pass
+
+    def flush(self):
+        with self._lock:
+            self._sync_locked("fsync" if self.durability == "fsync" else "flush")
+
+    def close(self):
+        with self._lock:
+            self._sync_locked(self.durability)
+            self._close_files()
+
+
+class SQLiteHistoryStore:
+    """
+    History store backed by a WAL mode SQLite table with one REAL column
+    per value and an index on the int64 epoch microsecond timestamp.
+
+    Appends are buffered and written in one transaction once `batch_size`
+    rows are pending or `commit_interval` seconds have passed. A daemon
+    thread does the timed commits and deletes rows older than
+    `retention_days`. Reads commit pending rows first and return numpy
+    arrays for just the requested window. `durability` maps onto the
+    SQLite synchronous setting.
+    """
+
+    TABLE = "readings"
+    SYNCHRONOUS = {"none": "OFF", "flush": "NORMAL", "fsync": "FULL"}
+
+    def __init__(
+        self,
+        path,
+        columns=("value",),
+        retention_days=None,
+        batch_size=60,
+        commit_interval=60.0,
+        prune_interval=3600.0,
+        durability="flush",
+    ):
+        for column in columns:
+            if not column.isidentifier():
+                raise ValueError(f"invalid history column name {column!r}")
+
+        self.path = path
+        self.columns = tuple(columns)
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.commit_interval = commit_interval
+        self.prune_interval = prune_interval
+        self.durability = check_durability(durability)
+        self._lock = threading.Lock()
+        self._pending = []
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={self.SYNCHRONOUS[self.durability]}")
+        column_defs = ", ".join(f"{column} REAL" for column in self.columns)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.TABLE} (ts INTEGER NOT NULL, {column_defs})"
+        )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.TABLE}_ts ON {self.TABLE} (ts)"
+        )
+        self._conn.commit()
+
+        self._insert_sql = (
+            f"INSERT INTO {self.TABLE} (ts, {', '.join(self.columns)}) "
+            f"VALUES ({', '.join('?' * (len(self.columns) + 1))})"
+        )
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._maintenance_loop, name="history-maintenance", daemon=True
+        )
+        self._thread.start()
+
+    def append(self, timestamp, values):
+        """
+        Queue one reading, `values` is a float for a single column store
+        or a sequence ordered like `columns`
+        """
+        row = np.asarray(values, dtype=np.float64).reshape(len(self.columns))
+        with self._lock:
+            self._pending.append((to_epoch_us(timestamp), *row.tolist()))
+            if len(self._pending) >= self.batch_size:
+                self._commit_locked()
+
+    def append_many(self, timestamps, rows):
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.float64).reshape(len(timestamps), -1)
+        with self._lock:
+            self._pending.extend(
+                (int(ts), *row) for ts, row in zip(timestamps, rows.tolist())
+            )
+            self._commit_locked()
+
+    def _commit_locked(self):
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(self._insert_sql, self._pending)
+        self._pending = []
+
+    def _query(self, columns, start, end):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(int(start))
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(int(end))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        with self._lock:
+            self._commit_locked()
+            rows = self._conn.execute(
+                f"SELECT ts, {', '.join(columns)} FROM {self.TABLE}{where} ORDER BY ts",
+                params,
+            ).fetchall()
+
+        width = len(columns) + 1
+        data = np.fromiter(
+            chain.from_iterable(rows), dtype=np.float64, count=len(rows) * width
+        ).reshape(len(rows), width)
+        return data[:, 0].astype(np.int64), data[:, 1:]
+
+    def read_range(self, start=None, end=None, column=None):
+        """
+        Read one column for start <= timestamp < end (epoch microseconds,
+        None for open ended), the first column when `column` is None.
+
+        Returns:
+        - tuple of numpy arrays (int64 epoch microseconds, float64 values)
+        """
+        column = self.columns[0] if column is None else column
+        if column not in self.columns:
+            raise KeyError(column)
+        timestamps, values = self._query((column,), start, end)
+        return timestamps, values[:, 0]
+
+    def read_columns(self, start=None, end=None, columns=None):
+        """
+        Returns:
+        - tuple of (int64 epoch microseconds, float64 array of shape (n, len(columns)))
+        """
+        columns = self.columns if columns is None else tuple(columns)
+        for column in columns:
+            if column not in self.columns:
+                raise KeyError(column)
+        return self._query(columns, start, end)
+
+    def tail(self, n, column=None):
+        """
+        Read the newest `n` readings of one column through the timestamp index
+
+        Returns:
+        - tuple of numpy arrays (int64 epoch microseconds, float64 values)
+        """
+        column = self.columns[0] if column is None else column
+        if column not in self.columns:
+            raise KeyError(column)
+
+        with self._lock:
+            self._commit_locked()
+            rows = self._conn.execute(
+                f"SELECT ts, {column} FROM {self.TABLE} ORDER BY ts DESC LIMIT ?",
+                (int(n),),
+            ).fetchall()
+
+        rows.reverse()
+        data = np.fromiter(
+            chain.from_iterable(rows), dtype=np.float64, count=len(rows) * 2
+        ).reshape(len(rows), 2)
+        return data[:, 0].astype(np.int64), data[:, 1]
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute(f"SELECT COUNT(*) FROM {self.TABLE}").fetchone()
+            return count + len(self._pending)
+
+    def prune(self):
+        if not self.retention_days:
+            return
+        oldest_kept = to_epoch_us(
+            datetime.now().timestamp() - self.retention_days * SECONDS_PER_DAY
+        )
+        with self._lock:
+            with self._conn:
+                self._conn.execute(f"DELETE FROM {self.TABLE} WHERE ts < ?", (oldest_kept,))
+
+    def _maintenance_loop(self):
+        last_prune = 0.0
+        while not self._stop.wait(self.commit_interval):
+            try:
+                with self._lock:
+                    self._commit_locked()
+                if time.monotonic() - last_prune >= self.prune_interval:
+                    self.prune()
+                    last_prune = time.monotonic()
+            except sqlite3.Error:
+                # retried on the next pass, readings stay pending meanwhile
+                continue
+
+    def flush(self):
+        with self._lock:
+            self._commit_locked()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            self._commit_locked()
+            self._conn.close()
+
+
+HISTORY_BACKENDS = ("columnar", "sqlite")
+
+
+def open_history_store(
+    backend, directory, columns=("value",), retention_days=None, durability="flush"
+):
+    """
+    Create the history store selected by `backend` inside `directory`,
+    either "columnar" (memory-mapped segment files) or "sqlite"
+    """
+    if backend == "columnar":
+        return ColumnarHistoryStore(directory, columns, retention_days, durability)
+    if backend == "sqlite":
+        return SQLiteHistoryStore(
+            os.path.join(directory, "history.sqlite3"),
+            columns,
+            retention_days,
+            durability=durability,
+        )
+    raise ValueError(f"unknown history backend {backend!r}, use one of {HISTORY_BACKENDS}")
+
+
+class BufferedHistoryWriter:
+    """
+    Group commit front end for a history store. Samples are batched in
+    memory and written with one `append_many` call every `max_samples`
+    samples or `max_delay` seconds, whichever comes first, from a
+    background thread so the BACnet thread never waits on the disk.
+
+    Reads flush the batch first so they always see every sample, and
+    `close()` flushes before closing the store. A crash loses at most the
+    samples of one batch.
+    """
+
+    def __init__(self, store, max_samples=10, max_delay=600.0):
+        self.store = store
+        self.columns = store.columns
+        self.max_samples = max_samples
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timestamps = []
+        self._rows = []
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="history-writer", daemon=True
+        )
+        self._thread.start()
+
+    def append(self, timestamp, values):
+        row = np.asarray(values, dtype=np.float64).reshape(len(self.columns))
+        with self._lock:
+            self._timestamps.append(to_epoch_us(timestamp))
+            self._rows.append(row)
+            if len(self._rows) >= self.max_samples:
+                self._wakeup.set()
+
+    def append_many(self, timestamps, rows):
+        self.flush()
+        self.store.append_many(timestamps, rows)
+
+    def __len__(self):
+        with self._lock:
+            return len(self.store) + len(self._rows)
+
+    def flush(self):
+        # one flush at a time keeps batches in timestamp order
+        with self._flush_lock:
+            with self._lock:
+                timestamps, rows = self._timestamps, self._rows
+                self._timestamps, self._rows = [], []
+            if not rows:
+                return
+            try:
+                self.store.append_many(timestamps, np.vstack(rows))
+            except Exception:
+                # keep the batch so the next flush retries it
+                with self._lock:
+                    self._timestamps[:0] = timestamps
+                    self._rows[:0] = rows
+                raise
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # the store is retried with the next batch
+                continue
+
+    def read_range(self, start=None, end=None, column=None):
+        self.flush()
+        return self.store.read_range(start, end, column)
+
+    def read_columns(self, start=None, end=None, columns=None):
+        self.flush()
+        return self.store.read_columns(start, end, columns)
+
+    def tail(self, n, column=None):
+        self.flush()
+        return self.store.tail(n, column)
+
+    def prune(self):
+        self.store.prune()
+
+    def close(self):
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        self.store.close()
+
+
+def import_csv(filename, store, batch_size=10000):
+    """
+    One time conversion of a legacy data.csv log (timestamp, value rows)
+    into a history store.
+
+    Returns:
+    - int number of rows imported
+    """
+    timestamps, rows = [], []
+    imported = 0
+
+    with open(filename, "r") as csvfile:
+        for row in csv.reader(csvfile):
+            if len(row) < 2:
+                continue
+            try:
+                timestamp = datetime.strptime(row[0], CSV_TIMESTAMP_FORMAT)
+                value = float(row[1])
+            except ValueError:
+                continue
+
+            timestamps.append(to_epoch_us(timestamp))
+            rows.append(value)
+            if len(rows) >= batch_size:
+                store.append_many(timestamps, rows)
+                imported += len(rows)
+                timestamps, rows = [], []
+
+    if rows:
+        store.append_many(timestamps, rows)
+        imported += len(rows)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a legacy data.csv log into a binary history store."
+    )
+    parser.add_argument("csv_file", nargs="?", default="data.csv")
+    parser.add_argument("--directory", default="history")
+    parser.add_argument("--backend", choices=HISTORY_BACKENDS, default="columnar")
+    args = parser.parse_args()
+
+    store = open_history_store(args.backend, args.directory, durability="fsync")
+    imported = import_csv(args.csv_file, store)
+    store.close()
+    print(f"imported {imported} rows from {args.csv_file} into {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
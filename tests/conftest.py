@@ -0,0 +1,85 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def bacpypes3_server():
+    """
+    The bacpypes3 server module, loaded under its own name because it
+    shares bacnet_server.py with the legacy server
+    """
+    pytest.importorskip("bacpypes3")
+    spec = importlib.util.spec_from_file_location(
+        "bacpypes3_bacnet_server",
+        os.path.join(ROOT, "bacpypes_three_version", "bacnet_server.py"),
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module  # bacpypes3 looks up object class modules
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def bacpypes3_app(bacpypes3_server, tmp_path, monkeypatch):
+    """
+    Factory of a SampleApplication on loopback writing its history and
+    metrics into tmp_path, to be called inside a running event loop
+    """
+    from bacpypes3.argparse import SimpleArgumentParser
+
+    monkeypatch.chdir(tmp_path)
+
+    def create(training_trigger=False):
+        args = SimpleArgumentParser().parse_args(
+            ["--address", "127.0.0.1/8:47890", "--instance", "598"]
+        )
+        return bacpypes3_server.SampleApplication(
+            args, **bacpypes3_server.create_objects(training_trigger)
+        )
+
+    return create
+
+
+@pytest.fixture
+def legacy_server(tmp_path, monkeypatch):
+    """
+    Factory of a legacy BacnetServer on loopback with its history, models
+    and metrics in tmp_path, closed after the test
+    """
+    from types import SimpleNamespace
+
+    pytest.importorskip("bacpypes")
+    import bacnet_server
+
+    monkeypatch.chdir(tmp_path)
+    servers = []
+
+    def create(meters=("",), forecaster=None, training_trigger=False):
+        ini = SimpleNamespace(
+            objectname="opendsm-test",
+            objectidentifier=599,
+            maxapdulengthaccepted=1024,
+            segmentationsupported="segmentedBoth",
+            vendoridentifier=15,
+        )
+        server = bacnet_server.BacnetServer(
+            ini,
+            f"127.0.0.1/8:{47880 + len(servers)}",
+            forecaster,
+            meters,
+            training_trigger,
+        )
+        servers.append(server)
+        return server
+
+    yield create
+    for server in servers:
+        server.task.close()
+        server.app.close_socket()
+        for meter in server.meters:
+            meter.close()
@@ -0,0 +1,164 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+
+def cache_rows(server, app, n, start):
+    """
+    n minutes of readings whose input power follows generic input 1 an
+    hour later, so a trained model has something to forecast
+    """
+    timestamps = start + np.arange(n) * server.INTERVAL
+    rows = np.zeros((n, len(app.columns) - 1))
+    driver = 50.0 + 20.0 * np.sin(np.arange(n) / 90.0)
+    rows[:, app.columns.index("generic_input_var_1_pv") - 1] = driver
+    power = np.roll(driver, server.FORECAST_HORIZON) + 100.0
+    rows[:, app.columns.index("input_power_pv") - 1] = power
+    return timestamps, rows
+
+
+def test_training_data_pairs_features_with_future_power(
+    bacpypes3_server, bacpypes3_app
+):
+    server = bacpypes3_server
+
+    async def run():
+        app = bacpypes3_app()
+        try:
+            timestamps, rows = cache_rows(server, app, 300, time.time() - 300 * 60)
+            app.data_cache.extend(timestamps, rows)
+            X, y = app.training_data()
+            assert X.shape == (300 - server.FORECAST_HORIZON, len(app.columns) - 2)
+            power = app.columns.index("input_power_pv") - 1
+            assert np.allclose(y, rows[server.FORECAST_HORIZON :, power])
+            assert X.shape[1] == app.model_features(app.data_cache.rows(1)).shape[1]
+        finally:
+            await app.close()
+
+    asyncio.run(run())
+
+
+def test_trained_model_is_published(bacpypes3_server, bacpypes3_app):
+    pytest.importorskip("sklearn")
+    from training import train_tree_grid
+
+    server = bacpypes3_server
+
+    async def run():
+        app = bacpypes3_app()
+        try:
+            app.model_train_hour = None  # no scheduled training in the test
+            timestamps, rows = cache_rows(server, app, 600, time.time() - 600 * 60)
+            app.data_cache.extend(timestamps, rows)
+            assert not await app.get_if_a_model_is_available()
+
+            model, _ = train_tree_grid(
+                *app.training_data(), parameter_grid={"estimator__max_depth": [4]}
+            )
+            app.model = model
+            assert await app.get_if_a_model_is_available()
+
+            app.input_power.presentValue = 120.0
+            app.generic_input_var_1.presentValue = 60.0
+            await app.forecasting_cycle()
+            forecast = float(app.one_hr_future_pwr.presentValue)
+            assert forecast != server.DEFAULT_PV
+            assert 100.0 <= forecast <= 200.0
+        finally:
+            await app.close()
+
+    asyncio.run(run())
+
+
+def test_failed_cycle_does_not_stop_forecasting(
+    bacpypes3_server, bacpypes3_app, monkeypatch
+):
+    server = bacpypes3_server
+
+    async def run():
+        app = bacpypes3_app()
+        # before the forecasting task first sleeps
+        monkeypatch.setattr(server, "INTERVAL", 0.01)
+        cycles = []
+
+        async def forecasting_cycle():
+            cycles.append(len(app.percentile_window))
+            if len(cycles) == 1:
+                await app.fetch_and_store_data()
+                raise RuntimeError("cycle broke")
+
+        try:
+            app.input_power.presentValue = float("nan")
+            app.forecasting_cycle = forecasting_cycle
+            for _ in range(200):
+                if len(cycles) >= 3:
+                    break
+                await asyncio.sleep(0.01)
+            assert len(cycles) >= 3
+            # the NaN reading was cached but kept out of the statistics
+            assert len(app.data_cache) == 1
+            assert len(app.percentile_window) == 0
+            assert len(app.power_stats) == 0
+        finally:
+            await app.close()
+
+    asyncio.run(run())
+
+
+def test_close_shuts_down_a_running_training(bacpypes3_server, bacpypes3_app):
+    import multiprocessing
+
+    server = bacpypes3_server
+
+    async def run():
+        app = bacpypes3_app()
+        try:
+            n = 20000  # enough for the grid search to outlast the test
+            timestamps, rows = cache_rows(server, app, n, time.time() - n * 60)
+            app.data_cache.extend(timestamps, rows)
+            app.start_model_training()
+            # running in the pool worker once the first candidate is scored
+            for _ in range(3000):
+                progress = app.training_progress
+                if progress is not None and progress.qsize():
+                    break
+                await asyncio.sleep(0.01)
+            assert not app.training_task.done()
+        finally:
+            await app.close()
+
+        assert app.training_task.done()
+        assert app.model is None
+        assert app.training_cancel is None
+        assert not [
+            child
+            for child in multiprocessing.active_children()
+            if child.name.startswith("SyncManager")
+        ]
+
+    asyncio.run(run())
+
+
+def test_realistic_rate_of_change_is_published(bacpypes3_server, bacpypes3_app):
+    async def run():
+        app = bacpypes3_app()
+        try:
+            start = time.time() - 600
+            published = []
+            for minute, power in enumerate((100.0, 100.3, 100.5, 101.0)):
+                app.power_stats.update(start + minute * 60, power)
+                await app.calc_power_rate_of_change()
+                published.append(
+                    app.publisher.publish(
+                        app.power_rate_of_change, app.current_power_lv_rate_of_change
+                    )
+                )
+            # 0.3 and 0.2 kW per minute are within 0.1 of each other
+            assert published == [True, True, False, True]
+            assert float(app.power_rate_of_change.presentValue) == pytest.approx(0.5)
+        finally:
+            await app.close()
+
+    asyncio.run(run())
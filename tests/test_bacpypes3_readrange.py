@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from trendlog import MAX_RANGE_ITEMS
+
+CLIENT_ADDRESS = "127.0.0.1/8:47891"
+SERVER_ADDRESS = "127.0.0.1:47890"
+
+
+async def read_range(client, objid, range_=None):
+    from bacpypes3.apdu import ReadRangeRequest
+    from bacpypes3.pdu import Address
+
+    request = ReadRangeRequest(
+        objectIdentifier=objid,
+        propertyIdentifier="logBuffer",
+        destination=Address(SERVER_ADDRESS),
+    )
+    if range_ is not None:
+        request.range = range_
+    return await asyncio.wait_for(client.request(request), 10)
+
+
+def run_with_client(bacpypes3_app, test):
+    from bacpypes3.app import Application
+    from bacpypes3.argparse import SimpleArgumentParser
+
+    async def run():
+        app = bacpypes3_app()
+        client = Application.from_args(
+            SimpleArgumentParser().parse_args(
+                ["--address", CLIENT_ADDRESS, "--instance", "597"]
+            )
+        )
+        try:
+            n = 3000
+            rows = np.zeros((n, len(app.columns) - 1))
+            rows[:, 0] = np.arange(n)
+            app.data_cache.extend(time.time() - 60.0 * (n - np.arange(n)), rows)
+            await test(app, client)
+        finally:
+            client.close()
+            await app.close()
+
+    asyncio.run(run())
+
+
+def test_read_range_pages_to_fit_the_client(bacpypes3_app):
+    async def test(app, client):
+        ack = await read_range(client, app.trend_logs[0].objectIdentifier)
+        assert 0 < ack.itemCount < MAX_RANGE_ITEMS
+        assert list(ack.resultFlags) == [1, 0, 1]  # firstItem, moreItems
+
+    run_with_client(bacpypes3_app, test)
+
+
+def test_wildcard_reference_time_is_value_out_of_range(bacpypes3_app):
+    from bacpypes3.apdu import ErrorRejectAbortNack
+    from bacpypes3.basetypes import DateTime, ErrorCode, Range, RangeByTime
+    from bacpypes3.primitivedata import Date, Time
+
+    async def test(app, client):
+        wildcard = Range(
+            byTime=RangeByTime(
+                referenceTime=DateTime(
+                    date=Date((255, 255, 255, 255)), time=Time((255, 255, 255, 255))
+                ),
+                count=10,
+            )
+        )
+        with pytest.raises(ErrorRejectAbortNack) as error:
+            await read_range(client, app.trend_logs[0].objectIdentifier, wildcard)
+        assert error.value.errorCode == ErrorCode.valueOutOfRange
+
+    run_with_client(bacpypes3_app, test)
@@ -0,0 +1,55 @@
+import threading
+
+from diagnostics import StageTimers, prometheus_text
+
+
+def test_prometheus_text_lists_every_stage():
+    timers = StageTimers(buckets=(0.1, 1.0), window=4)
+    timers.observe("predict", 0.05)
+    timers.observe("predict", 0.5)
+    timers.observe("ingest", 2.0)
+
+    text = prometheus_text(timers, [("cycle_seconds", "gauge", "Cycle.", 0.5)])
+    assert 'stage_duration_seconds_bucket{stage="predict",le="0.1"} 1' in text
+    assert 'stage_duration_seconds_bucket{stage="predict",le="1"} 2' in text
+    assert 'stage_duration_seconds_count{stage="ingest"} 1' in text
+    assert 'stage_recent_seconds{stage="ingest",stat="max"} 2.0' in text
+    assert "opendsm_cycle_seconds 0.5" in text
+
+
+def test_stages_added_while_exporting():
+    timers = StageTimers(window=1)
+    adder = threading.Thread(
+        target=lambda: [timers.observe(f"stage{i}", 0.001) for i in range(2000)]
+    )
+    adder.start()
+    while adder.is_alive():
+        prometheus_text(timers)
+    adder.join()
+    assert len(timers.items()) == 2000
+
+
+def test_both_servers_count_cycles_longer_than_the_interval(
+    legacy_server, bacpypes3_server, bacpypes3_app
+):
+    import asyncio
+    import time
+
+    task = legacy_server().task
+    for cycle_time in (1.0, task.interval + 1.0):
+        task.worker.results.put((time.perf_counter() - cycle_time, []))
+        task.publish()
+    assert task.overruns == 1
+    assert task.diagnostics["overrun_count"].presentValue.value == 1.0
+
+    async def run():
+        app = bacpypes3_app()
+        try:
+            for cycle_time in (1.0, bacpypes3_server.INTERVAL + 1.0):
+                app.report_diagnostics(cycle_time)
+            assert app.overruns == 1
+            assert float(app.overrun_count.presentValue) == 1.0
+        finally:
+            await app.close()
+
+    asyncio.run(run())
@@ -0,0 +1,38 @@
+import inspect
+
+import pytest
+
+from forecasters import FORECASTERS, check_options
+
+
+def test_known_options_pass():
+    assert check_options("ridge", {"alpha": 0.01}) == {"alpha": 0.01}
+    assert check_options("tree", {"max_depth": 8, "sample_stride": 2})
+
+
+def test_unknown_option_fails():
+    with pytest.raises(ValueError, match="max_dept"):
+        check_options("tree", {"max_dept": 8})
+    with pytest.raises(ValueError, match="max_depth"):
+        check_options("ridge", {"max_depth": 8})
+
+
+@pytest.mark.parametrize("name", sorted(FORECASTERS))
+def test_options_are_train_keywords(name):
+    engine = FORECASTERS[name]
+    parameters = inspect.signature(engine.train).parameters
+    takes_any = any(p.kind is p.VAR_KEYWORD for p in parameters.values())
+    assert takes_any or set(engine.OPTIONS) <= set(parameters)
+
+
+def test_unknown_ini_option_fails_at_startup(tmp_path):
+    pytest.importorskip("bacpypes")
+    from bacnet_server import read_forecaster_settings
+
+    ini = tmp_path / "BACpypes.ini"
+    ini.write_text("[Forecaster]\nengine = ridge\nalpha = 0.01\n")
+    assert read_forecaster_settings(str(ini))["options"] == {"alpha": 0.01}
+
+    ini.write_text("[Forecaster]\nengine = ridge\nalhpa = 0.01\n")
+    with pytest.raises(ValueError, match="alhpa"):
+        read_forecaster_settings(str(ini))
@@ -0,0 +1,16 @@
+import numpy as np
+
+from history import SlidingPercentiles
+
+
+def test_non_finite_readings_are_left_out_of_percentiles():
+    window = SlidingPercentiles(3600)
+    for i, value in enumerate((10.0, float("nan"), 20.0, float("inf"), 30.0)):
+        window.push(1000.0 + i * 60, value)
+
+    assert len(window) == 3
+    assert window.percentile(50) == np.percentile([10.0, 20.0, 30.0], 50)
+
+    # a non-finite reading still moves the window on
+    window.push(1000.0 + 3600 + 200, float("nan"))
+    assert len(window) == 1
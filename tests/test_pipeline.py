@@ -0,0 +1,134 @@
+import logging
+import time
+
+from pipeline import AnalyticsWorker, LatestSlot
+
+
+def test_latest_slot_keeps_newest():
+    slot = LatestSlot()
+    assert slot.take() is None
+    slot.put(1)
+    slot.put(2)
+    assert slot.take() == 2
+    assert slot.take() is None
+
+
+def wait_idle(worker):
+    deadline = time.monotonic() + 5.0
+    while worker.busy:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_failing_stage_hands_back_its_job(caplog):
+    def stage(job):
+        if job == "bad":
+            raise RuntimeError("stage broke")
+        return job.upper()
+
+    worker = AnalyticsWorker(stage)
+    try:
+        with caplog.at_level(logging.ERROR, logger="pipeline"):
+            assert worker.submit("bad")
+            wait_idle(worker)
+        assert worker.results.take() is None
+        assert worker.failed.take() == "bad"
+        assert worker.failures == 1
+        (record,) = caplog.records
+        assert record.exc_info is not None
+        assert "stage broke" in caplog.text
+
+        assert worker.submit("good")
+        wait_idle(worker)
+        assert worker.results.take() == "GOOD"
+        assert worker.failed.take() is None
+    finally:
+        worker.stop()
+
+
+def test_failed_readings_go_out_with_the_next_job(legacy_server):
+    server = legacy_server()
+    meter = server.meters[0]
+    applied = []
+    failures = [RuntimeError("statistics broke")]
+
+    def update_statistics(samples):
+        if failures:
+            raise failures.pop()
+        applied.extend(value for _, value in samples)
+
+    meter.update_statistics = update_statistics
+    for value in (50.0, 51.0):
+        meter.input_power.presentValue = value
+        server.task.process_task()
+        wait_idle(server.task.worker)
+
+    assert server.task.worker.failures == 1
+    assert applied == [50.0, 51.0]
+    assert meter.pending_samples == []
+
+
+def test_failing_reading_is_dropped_and_the_rest_retried_once(legacy_server):
+    server = legacy_server()
+    meter = server.meters[0]
+    window = meter.percentile_window
+    push = window.push
+
+    def fail_on_51(timestamp, value):
+        if value == 51.0:
+            raise ValueError("cannot index 51")
+        push(timestamp, value)
+
+    window.push = fail_on_51
+    start = time.time() - 600
+    meter.pending_samples = [(start, 50.0), (start + 60, 51.0), (start + 120, 52.0)]
+    meter.input_power.presentValue = 53.0
+    server.task.process_task()
+    wait_idle(server.task.worker)
+    assert server.task.worker.failures == 1
+
+    meter.input_power.presentValue = 54.0
+    server.task.process_task()
+    wait_idle(server.task.worker)
+    assert server.task.worker.failures == 1
+    assert sorted(value for _, value in window._readings) == [50.0, 52.0, 53.0, 54.0]
+    assert len(meter.power_stats) == 4
+
+
+def test_non_finite_input_power_is_not_stored(legacy_server):
+    server = legacy_server()
+    meter = server.meters[0]
+    for value in (50.0, float("nan"), float("inf"), 51.0):
+        meter.input_power.presentValue = value
+        server.task.process_task()
+        wait_idle(server.task.worker)
+
+    assert server.task.worker.failures == 0
+    assert list(meter.history.values()) == [50.0, 51.0]
+    assert len(meter.percentile_window) == 2
+
+
+def test_forecast_window_is_copied_out_of_the_ring(legacy_server):
+    from types import SimpleNamespace
+
+    from history import HistoryBuffer
+
+    server = legacy_server()
+    meter = server.meters[0]
+    meter.sequence_length = 3
+    meter.history = HistoryBuffer(5)
+    start = time.time() - 600
+    for minute in range(5):
+        meter.history.append(start + minute * 60, float(minute))
+    meter.prepare_forecast = lambda training_allowed: True
+    meter.serving = SimpleNamespace(forecaster=object())
+    submitted = []
+    server.task.worker.submit = lambda job: submitted.append(job) or True
+
+    server.task.process_task()
+    ((_, (entry,)),) = submitted
+    assert list(entry.window) == [2.0, 3.0, 4.0]
+    # the ring wraps over the slots of the window
+    for minute in range(5, 8):
+        meter.history.append(start + minute * 60, float(minute))
+    assert list(entry.window) == [2.0, 3.0, 4.0]
@@ -0,0 +1,43 @@
+import numpy as np
+
+from storage import US_PER_DAY, ColumnarHistoryStore
+
+DAY = 20000 * US_PER_DAY  # a UTC midnight in epoch microseconds
+MINUTE = 60 * 1_000_000
+
+
+def test_late_reading_is_dropped(tmp_path):
+    store = ColumnarHistoryStore(str(tmp_path))
+    for i in (0, 1, 2, 4):
+        store.append_many([DAY + i * MINUTE], [[float(i)]])
+    assert store.append_many([DAY + 3 * MINUTE], [[3.0]]) == 0
+    assert store.dropped == 1
+
+    timestamps, values = store.read_range(DAY + 2 * MINUTE, DAY + 5 * MINUTE)
+    assert list(values) == [2.0, 4.0]
+    assert np.all(np.diff(timestamps) >= 0)
+    store.close()
+
+
+def test_late_reading_in_batch_is_dropped(tmp_path):
+    store = ColumnarHistoryStore(str(tmp_path))
+    offsets = [0, 2, 1, 3]
+    written = store.append_many(
+        [DAY + i * MINUTE for i in offsets], [[float(i)] for i in offsets]
+    )
+    assert written == 3
+
+    _, values = store.read_range(DAY, DAY + MINUTE + 1)
+    assert list(values) == [0.0]
+    store.close()
+
+
+def test_late_reading_after_reopen_is_dropped(tmp_path):
+    store = ColumnarHistoryStore(str(tmp_path))
+    store.append_many([DAY + US_PER_DAY + MINUTE], [[1.0]])
+    store.close()
+
+    store = ColumnarHistoryStore(str(tmp_path))
+    assert store.append_many([DAY + 5 * MINUTE], [[0.0]]) == 0
+    assert store.segments() == [store._segment_for(DAY + US_PER_DAY)]
+    store.close()
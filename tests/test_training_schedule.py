@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+bacnet_server = pytest.importorskip("bacnet_server")
+
+TICK = timedelta(minutes=10)
+
+
+class SimulatedClock:
+    def __init__(self, start):
+        self.now = start
+
+    def datetime(self):
+        clock = self
+
+        class SimulatedDateTime(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return clock.now
+
+        return SimulatedDateTime
+
+
+def simulate_training(meter, runs, ticks):
+    """
+    Replace the training process of `meter` with runs that take `ticks`
+    ticks, counted in `runs`
+    """
+    remaining = []
+
+    def start_model_training():
+        runs[meter.name] += 1
+        remaining[:] = [ticks]
+        meter.model_is_training = True
+
+    def poll_model_training():
+        if remaining:
+            remaining[0] -= 1
+            if remaining[0] <= 0:
+                remaining.clear()
+                meter.model_is_training = False
+
+    meter.start_model_training = start_model_training
+    meter.poll_model_training = poll_model_training
+
+
+@pytest.mark.parametrize(
+    "training_ticks, runs_per_meter",
+    [
+        (3, {5}),  # half an hour a run, every meter trains once a day
+        (36, {3, 4}),  # six hours a run, the meters take turns
+    ],
+)
+def test_every_meter_trains_with_one_slot(
+    legacy_server, monkeypatch, training_ticks, runs_per_meter
+):
+    clock = SimulatedClock(datetime(2026, 3, 2, 12, 0))
+    monkeypatch.setattr(bacnet_server, "datetime", clock.datetime())
+    monkeypatch.setattr(bacnet_server, "MAX_CONCURRENT_TRAINING", 1)
+
+    names = [f"meter{i}" for i in range(6)]
+    server = legacy_server(names)
+    runs = dict.fromkeys(names, 0)
+    start = datetime(2026, 3, 2, 11, 0).timestamp()
+    for meter in server.meters:
+        simulate_training(meter, runs, training_ticks)
+        meter.history.extend(start + 60.0 * np.arange(200), np.full(200, 50.0))
+        meter.input_power.presentValue = 50.0
+
+    for _ in range(int(timedelta(days=5) / TICK)):
+        clock.now += TICK
+        server.task.process_task()
+
+    assert set(runs.values()) <= runs_per_meter, runs
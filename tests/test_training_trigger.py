@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime, timedelta
+
+
+def test_legacy_trigger_is_off_by_default(legacy_server):
+    server = legacy_server()
+    assert server.app.get_object_id(("binaryValue", 3)) is None
+    assert server.meters[0].model_training_bv is None
+
+
+def test_legacy_trigger_requests_training(legacy_server):
+    server = legacy_server(training_trigger=True)
+    meter = server.meters[0]
+    assert server.app.get_object_id(("binaryValue", 3)) is meter.model_training_bv
+
+    meter.model_is_training = True
+    assert meter.model_training_bv.presentValue == "active"
+
+
+def test_bacpypes3_trigger_is_off_by_default(bacpypes3_server, bacpypes3_app):
+    async def run():
+        assert "model_training_bv" not in bacpypes3_server.create_objects()
+        assert "model_training_bv" in bacpypes3_server.create_objects(True)
+        app = bacpypes3_app()
+        try:
+            app.model_train_hour = None  # no scheduled training in the test
+            assert app.model_training_bv is None
+            assert app.app.get_object_id(("binaryValue", 3)) is None
+            app.input_power.presentValue = 120.0
+            await app.forecasting_cycle()
+        finally:
+            await app.close()
+
+    asyncio.run(run())
+
+
+def test_legacy_request_waits_for_enough_readings(legacy_server):
+    server = legacy_server(training_trigger=True)
+    meter = server.meters[0]
+    meter.sequence_length = 3
+    # no scheduled training in the test
+    meter.last_scheduled_training = datetime.now() + timedelta(days=1)
+    started = []
+    meter.start_model_training = lambda: started.append(len(meter.history))
+
+    meter.model_training_bv.presentValue = "active"
+    for value in (50.0, 51.0, 52.0, 53.0):
+        meter.input_power.presentValue = value
+        meter.prepare_forecast()
+    assert started == [3]
+    assert not meter.training_requested
+
+
+def test_bacpypes3_request_waits_for_a_reading(bacpypes3_server, bacpypes3_app):
+    async def run():
+        app = bacpypes3_app(training_trigger=True)
+        try:
+            app.model_train_hour = None  # no scheduled training in the test
+            started = []
+            app.start_model_training = lambda: started.append(len(app.data_cache))
+
+            app.model_training_bv.presentValue = "active"
+            await app.forecasting_cycle()  # input power still unset
+            assert started == []
+            app.input_power.presentValue = 120.0
+            await app.forecasting_cycle()
+            assert started == [2]
+            assert not app.training_requested
+        finally:
+            await app.close()
+
+    asyncio.run(run())
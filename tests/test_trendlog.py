@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from history import HistoryBuffer
+from trendlog import (
+    MAX_RANGE_ITEMS,
+    RECORD_OCTETS,
+    TrendSource,
+    response_items,
+    select_range,
+    to_epoch,
+)
+
+APDU_1024 = 4  # max-APDU-length-accepted encoding of 1024 octets
+APDU_1476 = 5
+SEGMENTS_UNSPECIFIED = 0
+SEGMENTS_16 = 4
+
+
+def test_unsegmented_response_fits_one_apdu():
+    items = response_items(APDU_1024, SEGMENTS_UNSPECIFIED, segmented=False)
+    assert 0 < items * RECORD_OCTETS < 1024
+    assert items < response_items(APDU_1476, SEGMENTS_UNSPECIFIED, False)
+
+
+def test_segmented_response_fits_accepted_segments():
+    one = response_items(APDU_1024, SEGMENTS_16, segmented=False)
+    items = response_items(APDU_1024, SEGMENTS_16, segmented=True)
+    assert one < items
+    assert items * RECORD_OCTETS < 16 * 1024
+    assert response_items(APDU_1024, SEGMENTS_UNSPECIFIED, True) < items
+
+
+def test_response_items_bounds():
+    assert response_items(0, 0, False) >= 1  # 50 octet APDUs still page
+    assert response_items(5, 6, True) == MAX_RANGE_ITEMS
+    assert response_items(None, None, True) >= 1
+
+
+def test_whole_buffer_is_paged():
+    timestamps = np.arange(100.0)
+    assert select_range(timestamps, max_items=30) == (0, 30, True)
+    assert select_range(timestamps, "position", 31, 30, max_items=30) == (
+        30,
+        60,
+        False,
+    )
+
+
+def test_trend_source_pages_with_more_items():
+    history = HistoryBuffer(200)
+    for i in range(200):
+        history.append(1000.0 + 60 * i, float(i))
+    source = TrendSource(history)
+
+    records, first_sequence, flags = source.read_range(max_items=50)
+    assert len(records) == 50
+    assert first_sequence == 1
+    assert flags == (True, False, True)
+
+    records, _, flags = source.read_range()
+    assert len(records) == 200
+    assert flags == (True, True, False)
+
+
+@pytest.mark.parametrize(
+    "date, time",
+    [
+        ((255, 5, 3, 255), (10, 0, 0, 0)),
+        ((124, 255, 3, 255), (10, 0, 0, 0)),
+        ((124, 13, 3, 255), (10, 0, 0, 0)),  # odd months
+        ((124, 5, 32, 255), (10, 0, 0, 0)),  # last day of the month
+        ((124, 5, 3, 255), (255, 0, 0, 0)),
+        ((124, 5, 3, 255), (10, 255, 0, 0)),
+    ],
+)
+def test_wildcard_reference_time_is_rejected(date, time):
+    with pytest.raises(ValueError):
+        to_epoch(date, time)
+
+
+def test_unspecified_seconds_count_as_zero():
+    assert to_epoch((124, 5, 3, 5), (10, 30, 255, 255)) == to_epoch(
+        (124, 5, 3, 5), (10, 30, 0, 0)
+    )
@@ -0,0 +1,487 @@
+"""
+Model training pipelines for the power forecast.
+
+`run_training` reads the history store, trains the configured engine
+from forecasters.py and publishes it as a new version in the model
+registry. It can run on a thread of the BACnet process or, through
+`TrainingWorker`, in a spawned child process so Keras never competes
+with the BACnet stack for the GIL or memory.
+
+The LSTM engine scales the series, streams float32 windows to Keras
+through tf.data, fits the model and exports the numpy serving artifact
+(weights plus scaler range). Between full retrains it warm starts from
+the previous model and only fine-tunes on the most recent windows plus
+a small replay sample of older ones.
+
+`train_tree_grid` is the decision tree grid search of the bacpypes3
+server, written as a plain function so it can be submitted to a
+ProcessPoolExecutor and stopped between fits.
+
+TensorFlow and sklearn are only imported inside the training functions.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+import numpy as np
+
+from forecasters import LSTMForecaster, get_forecaster
+from forecasting import MinMaxScaling, export_keras_lstm
+from registry import ModelRegistry
+from storage import EPOCH_SCALE, open_history_store
+from windowing import window_count, window_dataset
+
+_log = logging.getLogger(__name__)
+
+PRED_LENGTH = 60  # minutes forecast by the Dense head
+VALIDATION_FRACTION = 0.33
+FINE_TUNE_EPOCHS = 20
+FINE_TUNE_LEARNING_RATE = 1e-4  # small steps so old patterns are not forgotten
+
+TREE_PARAMETER_GRID = {
+    "estimator__max_depth": [None, 10, 20],
+    "estimator__min_samples_split": [2, 5, 10],
+    "estimator__min_samples_leaf": [1, 2, 4],
+}
+
+
+class TrainingCancelled(Exception):
+    """
+    Raised inside a training run when its cancel event is set
+    """
+
+
+def scale_series(values):
+    """
+    Fit a MinMaxScaling on the series
+
+    Returns:
+    - float32 (n, 1) scaled series, fitted MinMaxScaling
+    """
+    scaler = MinMaxScaling()
+    scaled = scaler.fit_transform(np.asarray(values).reshape(-1, 1)).astype(np.float32)
+    return scaled, scaler
+
+
+def build_model(seq_length, pred_length):
+    from tensorflow.keras.layers import LSTM, Dense
+    from tensorflow.keras.models import Sequential
+
+    model = Sequential()
+    model.add(LSTM(50, return_sequences=True, input_shape=(seq_length, 1)))
+    model.add(LSTM(50, return_sequences=False))
+    model.add(Dense(pred_length))
+    model.compile(optimizer="adam", loss="mean_squared_error")
+    return model
+
+
+def _split_full(n):
+    """
+    Returns:
+    - train and validation window start indices, split by time
+    """
+    train_size = int((1 - VALIDATION_FRACTION) * n)
+    return range(0, train_size), range(train_size, n)
+
+
+def _split_fine_tune(n, recent_windows, replay_windows, seed=None):
+    """
+    Validate on the newest windows, train on the rest of the recent
+    windows plus `replay_windows` older ones drawn at random so the
+    fine-tune does not forget seasons it no longer sees
+    """
+    recent = min(int(recent_windows), n)
+    validation = max(1, int(VALIDATION_FRACTION * recent))
+
+    replay = np.random.default_rng(seed).choice(
+        n - recent, size=min(int(replay_windows), n - recent), replace=False
+    )
+    train = np.sort(np.concatenate((replay, np.arange(n - recent, n - validation))))
+    return train, range(n - validation, n)
+
+
+def _validation_rmse(model, dataset, scaler):
+    """
+    RMSE in original units, accumulated one batch at a time
+    """
+    squared_error, count = 0.0, 0
+    for X, y in dataset:
+        predictions = scaler.inverse_transform(model(X, training=False).numpy())
+        errors = predictions - scaler.inverse_transform(y.numpy())
+        squared_error += float(np.sum(errors**2))
+        count += errors.size
+    return float(np.sqrt(squared_error / count))
+
+
+def train_lstm(
+    values,
+    artifact_path,
+    seq_length,
+    pred_length=PRED_LENGTH,
+    checkpoint_path="best_model.h5",
+    progress=None,
+    warm_start_from=None,
+    recent_windows=1440,
+    replay_windows=1440,
+    full_train_time=None,
+    seed=None,
+):
+    """
+    Fit the LSTM on a raw power series and write the serving artifact,
+    `progress` is called with a dict after every epoch.
+
+    With `warm_start_from`, an (artifact, checkpoint) pair of paths of the
+    previous model, its Keras model and scaler are reused and fine-tuned for at most
+    FINE_TUNE_EPOCHS on the last `recent_windows` windows plus
+    `replay_windows` older ones, otherwise a new model is fitted on every
+    window for up to 200 epochs.
+
+    Returns:
+    - dict with rmse, training_time_minutes, epochs, mode and
+      full_train_time (epoch seconds of the last full retrain)
+    """
+    import tensorflow as tf
+    from tensorflow.keras.callbacks import Callback, EarlyStopping, ModelCheckpoint
+
+    start_time = time.time()
+    values = np.asarray(values).reshape(-1, 1)
+
+    model = None
+    if warm_start_from is not None:
+        previous_artifact, previous_checkpoint = warm_start_from
+        model = tf.keras.models.load_model(previous_checkpoint)
+        if model.input_shape[1] != seq_length or model.output_shape[-1] != pred_length:
+            _log.info("previous model has a different shape, retraining from scratch")
+            model = None
+
+    if model is not None:
+        scaler = MinMaxScaling.load(previous_artifact)
+        scaled_data = scaler.transform(values).astype(np.float32)
+        model.compile(
+            optimizer=tf.keras.optimizers.Adam(learning_rate=FINE_TUNE_LEARNING_RATE),
+            loss="mean_squared_error",
+        )
+        mode, epochs, patience = "incremental", FINE_TUNE_EPOCHS, 3
+        if full_train_time is None:
+            full_train_time = start_time
+    else:
+        scaled_data, scaler = scale_series(values)
+        model = build_model(seq_length, pred_length)
+        mode, epochs, patience = "full", 200, 5
+        full_train_time = start_time
+
+    # windows are cut on the fly from the float32 series, the dense
+    # (n, seq_length, 1) tensor never exists
+    n = window_count(len(scaled_data), seq_length, pred_length)
+    if n < 2:
+        raise ValueError(
+            f"{len(scaled_data)} readings is not enough for training windows"
+        )
+
+    if mode == "incremental":
+        train_index, test_index = _split_fine_tune(
+            n, recent_windows, replay_windows, seed=seed
+        )
+    else:
+        train_index, test_index = _split_full(n)
+    _log.debug(
+        f"{mode} training, {len(train_index)} train and {len(test_index)} validation windows"
+    )
+
+    train_ds = window_dataset(
+        scaled_data, seq_length, pred_length, train_index, shuffle=True, seed=seed
+    )
+    test_ds = window_dataset(scaled_data, seq_length, pred_length, test_index)
+
+    class ReportProgress(Callback):
+        def on_epoch_end(self, epoch, logs=None):
+            if progress is not None:
+                logs = logs or {}
+                progress(
+                    {
+                        "epoch": epoch + 1,
+                        "loss": float(logs.get("loss", np.nan)),
+                        "val_loss": float(logs.get("val_loss", np.nan)),
+                    }
+                )
+
+    # Define the EarlyStopping callback with patience
+    early_stop = EarlyStopping(
+        monitor="val_loss", patience=patience, verbose=1, restore_best_weights=True
+    )
+
+    # Define the ModelCheckpoint callback to save the best model
+    model_checkpoint = ModelCheckpoint(
+        checkpoint_path, monitor="val_loss", save_best_only=True
+    )
+
+    history = model.fit(
+        train_ds,
+        epochs=epochs,
+        validation_data=test_ds,
+        callbacks=[early_stop, model_checkpoint, ReportProgress()],
+    )
+
+    # Validate the best model
+    best_model = tf.keras.models.load_model(checkpoint_path)
+    rmse = _validation_rmse(best_model, test_ds, scaler)
+
+    export_keras_lstm(best_model, artifact_path, **scaler.to_arrays())
+
+    return {
+        "rmse": rmse,
+        "training_time_minutes": (time.time() - start_time) / 60,
+        "epochs": len(history.history.get("loss", [])),
+        "mode": mode,
+        "full_train_time": full_train_time,
+    }
+
+
+def choose_warm_start(registry, full_retrain_days, now=None):
+    """
+    Fine-tune the current registry version when it is an LSTM,
+    `full_retrain_days` is set and its last full retrain is younger than
+    that, 0 or None always retrains from scratch
+
+    Returns:
+    - (artifact, checkpoint) paths to warm start from or None,
+      full_train_time of the current version or None
+    """
+    version = registry.current_version()
+    if not full_retrain_days or version is None:
+        return None, None
+
+    try:
+        metadata = registry.metadata(version)
+    except (OSError, ValueError) as e:
+        _log.warning(f"could not read metadata of model version {version}: {e}")
+        return None, None
+    if metadata.get("engine", LSTMForecaster.name) != LSTMForecaster.name:
+        return None, None
+
+    last_full = metadata.get("full_train_time")
+    checkpoint = registry.path(version, LSTMForecaster.CHECKPOINT_FILE)
+    now = time.time() if now is None else now
+    if last_full is None or not os.path.exists(checkpoint):
+        return None, None
+    if now - last_full >= full_retrain_days * 86400:
+        return None, last_full
+    return (registry.path(version, LSTMForecaster.ARTIFACT_FILE), checkpoint), last_full
+
+
+def run_training(config, progress=None):
+    """
+    Read the training series from the history store described by
+    `config`, train the forecasting engine named by `config["engine"]`
+    into a staging directory of the model registry and publish it as the
+    current version. `config` holds plain values only so it can be sent
+    to a spawned process.
+
+    Returns:
+    - dict of training metrics plus the published version
+    """
+    store = open_history_store(
+        config["backend"], config["directory"], columns=config.get("columns", ("value",))
+    )
+    try:
+        timestamps, values = store.read_range(column=config.get("column"))
+        # copy out of the store before it closes
+        timestamps = timestamps / EPOCH_SCALE
+        values = np.array(values)
+    finally:
+        store.close()
+
+    registry = ModelRegistry(
+        config["registry"], keep_versions=config.get("keep_versions", 5)
+    )
+    engine = config.get("engine", LSTMForecaster.name)
+    options = dict(config.get("engine_options", {}))
+    if engine == LSTMForecaster.name:
+        warm_start_from, full_train_time = choose_warm_start(
+            registry, config.get("full_retrain_days")
+        )
+        options.update(
+            warm_start_from=warm_start_from,
+            recent_windows=config.get("recent_windows", 1440),
+            replay_windows=config.get("replay_windows", 1440),
+            full_train_time=full_train_time,
+        )
+
+    start_time = time.time()
+    staging = registry.staging()
+    try:
+        result = get_forecaster(engine).train(
+            timestamps,
+            values,
+            staging,
+            config["seq_length"],
+            config.get("pred_length", PRED_LENGTH),
+            progress=progress,
+            **options,
+        )
+        result.setdefault("training_time_minutes", (time.time() - start_time) / 60)
+        result["version"] = registry.publish(
+            staging,
+            dict(
+                result,
+                engine=engine,
+                seq_length=config["seq_length"],
+                pred_length=config.get("pred_length", PRED_LENGTH),
+                training_samples=len(values),
+            ),
+        )
+    except BaseException:
+        registry.discard(staging)
+        raise
+    return result
+
+
+def train_tree_grid(
+    X, y, progress=None, cancel=None, parameter_grid=None, n_splits=5
+):
+    """
+    Grid search of a multi output decision tree with time series cross
+    validation, same search as GridSearchCV(scoring="neg_mean_squared_error")
+    but one fit at a time so `cancel` (anything with is_set(), such as a
+    multiprocessing Manager Event) is honoured between fits and `progress`
+    (anything with put(), such as a Manager Queue) gets a dict per candidate
+
+    Returns:
+    - fitted best estimator, dict with best_params, best_score,
+      training_time_minutes
+    """
+    from sklearn.base import clone
+    from sklearn.metrics import mean_squared_error
+    from sklearn.model_selection import ParameterGrid, TimeSeriesSplit
+    from sklearn.multioutput import MultiOutputRegressor
+    from sklearn.tree import DecisionTreeRegressor
+
+    def check_cancel():
+        if cancel is not None and cancel.is_set():
+            raise TrainingCancelled("model training was cancelled")
+
+    start_time = time.time()
+    X = np.asarray(X)
+    y = np.asarray(y)
+    if y.ndim == 1:
+        y = y[:, np.newaxis]  # MultiOutputRegressor wants 2-D targets
+
+    base = MultiOutputRegressor(DecisionTreeRegressor(random_state=0))
+    candidates = list(ParameterGrid(parameter_grid or TREE_PARAMETER_GRID))
+    folds = list(TimeSeriesSplit(n_splits=n_splits).split(X))
+
+    best_score, best_params = -np.inf, None
+    for i, params in enumerate(candidates):
+        scores = []
+        for train_index, test_index in folds:
+            check_cancel()
+            model = clone(base).set_params(**params)
+            model.fit(X[train_index], y[train_index])
+            scores.append(
+                -mean_squared_error(y[test_index], model.predict(X[test_index]))
+            )
+
+        score = float(np.mean(scores))
+        if score > best_score:
+            best_score, best_params = score, params
+        if progress is not None:
+            progress.put(
+                {
+                    "candidate": i + 1,
+                    "candidates": len(candidates),
+                    "score": score,
+                    "best_score": best_score,
+                }
+            )
+
+    # refit the winner on everything like GridSearchCV(refit=True)
+    check_cancel()
+    best_model = clone(base).set_params(**best_params).fit(X, y)
+
+    return best_model, {
+        "best_params": best_params,
+        "best_score": best_score,
+        "training_time_minutes": (time.time() - start_time) / 60,
+    }
+
+
+def _worker_main(config, results):
+    try:
+        result = run_training(
+            config, progress=lambda info: results.put(("progress", info))
+        )
+        results.put(("done", result))
+    except Exception as e:
+        results.put(("error", f"{e}\n{traceback.format_exc()}"))
+
+
+class TrainingWorker:
+    """
+    Runs `run_training` in a spawned child process, spawned rather than
+    forked so the child starts clean instead of inheriting the BACnet
+    sockets, threads and any TensorFlow state. The parent polls for
+    ("progress", dict), ("done", result) and ("error", message) messages
+    without blocking.
+    """
+
+    def __init__(self):
+        self._context = multiprocessing.get_context("spawn")
+        self._process = None
+        self._results = None
+        self._finished = False
+
+    @property
+    def running(self):
+        return self._process is not None and not self._finished
+
+    def start(self, config):
+        if self.running:
+            raise RuntimeError("a training process is already running")
+
+        self._results = self._context.Queue()
+        self._process = self._context.Process(
+            target=_worker_main,
+            args=(config, self._results),
+            name="model-training",
+            daemon=True,
+        )
+        self._finished = False
+        self._process.start()
+        _log.debug(f"training process started, pid {self._process.pid}")
+
+    def poll(self):
+        """
+        Returns:
+        - list of (kind, payload) messages received since the last poll
+        """
+        if self._process is None:
+            return []
+
+        messages = []
+        while True:
+            try:
+                messages.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+
+        if any(kind in ("done", "error") for kind, _ in messages):
+            self._finish()
+        elif not self._process.is_alive() and self._results.empty():
+            messages.append(
+                ("error", f"training process exited with code {self._process.exitcode}")
+            )
+            self._finish()
+        return messages
+
+    def _finish(self):
+        self._process.join(timeout=5)
+        self._finished = True
+
+    def terminate(self):
+        if self._process is not None and self._process.is_alive():
+            self._process.terminate()
+            self._process.join(timeout=5)
+        self._finished = True
@@ -0,0 +1,216 @@
+"""
+BACnet trend log view of the in-memory history.
+
+Both BACnet servers expose a HistoryBuffer, or one column of a
+ColumnarRing, as a TrendLog object whose logBuffer is read with the
+ReadRange service. This module holds the part of ReadRange that does not
+depend on the BACnet stack: choosing the records a byPosition,
+bySequenceNumber or byTime range selects, with a binary search over the
+timestamps for time lookups, sizing a response to what the requester
+accepts, and converting BACnet date and time tuples.
+"""
+from datetime import datetime
+
+import numpy as np
+
+MAX_RANGE_ITEMS = 1440  # records per ReadRange response, a day of minutes
+RECORD_OCTETS = 19  # encoded LogRecord of a real value with its timestamp
+RESPONSE_OCTETS = 32  # ReadRange-ACK header, ids, flags, count and sequence
+SEGMENT_HEADER_OCTETS = 5  # segmented Complex-ACK header
+# max-APDU-length-accepted and max-segments-accepted request encodings
+MAX_APDU_LENGTHS = (50, 128, 206, 480, 1024, 1476)
+MAX_SEGMENTS = (None, 2, 4, 8, 16, 32, 64, None)
+
+
+def select_range(
+    timestamps,
+    by=None,
+    reference=None,
+    count=None,
+    first_sequence=1,
+    max_items=MAX_RANGE_ITEMS,
+):
+    """
+    Pick the records a ReadRange asks for out of `timestamps`, oldest
+    first. `by` is None for the whole buffer, "position" with a 1 based
+    reference index, "sequence" with a reference sequence number where
+    the oldest record is `first_sequence`, or "time" with a reference in
+    epoch seconds. A positive `count` selects records from the reference
+    forward, a negative one records up to it; by time the reference
+    itself is excluded. At most `max_items` records closest to the
+    reference are returned.
+
+    Returns:
+    - tuple (start, stop, more) slice of the selected records and
+      whether more records matched than were returned
+    """
+    n = len(timestamps)
+    if by is None:
+        start, stop = 0, n
+        count = n
+    elif count is None or count == 0:
+        raise ValueError("ReadRange count must not be zero")
+    elif by in ("position", "sequence"):
+        # 0 based index of the reference record
+        index = int(reference) - (1 if by == "position" else int(first_sequence))
+        if not 0 <= index < n:
+            return 0, 0, False
+        if count > 0:
+            start, stop = index, min(n, index + count)
+        else:
+            start, stop = max(0, index + 1 + count), index + 1
+    elif by == "time":
+        if count > 0:
+            start = int(np.searchsorted(timestamps, reference, side="right"))
+            stop = min(n, start + count)
+        else:
+            stop = int(np.searchsorted(timestamps, reference, side="left"))
+            start = max(0, stop + count)
+    else:
+        raise ValueError(f"unknown ReadRange type {by!r}")
+
+    if stop - start <= max_items:
+        return start, stop, False
+    if count > 0:
+        return start, start + max_items, True
+    return stop - max_items, stop, True
+
+
+def response_items(max_apdu, max_segments, segmented):
+    """
+    Records that fit one ReadRange response to a request with the encoded
+    `max_apdu` length and `max_segments` count, `segmented` if both the
+    requester accepts and this device sends segmented responses. An
+    unspecified segment count is taken as the smallest specified one.
+    Larger ranges are returned a page at a time with moreItems set.
+
+    Returns:
+    - int at least 1 and at most MAX_RANGE_ITEMS
+    """
+    try:
+        apdu_length = MAX_APDU_LENGTHS[max_apdu]
+    except (IndexError, TypeError):
+        apdu_length = MAX_APDU_LENGTHS[0]
+    if segmented:
+        try:
+            segments = MAX_SEGMENTS[max_segments] or MAX_SEGMENTS[1]
+        except (IndexError, TypeError):
+            segments = MAX_SEGMENTS[1]
+        octets = segments * (apdu_length - SEGMENT_HEADER_OCTETS)
+    else:
+        octets = apdu_length
+    items = (octets - RESPONSE_OCTETS) // RECORD_OCTETS
+    return max(1, min(MAX_RANGE_ITEMS, items))
+
+
+def to_epoch(date, time):
+    """
+    Returns:
+    - float epoch seconds of a BACnet (year - 1900, month, day, weekday)
+      date and (hour, minute, second, hundredth) time in local time,
+      unspecified (255) seconds and hundredths count as zero
+
+    Raises ValueError for a wildcard date, hour or minute, or a special
+    month or day such as odd months or the last day of the month, which
+    name no single moment.
+    """
+    year, month, day, _ = date
+    hour, minute, second, hundredth = time
+    if 255 in (year, month, day, hour, minute):
+        raise ValueError("reference time has unspecified fields")
+    second, hundredth = (0 if v == 255 else v for v in (second, hundredth))
+    return datetime(
+        year + 1900, month, day, hour, minute, second, hundredth * 10000
+    ).timestamp()
+
+
+def to_date_time(timestamp):
+    """
+    Returns:
+    - tuple of the BACnet date and time tuples of epoch `timestamp`
+    """
+    moment = datetime.fromtimestamp(timestamp)
+    date = (moment.year - 1900, moment.month, moment.day, moment.isoweekday())
+    time = (moment.hour, moment.minute, moment.second, moment.microsecond // 10000)
+    return date, time
+
+
+def range_arguments(range_):
+    """
+    Returns:
+    - tuple (by, reference, count) for `select_range` from the optional
+      range of a ReadRangeRequest, the same in bacpypes and bacpypes3
+    """
+    if range_ is None:
+        return None, None, None
+    if range_.byPosition is not None:
+        return "position", range_.byPosition.referenceIndex, range_.byPosition.count
+    if range_.bySequenceNumber is not None:
+        return (
+            "sequence",
+            range_.bySequenceNumber.referenceSequenceNumber,
+            range_.bySequenceNumber.count,
+        )
+    if range_.byTime is not None:
+        reference = range_.byTime.referenceTime
+        return (
+            "time",
+            to_epoch(tuple(reference.date), tuple(reference.time)),
+            range_.byTime.count,
+        )
+    return None, None, None
+
+
+class TrendSource:
+    """
+    HistoryBuffer, or one `column` of a ColumnarRing, read as the log
+    buffer of a trend log. Records are numbered from 1 in the order they
+    were appended, so sequence numbers keep counting once the ring wraps.
+    """
+
+    def __init__(self, history, column=None):
+        self.history = history
+        self.column = column
+
+    def __len__(self):
+        return len(self.history)
+
+    @property
+    def capacity(self):
+        return self.history.capacity
+
+    @property
+    def total_count(self):
+        return self.history.total_count
+
+    def read_range(self, by=None, reference=None, count=None, max_items=None):
+        """
+        Select records as `select_range`, at most `max_items` of them or
+        MAX_RANGE_ITEMS when it is None
+
+        Returns:
+        - tuple (records, first_sequence, flags), records a list of
+          (epoch seconds, float value), first_sequence the number of the
+          first record (None if there are none) and flags the ResultFlags
+          (firstItem, lastItem, moreItems)
+        """
+        n = len(self.history)
+        first_sequence = self.history.total_count - n + 1
+        timestamps = self.history.timestamps()
+        if max_items is None:
+            max_items = MAX_RANGE_ITEMS
+        start, stop, more = select_range(
+            timestamps, by, reference, count, first_sequence, max_items
+        )
+        if stop <= start:
+            return [], None, (False, False, False)
+
+        if self.column is None:
+            values = self.history.values()
+        else:
+            values = self.history.column(self.column)
+        records = list(
+            zip(timestamps[start:stop].tolist(), values[start:stop].tolist())
+        )
+        flags = (start == 0, stop == n, more)
+        return records, first_sequence + start, flags
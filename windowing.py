@@ -0,0 +1,126 @@
+"""
+Sliding window datasets for the forecasting models.
+
+Both servers train on (input window, forecast horizon) pairs cut from one
+long series. Building them with Python loops costs one iteration per
+sample and doubles peak memory, these helpers return strided views over
+the series instead and can hand out small float32 batches on demand.
+`window_dataset` does the same as a tf.data pipeline for Keras.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def window_count(length, seq_length, pred_length):
+    """
+    Returns:
+    - int number of complete (input, target) windows in a series of `length`
+    """
+    return max(0, length - seq_length - pred_length + 1)
+
+
+def sliding_windows(series, seq_length, pred_length):
+    """
+    Zero-copy (X, y) windows over a 1-D series, or a (n, 1) column.
+    Row i of X is series[i : i + seq_length] and row i of y is the
+    following `pred_length` values. Both are read-only views sharing
+    memory with `series`.
+
+    Returns:
+    - numpy arrays X of shape (n, seq_length), y of shape (n, pred_length)
+    """
+    series = np.asarray(series)
+    if series.ndim == 2 and series.shape[1] == 1:
+        series = series[:, 0]
+    if series.ndim != 1:
+        raise ValueError(f"expected a 1-D series, got shape {series.shape}")
+
+    n = window_count(len(series), seq_length, pred_length)
+    if n == 0:
+        return (
+            np.empty((0, seq_length), dtype=series.dtype),
+            np.empty((0, pred_length), dtype=series.dtype),
+        )
+
+    windows = sliding_window_view(series, seq_length + pred_length)
+    return windows[:, :seq_length], windows[:, seq_length:]
+
+
+def iter_window_batches(
+    series,
+    seq_length,
+    pred_length,
+    batch_size=64,
+    start=0,
+    stop=None,
+    dtype=np.float32,
+    shuffle=False,
+    seed=None,
+):
+    """
+    Lazily yield (X, y) batches for windows `start` to `stop`. Only one
+    batch is materialized at a time, X gets a trailing feature axis so it
+    can be fed straight to an LSTM.
+
+    Returns:
+    - generator of numpy arrays X (b, seq_length, 1), y (b, pred_length)
+    """
+    X, y = sliding_windows(series, seq_length, pred_length)
+    stop = len(X) if stop is None else min(stop, len(X))
+
+    order = np.arange(start, stop)
+    if shuffle:
+        np.random.default_rng(seed).shuffle(order)
+
+    for i in range(0, len(order), batch_size):
+        index = order[i : i + batch_size]
+        if not shuffle:
+            index = slice(index[0], index[-1] + 1)
+        yield (
+            X[index].astype(dtype, copy=False)[:, :, np.newaxis],
+            y[index].astype(dtype, copy=False),
+        )
+
+
+def window_dataset(
+    series,
+    seq_length,
+    pred_length,
+    index,
+    batch_size=64,
+    shuffle=False,
+    seed=None,
+):
+    """
+    tf.data pipeline that cuts float32 (X, y) windows out of `series` one
+    batch at a time, so only the series itself and the batches in flight
+    are ever held in memory. `index` is a range or an array of window
+    start positions, a train/validation split is two index ranges over
+    the same series rather than two copies of it.
+
+    Returns:
+    - tf.data.Dataset of X (b, seq_length, 1), y (b, pred_length)
+    """
+    import tensorflow as tf
+
+    values = tf.constant(np.asarray(series, dtype=np.float32).reshape(-1))
+    if isinstance(index, range):
+        starts = tf.data.Dataset.range(index.start, index.stop, index.step)
+    else:
+        starts = tf.data.Dataset.from_tensor_slices(np.asarray(index, dtype=np.int64))
+    if shuffle:
+        starts = starts.shuffle(
+            max(len(index), 1), seed=seed, reshuffle_each_iteration=True
+        )
+
+    offsets = tf.range(seq_length + pred_length, dtype=tf.int64)
+
+    def cut(batch_starts):
+        windows = tf.gather(values, batch_starts[:, tf.newaxis] + offsets)
+        return windows[:, :seq_length, tf.newaxis], windows[:, seq_length:]
+
+    return (
+        starts.batch(batch_size)
+        .map(cut, num_parallel_calls=tf.data.AUTOTUNE)
+        .prefetch(tf.data.AUTOTUNE)
+    )